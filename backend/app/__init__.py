@@ -1,15 +1,28 @@
 # app/__init__.py
 
-from flask import Flask
+import time
+from flask import Flask, jsonify, request, g
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_jwt_extended import JWTManager
 from flask_cors import CORS
+from .services.job_queue import JobQueue, JobQueueFull
+from .services.passwords import PasswordHasher, HasherSaturated
+from .services.identity_cache import IdentityCache
+from .services.model_router import router as model_router
+from .services.llm_governor import AdmissionRejected
+from .services.metrics import HTTP_REQUEST_SECONDS
+from .services.request_context import request_id_var, new_request_id
+from .services.logging_setup import init_logging
+from .services.database import configure_database, init_database
 
 # 全局实例化扩展（不绑定任何 app）
 db      = SQLAlchemy()    # ORM 实例
 migrate = Migrate()       # 迁移工具实例
 jwt     = JWTManager()    # JWT 管理器实例
+job_queue = JobQueue()    # 后台任务队列实例
+password_hasher = PasswordHasher()   # 密码哈希与校验（独立线程池）
+identity_cache  = IdentityCache()    # JWT 用户身份短期缓存
 
 
 def create_app(config_object: str = 'config.Config') -> Flask:
@@ -18,11 +31,18 @@ def create_app(config_object: str = 'config.Config') -> Flask:
     app = Flask(__name__)
     # 2. 加载配置
     app.config.from_object(config_object)
+    init_logging(app)
 
     # 3. 绑定并初始化扩展
+    configure_database(app)
     db.init_app(app)
+    init_database(app, db)
     migrate.init_app(app, db)
     jwt.init_app(app)
+    job_queue.init_app(app)
+    password_hasher.init_app(app)
+    identity_cache.init_app(app)
+    model_router.init_app(app)
     CORS(
         app,
         origins=app.config.get('CORS_ORIGINS', ['http://localhost:5173']),
@@ -39,10 +59,73 @@ def create_app(config_object: str = 'config.Config') -> Flask:
     from .routes.survey   import survey_bp
     from .routes.image    import image_bp
     from .routes.evaluate import evaluate_bp
+    from .routes.jobs     import jobs_bp
+    from .routes.metrics  import metrics_bp
+    from .routes.history  import history_bp
 
     app.register_blueprint(chat_bp,       url_prefix='/api/chat')
     app.register_blueprint(survey_bp,     url_prefix='/api/survey')
     app.register_blueprint(image_bp,      url_prefix='/api/image')
     app.register_blueprint(evaluate_bp,   url_prefix='/api/evaluate')
+    app.register_blueprint(jobs_bp,       url_prefix='/api/jobs')
+    app.register_blueprint(metrics_bp)
+    app.register_blueprint(history_bp,    url_prefix='/api/history')
+
+    # 6. 推理请求或密码校验未获放行时直接返回 429/503，而不是等待上游超时
+    @app.errorhandler(AdmissionRejected)
+    def handle_admission_rejected(e):
+        return jsonify({'error': str(e)}), e.status_code, {'Retry-After': str(e.retry_after)}
+
+    @app.errorhandler(JobQueueFull)
+    def handle_job_queue_full(e):
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '5'}
+
+    @app.errorhandler(HasherSaturated)
+    def handle_hasher_saturated(e):
+        return jsonify({'message': str(e)}), 503, {'Retry-After': '1'}
+
+    # 7. 请求 ID 与请求耗时
+    _init_request_tracing(app)
+
+    # 8. 命令行子命令（flask analyze-images 等）
+    from .cli import register_cli
+    register_cli(app)
+
+    # 9. 预热：默认在首次使用时才导入推理 SDK、加载模型，开启后在启动时完成
+    if app.config.get('WARMUP_ON_START'):
+        from .services.warmup import warm_up
+        warm_up()
 
     return app
+
+
+def _init_request_tracing(app: Flask) -> None:
+    """为每个请求分配 request ID（写入日志与响应头），并记录请求耗时直方图"""
+    @app.before_request
+    def start_request():
+        g.request_id = new_request_id(request.headers.get('X-Request-ID'))
+        g.request_id_token = request_id_var.set(g.request_id)
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def finish_request(response):
+        start = g.pop('request_start', None)
+        if start is not None:
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - start,
+                endpoint=request.endpoint or 'unknown',
+                method=request.method,
+                status=response.status_code
+            )
+        response.headers['X-Request-ID'] = g.get('request_id', '-')
+        return response
+
+    @app.teardown_request
+    def reset_request_id(exc):
+        token = g.pop('request_id_token', None)
+        if token is not None:
+            try:
+                request_id_var.reset(token)
+            except ValueError:
+                # 流式响应可能在其他上下文中结束，此时无需复位
+                pass
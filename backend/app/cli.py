@@ -0,0 +1,72 @@
+# app/cli.py
+
+import os
+import sys
+import json
+import time
+import click
+
+
+def register_cli(app) -> None:
+    """注册 flask 命令行子命令"""
+
+    @app.cli.command('analyze-images')
+    @click.argument('directory', required=False, type=click.Path(exists=True, file_okay=False))
+    @click.option('-o', '--output', type=click.File('w', encoding='utf-8'), default='-',
+                  help='JSON Lines 结果输出文件，默认标准输出')
+    @click.option('--concurrency', type=int, default=None, help='同时进行的模型调用数')
+    @click.option('--workers', type=int, default=None, help='并行解码/预处理的线程数')
+    @click.option('--limit', type=int, default=None, help='最多处理的图片数')
+    @click.option('--no-recursive', is_flag=True, help='不处理子目录')
+    def analyze_images(directory, output, concurrency, workers, limit, no_recursive):
+        """批量分析目录中的图片（默认为已保存的全部原图），每完成一张输出一行 JSON。"""
+        from app.services.bulk_analysis import BulkAnalyzer, iter_directory
+        from app.services.storage import UPLOAD_FOLDER, ORIGINALS
+
+        directory = directory or os.path.join(UPLOAD_FOLDER, ORIGINALS)
+        analyzer = BulkAnalyzer(prepare_workers=workers, llm_concurrency=concurrency, max_files=limit)
+        counts = {}
+        started = time.perf_counter()
+        for record in analyzer.run(iter_directory(directory, recursive=not no_recursive)):
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            output.flush()
+            counts[record['status']] = counts.get(record['status'], 0) + 1
+        elapsed = time.perf_counter() - started
+        summary = '，'.join(f"{k} {v}" for k, v in sorted(counts.items())) or '没有找到图片'
+        click.echo(f"完成：{summary}，耗时 {elapsed:.1f}s", file=sys.stderr)
+
+    @app.cli.command('import-uploads')
+    @click.argument('directory', required=False, type=click.Path(exists=True, file_okay=False))
+    @click.option('--delete', is_flag=True, help='导入成功后删除原文件')
+    def import_uploads(directory, delete):
+        """将旧版平铺在上传目录中的图片导入内容寻址存储（相同内容只保留一份）。"""
+        from app.services.bulk_analysis import IMAGE_EXTENSIONS
+        from app.services.storage import UPLOAD_FOLDER, save_original
+
+        directory = directory or UPLOAD_FOLDER
+        imported = failed = 0
+        for entry in sorted(os.scandir(directory), key=lambda e: e.name):
+            if not entry.is_file() or os.path.splitext(entry.name)[1][1:].lower() not in IMAGE_EXTENSIONS:
+                continue
+            try:
+                with open(entry.path, 'rb') as f:
+                    image = save_original(f.read(), entry.name)
+            except ValueError as e:
+                failed += 1
+                click.echo(f"跳过 {entry.name}: {e}", file=sys.stderr)
+                continue
+            imported += 1
+            click.echo(f"{entry.name} -> {image.sha256}")
+            if delete:
+                os.remove(entry.path)
+        click.echo(f"导入 {imported} 张，失败 {failed} 张", file=sys.stderr)
+
+    @app.cli.command('backfill-trends')
+    @click.option('--batch-size', type=int, default=5000, help='每批读取的问卷记录数')
+    def backfill_trends(batch_size):
+        """由已保存的问卷历史重建全部趋势汇总。"""
+        from app.services.analytics import backfill
+
+        started = time.perf_counter()
+        total = backfill(batch_size=batch_size)
+        click.echo(f"已重建 {total} 条问卷的趋势汇总，耗时 {time.perf_counter() - started:.1f}s", file=sys.stderr)
@@ -1,25 +1,26 @@
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
 from . import db
 
 class User(db.Model):
     __tablename__ = 'users'
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    password_hash = db.Column(db.String(128), nullable=False)
+    password_hash = db.Column(db.String(255), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     def set_password(self, password: str) -> None:
         """
         Hashes the given plaintext password and stores it.
         """
-        self.password_hash = generate_password_hash(password)
+        from app import password_hasher
+        self.password_hash = password_hasher.hash(password)
 
     def check_password(self, password: str) -> bool:
         """
         Verifies a plaintext password against the stored hash.
         """
-        return check_password_hash(self.password_hash, password)
+        from app import password_hasher
+        return password_hasher.verify(self.password_hash, password)
 
     def to_dict(self) -> dict:
         """
@@ -30,3 +31,158 @@ class User(db.Model):
             'email': self.email,
             'created_at': self.created_at.isoformat()
         }
+
+
+class StoredImage(db.Model):
+    """
+    上传的原始图片，按内容 SHA-256 去重；文件保存在 storage.ContentStore 的 originals 命名空间。
+    """
+    __tablename__ = 'stored_images'
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), unique=True, nullable=False)
+    ext = db.Column(db.String(8), nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
+    original_name = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    variants = db.relationship('ImageVariant', backref='image', lazy='dynamic', cascade='all, delete-orphan')
+
+    def to_dict(self) -> dict:
+        return {
+            'id': self.id,
+            'sha256': self.sha256,
+            'ext': self.ext,
+            'size': self.size,
+            'width': self.width,
+            'height': self.height,
+            'original_name': self.original_name,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+
+class ImageVariant(db.Model):
+    """
+    原图的派生结果（预处理后的缩略图、人脸裁剪、线稿特征等）。
+    同一原图、同一类别、同一流程版本只保存一份；有文件时按内容保存在 variants 命名空间，
+    纯数据结果（如线稿特征）只存 meta。
+    """
+    __tablename__ = 'image_variants'
+    __table_args__ = (db.UniqueConstraint('image_id', 'kind', 'version', name='uq_image_variant'),)
+    id = db.Column(db.Integer, primary_key=True)
+    image_id = db.Column(db.Integer, db.ForeignKey('stored_images.id', ondelete='CASCADE'), nullable=False)
+    kind = db.Column(db.String(32), nullable=False)
+    version = db.Column(db.String(16), nullable=False)
+    sha256 = db.Column(db.String(64))
+    ext = db.Column(db.String(8))
+    meta = db.Column(db.JSON)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class Assessment(db.Model):
+    """
+    评估历史的公共索引行：问卷、图片分析、综合评估各一条，明细在对应的 1:1 表中。
+    登录用户按 user_id 归属，未登录用户按会话中的 anon_id 归属；
+    (归属, created_at, id) 上的联合索引支撑按时间倒序的游标分页。
+    """
+    __tablename__ = 'assessments'
+    __table_args__ = (
+        db.Index('ix_assessments_user_created', 'user_id', 'created_at', 'id'),
+        db.Index('ix_assessments_anon_created', 'anon_id', 'created_at', 'id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'))
+    anon_id = db.Column(db.String(32))
+    kind = db.Column(db.String(16), nullable=False)      # survey / image / evaluation
+    score = db.Column(db.Float)
+    risk_level = db.Column(db.String(16))
+    emotion = db.Column(db.String(32))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    survey = db.relationship('SurveyResponse', uselist=False, backref='assessment',
+                             cascade='all, delete-orphan')
+    image_analysis = db.relationship('ImageAnalysis', uselist=False, backref='assessment',
+                                     cascade='all, delete-orphan')
+    evaluation = db.relationship('EvaluationReport', uselist=False, backref='assessment',
+                                 cascade='all, delete-orphan')
+
+
+class Questionnaire(db.Model):
+    """问卷题目按内容哈希去重保存，每次提交只引用其 id"""
+    __tablename__ = 'questionnaires'
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), unique=True, nullable=False)
+    question_count = db.Column(db.Integer, nullable=False)
+    questions = db.Column(db.JSON, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class SurveyResponse(db.Model):
+    """
+    一次问卷提交：回答向量按每题 2 位打包（0-3 四档），
+    100 道题只占 25 字节；结果 JSON 保存模型返回的完整评估。
+    """
+    __tablename__ = 'survey_responses'
+    assessment_id = db.Column(db.Integer, db.ForeignKey('assessments.id', ondelete='CASCADE'), primary_key=True)
+    questionnaire_id = db.Column(db.Integer, db.ForeignKey('questionnaires.id'), nullable=False)
+    responses = db.Column(db.LargeBinary, nullable=False)
+    response_count = db.Column(db.Integer, nullable=False)
+    age_group = db.Column(db.String(16))
+    gender = db.Column(db.String(16))
+    result = db.Column(db.JSON)
+
+    questionnaire = db.relationship('Questionnaire')
+
+
+class ImageAnalysis(db.Model):
+    """一次图片分析的结果，image_id 指向内容寻址存储中的原图"""
+    __tablename__ = 'image_analyses'
+    assessment_id = db.Column(db.Integer, db.ForeignKey('assessments.id', ondelete='CASCADE'), primary_key=True)
+    image_id = db.Column(db.Integer, db.ForeignKey('stored_images.id', ondelete='SET NULL'))
+    analysis = db.Column(db.Text)
+
+
+class EvaluationReport(db.Model):
+    """一次综合评估（文本 + 问卷 + 绘图）生成的报告"""
+    __tablename__ = 'evaluation_reports'
+    assessment_id = db.Column(db.Integer, db.ForeignKey('assessments.id', ondelete='CASCADE'), primary_key=True)
+    age_group = db.Column(db.String(16))
+    gender = db.Column(db.String(16))
+    text_input = db.Column(db.Text)
+    report = db.Column(db.Text)
+
+
+class SurveyAggregate(db.Model):
+    """
+    每个归属（用户或匿名会话）一行的问卷趋势汇总，随每次提交增量更新（见 services.analytics）。
+    全量斜率由 n、Σy、Σxy、Σy² 推出（x 为提交序号），recent 保存最近若干次的
+    [时间, 分数, 风险等级]，读取趋势只需这一行。
+    """
+    __tablename__ = 'survey_aggregates'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), unique=True)
+    anon_id = db.Column(db.String(32), unique=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    score_sum = db.Column(db.Float, nullable=False, default=0.0)
+    score_sq_sum = db.Column(db.Float, nullable=False, default=0.0)
+    score_xy_sum = db.Column(db.Float, nullable=False, default=0.0)
+    ewma = db.Column(db.Float)
+    recent = db.Column(db.JSON)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    questions = db.relationship('SurveyQuestionAggregate', backref='aggregate', lazy='select',
+                                cascade='all, delete-orphan')
+
+
+class SurveyQuestionAggregate(db.Model):
+    """某归属在某份问卷上每道题的回答累计和，平均值 = sums / count"""
+    __tablename__ = 'survey_question_aggregates'
+    __table_args__ = (db.UniqueConstraint('aggregate_id', 'questionnaire_id', name='uq_question_aggregate'),)
+    id = db.Column(db.Integer, primary_key=True)
+    aggregate_id = db.Column(db.Integer, db.ForeignKey('survey_aggregates.id', ondelete='CASCADE'), nullable=False)
+    questionnaire_id = db.Column(db.Integer, db.ForeignKey('questionnaires.id'), nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    sums = db.Column(db.JSON, nullable=False)
+
+    questionnaire = db.relationship('Questionnaire')
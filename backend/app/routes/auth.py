@@ -6,8 +6,7 @@ from flask_jwt_extended import (
     jwt_required,
     get_jwt_identity
 )
-from werkzeug.security import generate_password_hash, check_password_hash
-from app import db
+from app import db, password_hasher, identity_cache
 from app.models import User
 
 # 1. 定义 Blueprint
@@ -28,7 +27,7 @@ def register():
 
     # 创建并保存用户
     new_user = User(email=email)
-    new_user.password_hash = generate_password_hash(password)
+    new_user.password_hash = password_hasher.hash(password)
     db.session.add(new_user)
     db.session.commit()
 
@@ -44,9 +43,14 @@ def login():
         return jsonify({'message': '邮箱和密码为必填项'}), 400
 
     user = User.query.filter_by(email=email).first()
-    if user and check_password_hash(user.password_hash, password):
+    # 哈希校验在独立线程池中执行，排队已满时抛出 HasherSaturated（返回 503）
+    if user and password_hasher.verify_and_update(user, password):
+        if db.session.is_modified(user):
+            # 哈希参数已更新为当前配置
+            db.session.commit()
         # 生成访问令牌
-        access_token = create_access_token(identity=user.id)
+        # JWT 的 sub 必须是字符串（PyJWT 2.10 起会校验），取用时再转回整数
+        access_token = create_access_token(identity=str(user.id))
         return jsonify({'token': access_token}), 200
 
     return jsonify({'message': '邮箱或密码错误'}), 401
@@ -55,12 +59,14 @@ def login():
 @jwt_required()
 def me():
     # 从令牌中获取用户 ID
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
-    if not user:
-        return jsonify({'message': '用户未找到'}), 404
+    user_id = int(get_jwt_identity())
+    # 短期缓存命中时不查询数据库
+    identity = identity_cache.get(user_id)
+    if identity is None:
+        user = db.session.get(User, user_id)
+        if not user:
+            return jsonify({'message': '用户未找到'}), 404
+        identity = {'id': user.id, 'email': user.email}
+        identity_cache.set(user_id, identity)
 
-    return jsonify({
-        'id': user.id,
-        'email': user.email
-    }), 200
+    return jsonify(identity), 200
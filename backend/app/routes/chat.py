@@ -1,5 +1,6 @@
 from flask import Blueprint, request, jsonify, session
 from app.services.chat_logic import process_chat
+from app.services.llm_governor import AdmissionRejected
 
 chat_bp = Blueprint('chat', __name__)
 
@@ -34,6 +35,8 @@ def handle_chat():
         session['chat_history'].append({"role": "assistant", "content": ai_reply})
         session.modified = True
         return jsonify({'reply': ai_reply})
+    except AdmissionRejected:
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -61,5 +64,7 @@ def handle_assessment():
         instruction = "请对以下对话内容进行心理健康分析，识别潜在的心理风险因素，并提供专业建议。"
         ai_reply = process_chat(session['chat_history'], instruction=instruction)
         return jsonify({'assessment': ai_reply})
+    except AdmissionRejected:
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500
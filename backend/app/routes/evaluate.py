@@ -1,8 +1,14 @@
 import os
 import base64
 import json
-from flask import Blueprint, request, jsonify
-from app.services.evaluate_logic import evaluate_all, analyze_image
+import tempfile
+from flask import Blueprint, request, jsonify, Response, stream_with_context
+from app import job_queue
+from app.services.evaluate_logic import evaluate_all, evaluate_sections, analyze_image
+from app.services.job_queue import report_progress
+from app.services.llm_governor import AdmissionRejected
+from app.services.metrics import span
+from app.services import history
 
 evaluate_bp = Blueprint('evaluate', __name__, url_prefix='/api/evaluate')
 
@@ -23,53 +29,126 @@ def evaluate():
         if not data:
             return jsonify({"error": "无效的 JSON 请求"}), 400
 
-        # 基本字段
-        age_group = data.get('ageGroup', None)
-        gender    = data.get('gender', None)
-        text_input    = data.get('text', '')
-        questions_data = data.get('questions', [])
-        survey_answers = data.get('responses', [])
-
-        # 处理 Base64 绘图（可接受 data URL 或纯 base64）
-        drawing_data = data.get('drawing')
-        image_analysis = None
-        if drawing_data:
-            # 如果是 data URL 格式，去除前缀
-            if drawing_data.startswith('data:'):
-                _, b64 = drawing_data.split(',', 1)
-            else:
-                b64 = drawing_data
+        result_text = run_evaluation(data, history.current_owner())
+        return jsonify({"result": result_text}), 200
+
+    except AdmissionRejected:
+        raise
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@evaluate_bp.route('/async', methods=['POST'], strict_slashes=False)
+def evaluate_async():
+    """
+    与 /api/evaluate 接收相同的 JSON，但立即返回任务 ID（202），
+    评估在后台执行；通过 /api/jobs/<id> 轮询或 /api/jobs/<id>/events 订阅结果。
+    """
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({"error": "无效的 JSON 请求"}), 400
+
+    owner = history.current_owner()
+    job = job_queue.submit('evaluate', run_evaluation, data, owner, owner=owner)
+    return jsonify({
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/api/jobs/{job.id}",
+        "events_url": f"/api/jobs/{job.id}/events"
+    }), 202
+
+
+@evaluate_bp.route('/stream', methods=['POST'])
+def evaluate_stream():
+    """
+    与 /api/evaluate 接收相同的 JSON，以 JSON Lines 流式返回分段报告：
+    五个部分由本地模型同时起草，每完成一段即输出一行；低置信度段落随后由云端模型修订并再输出一行，
+    最后一行为 {"type": "done", "report": 完整报告}。查询参数 refine=0 时不修订。
+    """
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({"error": "无效的 JSON 请求"}), 400
+    refine = request.args.get('refine', type=lambda v: v != '0')
+    owner = history.current_owner()
+
+    def stream():
+        try:
+            inputs = prepare_inputs(data)
+        except Exception as e:
+            yield json.dumps({"type": "error", "error": str(e)}, ensure_ascii=False) + "\n"
+            return
+        for event in evaluate_sections(**inputs, refine=refine):
+            if event['type'] == 'done' and owner is not None:
+                history.try_record(history.record_evaluation, owner, event['report'],
+                                   age_group=inputs['age_group'], gender=inputs['gender'],
+                                   text_input=inputs['text_input'])
+            yield json.dumps(event, ensure_ascii=False) + "\n"
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(stream()), mimetype='application/x-ndjson', headers=headers)
+
+
+def run_evaluation(data: dict, owner=None) -> str:
+    """同步与异步评估共用的执行流程，返回评估报告文本；指定 owner 时写入其评估历史"""
+    inputs = prepare_inputs(data)
+
+    # 调用综合评估逻辑
+    report_progress(50, '正在生成评估报告')
+    report = evaluate_all(**inputs)
+    if owner is not None:
+        history.try_record(history.record_evaluation, owner, report,
+                           age_group=inputs['age_group'], gender=inputs['gender'],
+                           text_input=inputs['text_input'])
+    return report
+
+
+def prepare_inputs(data: dict) -> dict:
+    """解析请求字段并完成绘图分析，返回 evaluate_all / evaluate_sections 的关键字参数"""
+    # 基本字段
+    age_group = data.get('ageGroup', None)
+    gender    = data.get('gender', None)
+    text_input    = data.get('text', '')
+    questions_data = data.get('questions', [])
+    survey_answers = data.get('responses', [])
+
+    # 处理 Base64 绘图（可接受 data URL 或纯 base64）
+    drawing_data = data.get('drawing')
+    image_analysis = None
+    if drawing_data:
+        report_progress(10, '正在分析绘图')
+        # 如果是 data URL 格式，去除前缀
+        if drawing_data.startswith('data:'):
+            _, b64 = drawing_data.split(',', 1)
+        else:
+            b64 = drawing_data
+        with span('decode', source='base64'):
             img_bytes = base64.b64decode(b64)
 
-            # 临时保存文件以供 analyze_image 使用
-            save_dir = os.getenv('TEMP_IMAGE_DIR', '/tmp')
-            os.makedirs(save_dir, exist_ok=True)
-            tmp_path = os.path.join(save_dir, 'drawing.png')
-            with open(tmp_path, 'wb') as f:
-                f.write(img_bytes)
+        # 临时保存文件以供 analyze_image 使用（并发任务各用独立文件）
+        save_dir = os.getenv('TEMP_IMAGE_DIR', '/tmp')
+        os.makedirs(save_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='drawing_', suffix='.png', dir=save_dir)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(img_bytes)
 
+        try:
             img_result = analyze_image(tmp_path)
-            if isinstance(img_result, dict):
-                image_analysis = json.dumps(img_result, ensure_ascii=False)
-            else:
-                image_analysis = str(img_result)
-
+        finally:
             try:
                 os.remove(tmp_path)
             except OSError:
                 pass
 
-        # 调用综合评估逻辑
-        result_text = evaluate_all(
-            text_input,
-            survey_answers,
-            image_analysis,
-            questions_data,
-            age_group,
-            gender
-        )
-
-        return jsonify({"result": result_text}), 200
+        if isinstance(img_result, dict):
+            image_analysis = json.dumps(img_result, ensure_ascii=False)
+        else:
+            image_analysis = str(img_result)
 
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    return {
+        'text_input': text_input,
+        'questions': questions_data,
+        'survey_answers': survey_answers,
+        'image_analysis': image_analysis,
+        'age_group': age_group,
+        'gender': gender,
+    }
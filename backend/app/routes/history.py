@@ -0,0 +1,43 @@
+# app/routes/history.py
+
+from flask import Blueprint, request, jsonify
+from app.services import history, analytics
+
+history_bp = Blueprint('history', __name__, url_prefix='/api/history')
+
+
+@history_bp.route('', methods=['GET'], strict_slashes=False)
+def list_history():
+    """
+    当前用户（登录用户或匿名会话）的评估历史，按时间倒序游标分页：
+      - kind：survey / image / evaluation，不传则返回全部
+      - limit：每页条数（默认 20，最多 100）
+      - cursor：上一页返回的 next_cursor
+    """
+    kind = request.args.get('kind')
+    if kind and kind not in history.KINDS:
+        return jsonify({'error': f'kind 只能是 {", ".join(history.KINDS)}'}), 400
+    try:
+        rows, next_cursor = history.list_history(
+            history.current_owner(), kind=kind,
+            limit=request.args.get('limit', history.DEFAULT_PAGE_SIZE, type=int),
+            cursor=request.args.get('cursor')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'items': [history.to_dict(row) for row in rows], 'next_cursor': next_cursor}), 200
+
+
+@history_bp.route('/trends', methods=['GET'])
+def trends():
+    """问卷分数趋势（全量与近期统计、分数序列、风险等级、各题平均分），读取预先维护的汇总"""
+    return jsonify(analytics.get_trends(history.current_owner())), 200
+
+
+@history_bp.route('/<int:assessment_id>', methods=['GET'])
+def get_assessment(assessment_id: int):
+    """单条评估的明细"""
+    assessment = history.get_assessment(history.current_owner(), assessment_id)
+    if assessment is None:
+        return jsonify({'error': '记录不存在'}), 404
+    return jsonify(history.to_dict(assessment, detail=True)), 200
@@ -1,39 +1,41 @@
-from flask import Blueprint, request, jsonify, current_app
-from werkzeug.utils import secure_filename
-import os, time, base64, io
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
+import base64, io, json, shutil, tempfile
 from PIL import Image
 import cv2
-import numpy as np
-from ..services.image_logic import analyze_image
+from app import job_queue
+from ..services.image_logic import analyze_image, analyze_drawing_features
+from ..services.drawing_features import (
+    DRAWING_FAST_PATH, IMAGE_ANALYSIS_PATH, is_line_drawing, extract_features
+)
+from ..services.emotion_classifier import classify_face, enabled as classifier_enabled
+from ..services.bulk_analysis import BulkAnalyzer, BulkItem, iter_zip, BULK_LLM_CONCURRENCY
+from ..services.job_queue import report_progress
+from ..services.image_preprocess import preprocess_pool, PreprocessPoolSaturated, read_image
+from ..services.llm_governor import AdmissionRejected
+from ..services import storage, history
+from .. import db
+from ..models import StoredImage
+from ..services.metrics import span
 
 # Blueprint 注册，前缀为 /api/image
 image_bp = Blueprint('image', __name__, url_prefix='/api/image')
 
-# 上传文件存储目录 & 支持的后缀
-UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', 'uploads')
+# 支持的后缀（文件存储见 services.storage）
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
-# 确保目录存在
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 def allowed_file(filename: str) -> bool:
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def compress_image(image_path, max_size_kb=1):
-    """
-    压缩图像以确保其大小不超过指定的最大值（以KB为单位）。
-    """
-    img = Image.open(image_path)
-    img_format = img.format
-    quality = 85
-    while True:
-        buffer = io.BytesIO()
-        img.save(buffer, format=img_format, quality=quality)
-        size_kb = buffer.tell() / 1024
-        if size_kb <= max_size_kb or quality <= 20:
-            break
-        quality -= 5
-    buffer.seek(0)
-    return buffer
+def thumbnail_bytes(img_bgr, ext='png', max_dimensions=(192, 192)) -> bytes:
+    """将 BGR 图像缩放到 max_dimensions 以内，按 ext 编码为 PNG 或 JPEG"""
+    img_pil = Image.fromarray(cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB))
+    img_pil.thumbnail(max_dimensions, Image.Resampling.LANCZOS)
+    buffer = io.BytesIO()
+    if ext == 'jpg':
+        img_pil.save(buffer, format='JPEG', quality=90)
+    else:
+        img_pil.save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue()
 
 @image_bp.route('/upload', methods=['POST'])
 def upload_image():
@@ -44,83 +46,214 @@ def upload_image():
     同时添加图像预处理：对比度增强、去噪、人脸检测与裁剪。
     """
     try:
-        # 1. 文件流上传
-        if 'file' in request.files:
-            file = request.files['file']
-            if file.filename == '':
-                return jsonify({'error': '未选择文件'}), 400
-            if not allowed_file(file.filename):
-                return jsonify({'error': '不支持的文件类型'}), 415
-
-            filename = secure_filename(file.filename)
-            filepath = os.path.join(UPLOAD_FOLDER, filename)
-            file.save(filepath)
-
-        # 2. Base64 字符串上传
-        elif request.form.get('image'):
-            b64data = request.form['image']
-            # 去除可能的 data URI 前缀
-            if ',' in b64data:
-                b64data = b64data.split(',', 1)[1]
-            raw = base64.b64decode(b64data)
-            img = Image.open(io.BytesIO(raw))
-            filename = f'drawing_{int(time.time())}.png'
-            filepath = os.path.join(UPLOAD_FOLDER, filename)
-            img.save(filepath)
+        image, error = save_upload()
+        if error:
+            return error
 
-        else:
-            return jsonify({'error': '未检测到上传数据'}), 400
+        result = process_upload(image.id, history.current_owner())
+
+        # 7. 返回评估结果
+        return jsonify({'message': '上传成功', 'image': image.sha256, 'result': result}), 200
+
+    except PreprocessPoolSaturated as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '2'}
+
+    except AdmissionRejected:
+        raise
+
+    except Exception as e:
+        # 记录异常堆栈，便于排查
+        current_app.logger.exception('上传或评估失败')
+        return jsonify({'error': '服务器内部错误，请稍后重试'}), 500
+
+
+@image_bp.route('/upload/async', methods=['POST'])
+def upload_image_async():
+    """
+    与 /upload 接收相同的数据，保存文件后立即返回任务 ID（202），
+    预处理与模型分析在后台执行；通过 /api/jobs/<id> 获取结果。
+    """
+    try:
+        image, error = save_upload()
+        if error:
+            return error
+    except Exception:
+        current_app.logger.exception('上传失败')
+        return jsonify({'error': '服务器内部错误，请稍后重试'}), 500
+
+    owner = history.current_owner()
+    job = job_queue.submit('image', process_upload, image.id, owner, owner=owner)
+    return jsonify({
+        'message': '上传成功，正在分析',
+        'image': image.sha256,
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': f'/api/jobs/{job.id}',
+        'events_url': f'/api/jobs/{job.id}/events'
+    }), 202
+
+
+@image_bp.route('/bulk', methods=['POST'])
+def upload_bulk():
+    """
+    批量分析：接收多个 files 字段（图片或 zip 压缩包），以 JSON Lines 流式返回，
+    每张图片分析完成即输出一行（按完成顺序，内容相同的图片只分析一次）。
+    可选参数 concurrency 限制同时进行的模型调用数（不超过 BULK_LLM_CONCURRENCY）。
+    """
+    # 批量上传单独放宽请求体上限（超出时返回 413）
+    request.max_content_length = current_app.config.get('BULK_MAX_REQUEST_BYTES')
+    files = [f for f in request.files.getlist('files') + request.files.getlist('file') if f.filename]
+    if not files:
+        return jsonify({'error': '未检测到上传数据'}), 400
+    for f in files:
+        if not (allowed_file(f.filename) or f.filename.lower().endswith('.zip')):
+            return jsonify({'error': f'不支持的文件类型: {f.filename}'}), 415
+    concurrency = min(request.args.get('concurrency', BULK_LLM_CONCURRENCY, type=int), BULK_LLM_CONCURRENCY)
+    # 上传文件对象可能在视图返回后被关闭：返回流式响应前转存到临时文件（较大的落盘，不整体读入内存），
+    # 压缩包成员在处理时才从临时文件中解压
+    uploads = []
+    for f in files:
+        spooled = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+        shutil.copyfileobj(f.stream, spooled)
+        spooled.seek(0)
+        uploads.append((f.filename, spooled))
+
+    def read_all(spooled):
+        spooled.seek(0)
+        return spooled.read()
+
+    def items():
+        for filename, spooled in uploads:
+            if filename.lower().endswith('.zip'):
+                yield from iter_zip(spooled, prefix=f"{filename}/")
+            else:
+                yield BulkItem(filename, lambda s=spooled: read_all(s))
+
+    def stream():
+        try:
+            for record in BulkAnalyzer(llm_concurrency=max(1, concurrency)).run(items()):
+                yield json.dumps(record, ensure_ascii=False) + "\n"
+        finally:
+            for _, spooled in uploads:
+                spooled.close()
 
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(stream()), mimetype='application/x-ndjson', headers=headers)
+
+
+@image_bp.route('/pool', methods=['GET'])
+def pool_stats():
+    """返回预处理进程池的队列深度与服务耗时"""
+    return jsonify(preprocess_pool.stats()), 200
+
+
+def save_upload():
+    """
+    从请求中取出图片并写入内容寻址存储（相同内容只保存一份）。
+    返回 (StoredImage, None)；请求不合法时返回 (None, 错误响应)。
+    """
+    # 1. 文件流上传
+    if 'file' in request.files:
+        file = request.files['file']
+        if file.filename == '':
+            return None, (jsonify({'error': '未选择文件'}), 400)
+        if not allowed_file(file.filename):
+            return None, (jsonify({'error': '不支持的文件类型'}), 415)
+        name = file.filename
+        with span('decode', source='file'):
+            raw = file.read()
+
+    # 2. Base64 字符串上传
+    elif request.form.get('image'):
+        b64data = request.form['image']
+        # 去除可能的 data URI 前缀
+        if ',' in b64data:
+            b64data = b64data.split(',', 1)[1]
+        name = 'drawing.png'
+        with span('decode', source='base64'):
+            try:
+                raw = base64.b64decode(b64data)
+            except ValueError:
+                return None, (jsonify({'error': '图片数据不是有效的 Base64'}), 400)
+
+    else:
+        return None, (jsonify({'error': '未检测到上传数据'}), 400)
+
+    try:
+        with span('storage', step='save_original'):
+            image = storage.save_original(raw, name)
+    except ValueError as e:
+        return None, (jsonify({'error': str(e)}), 400)
+    return image, None
+
+
+def process_upload(image_id: int, owner=None) -> dict:
+    """
+    对已保存的图片执行预处理与模型分析，返回分析结果；
+    指定 owner（history.Owner）时将结果写入其评估历史。
+    """
+    image = db.session.get(StoredImage, image_id)
+    result = analyze_stored_image(image)
+    if owner is not None:
+        history.try_record(history.record_image_analysis, owner, image.id, result)
+    return result
+
+
+def analyze_stored_image(image: StoredImage) -> dict:
+    """
+    预处理结果（线稿特征、人脸裁剪、缩略图）作为变体保存，同一张图片再次分析时直接复用。
+    """
+    filepath = storage.original_path(image)
+    report_progress(10, '正在预处理图像')
+
+    # 线稿特征已提取过：直接走快速通道
+    features = storage.get_variant(image, 'drawing_features')
+    if features is not None:
+        return _analyze_drawing(features.meta)
+
+    thumbnail = storage.get_variant(image, 'thumbnail')
+    face = storage.get_variant(image, 'face') if thumbnail is not None else None
+    if thumbnail is None:
         # --- 图像预处理流程 ---
-        # 读取图像
-        img_cv = cv2.imread(filepath)
+        with span('preprocess', step='read'):
+            img_cv = read_image(filepath)
         if img_cv is None:
             current_app.logger.error(f"无法读取图像文件: {filepath}")
+        elif DRAWING_FAST_PATH and is_line_drawing(img_cv):
+            # 画布线稿：跳过照片增强与像素上传，只发送本地提取的绘画特征
+            with span('preprocess', step='drawing_features'):
+                features = extract_features(img_cv)
+            storage.save_variant(image, 'drawing_features', meta=features)
+            return _analyze_drawing(features)
         else:
-            # 1. 转 LAB 做 CLAHE 均衡化
-            lab = cv2.cvtColor(img_cv, cv2.COLOR_BGR2LAB)
-            l_channel, a_channel, b_channel = cv2.split(lab)
-            clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-            cl = clahe.apply(l_channel)
-            merged_lab = cv2.merge((cl, a_channel, b_channel))
-            img_clahe = cv2.cvtColor(merged_lab, cv2.COLOR_LAB2BGR)
-
-            # 2. 去噪
-            img_denoised = cv2.fastNlMeansDenoisingColored(
-                img_clahe, None, h=10, hColor=10, templateWindowSize=7, searchWindowSize=21
-            )
-
-            # 3. 人脸检测与裁剪（可选）
-            face_cascade = cv2.CascadeClassifier(
-                cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
-            )
-            gray = cv2.cvtColor(img_denoised, cv2.COLOR_BGR2GRAY)
-            faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5)
-            if len(faces) > 0:
-                x, y, w, h = faces[0]
-                img_processed = img_denoised[y:y+h, x:x+w]
-            else:
-                img_processed = img_denoised
+            # 1-3. CLAHE 均衡化、去噪、人脸检测与裁剪（在独立进程池中执行）
+            img_processed, face_found = preprocess_pool.run(img_cv)
+            ext = 'jpg' if image.ext == 'jpg' else 'png'
+            if face_found:
+                with span('storage', step='save_variant'):
+                    face = storage.save_variant(image, 'face', cv2.imencode('.png', img_processed)[1].tobytes(), 'png')
 
             # 4. 调整图像尺寸
-            max_dimensions = (192, 192)
-            img_pil = Image.fromarray(cv2.cvtColor(img_processed, cv2.COLOR_BGR2RGB))
-            img_pil.thumbnail(max_dimensions, Image.Resampling.LANCZOS)
-            img_pil.save(filepath)
+            with span('preprocess', step='thumbnail'):
+                data = thumbnail_bytes(img_processed, ext)
+            with span('storage', step='save_variant'):
+                thumbnail = storage.save_variant(image, 'thumbnail', data, ext, meta={'face_found': face_found})
 
-        # 5. 压缩图像
-        compressed_buffer = compress_image(filepath, max_size_kb=100)
-        compressed_image = Image.open(compressed_buffer)
-        compressed_image.save(filepath)
+    # 5. 裁剪到人脸时先用本地模型分类（未配置模型时为 None）
+    prediction = None
+    if face is not None and classifier_enabled():
+        prediction = classify_face(cv2.imread(storage.variant_path(face)))
 
-        # 6. 调用图像分析逻辑
-        result = analyze_image(filepath)
-        current_app.logger.debug("分析结果 = %r", result)
+    # 6. 调用图像分析逻辑（缩略图缺失时如 GIF，直接使用原图）
+    IMAGE_ANALYSIS_PATH.inc(path='pixels')
+    report_progress(40, '正在进行模型分析')
+    source = storage.variant_path(thumbnail) if thumbnail is not None else filepath
+    result = analyze_image(source, prediction=prediction)
+    current_app.logger.debug("分析结果 = %r", result)
+    return result
 
-        # 7. 返回评估结果
-        return jsonify({'message': '上传成功', 'result': result}), 200
 
-    except Exception as e:
-        # 记录异常堆栈，便于排查
-        current_app.logger.exception('上传或评估失败')
-        return jsonify({'error': '服务器内部错误，请稍后重试'}), 500
+def _analyze_drawing(features: dict) -> dict:
+    IMAGE_ANALYSIS_PATH.inc(path='drawing_features')
+    report_progress(40, '正在进行模型分析')
+    return analyze_drawing_features(features)
@@ -0,0 +1,54 @@
+# app/routes/jobs.py
+
+import json
+from flask import Blueprint, jsonify, Response
+from app import job_queue
+from app.services import history
+
+jobs_bp = Blueprint('jobs', __name__, url_prefix='/api/jobs')
+
+
+def _get_own_job(job_id):
+    """只返回当前用户（或匿名会话）提交的任务；他人的任务与不存在一样返回 None"""
+    job = job_queue.get(job_id)
+    if job is None or (job.owner is not None and job.owner != history.current_owner()):
+        return None
+    return job
+
+
+@jobs_bp.route('/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """轮询任务状态；完成后包含 result 或 error"""
+    job = _get_own_job(job_id)
+    if job is None:
+        return jsonify({'error': '任务不存在或已过期'}), 404
+    return jsonify(job.to_dict()), 200
+
+
+@jobs_bp.route('/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """
+    以 SSE 推送任务进度：
+      - event: progress  状态或进度变化
+      - event: done      任务结束（成功或失败），随后关闭连接
+    空闲期间每 15 秒发送一次注释行保活，避免被代理断开。
+    """
+    job = _get_own_job(job_id)
+    if job is None:
+        return jsonify({'error': '任务不存在或已过期'}), 404
+
+    def stream():
+        version = -1
+        while True:
+            if job.version > version:
+                version = job.version
+                event = 'done' if job.done else 'progress'
+                payload = json.dumps(job.to_dict(), ensure_ascii=False)
+                yield f"event: {event}\ndata: {payload}\n\n"
+                if job.done:
+                    return
+            elif not job_queue.wait_for_update(job, version):
+                yield ": keep-alive\n\n"
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream(), mimetype='text/event-stream', headers=headers)
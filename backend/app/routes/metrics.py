@@ -0,0 +1,19 @@
+# app/routes/metrics.py
+
+from flask import Blueprint, Response, jsonify
+from app.services.metrics import registry
+from app.services.model_router import router
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def export_metrics():
+    """以 Prometheus 文本格式导出全部指标"""
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+@metrics_bp.route('/metrics/routing', methods=['GET'])
+def routing_state():
+    """当前生效的推理路由策略，以及各 (后端, 接口) 的耗时、是否已切走与本小时 token 用量"""
+    return jsonify(router.state())
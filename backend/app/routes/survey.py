@@ -1,6 +1,7 @@
 # app/routes/survey.py
-from flask import Blueprint, request, jsonify, session
+from flask import Blueprint, request, jsonify
 from app.services.survey_logic import process_survey
+from app.services import history
 
 survey_bp = Blueprint('survey', __name__)
 
@@ -8,8 +9,6 @@ survey_bp = Blueprint('survey', __name__)
 def submit_survey():
     """提交问卷回答并返回评分和建议"""
     data = request.get_json() or {}
-
-    print("DEBUG payload:", data)
     questions = data.get('questions')
     responses = data.get('responses')
     age_group = data.get('ageGroup')
@@ -19,19 +18,17 @@ def submit_survey():
     if not isinstance(questions, list) or not isinstance(responses, list):
         return jsonify({'error': '缺少或格式错误，需提供 questions 和 responses 列表'}), 400
 
+    # 先确定归属，再调用推理
+    owner = history.current_owner()
+
     # 调用处理逻辑
     result = process_survey(questions, responses)
 
-    # 存入 session 历史
-    history = session.setdefault('survey_history', [])
-    history.append({
-        'questions': questions,
-        'responses': responses,
-        'result': result,
-        'ageGroup': age_group,
-        'gender': gender
-    })
-    session.modified = True
+    # 存入数据库历史（会话 Cookie 中只保留匿名 ID）
+    history.try_record(
+        history.record_survey, owner,
+        questions, responses, result, age_group=age_group, gender=gender
+    )
 
     # 返回完整的评估结果
     return jsonify({
@@ -44,13 +41,25 @@ def submit_survey():
 
 @survey_bp.route('/history', methods=['GET'], strict_slashes=False)
 def get_history():
-    """返回所有提交记录，包括回答和评估结果"""
-    history = session.get('survey_history', [])
-    return jsonify({'history': history})
+    """
+    按时间倒序分页返回提交记录，包括回答和评估结果。
+    参数 limit（默认 20，最多 100）与 cursor（上一页返回的 next_cursor）。
+    """
+    try:
+        rows, next_cursor = history.list_history(
+            history.current_owner(), kind='survey',
+            limit=request.args.get('limit', history.DEFAULT_PAGE_SIZE, type=int),
+            cursor=request.args.get('cursor')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({
+        'history': [history.survey_to_dict(row) for row in rows],
+        'next_cursor': next_cursor
+    })
 
 @survey_bp.route('/reset', methods=['POST'], strict_slashes=False)
 def reset_survey():
     """清空问卷提交记录"""
-    session['survey_history'] = []
-    session.modified = True
+    history.delete_history(history.current_owner(), kind='survey')
     return jsonify({'status': 'survey history reset'})
@@ -0,0 +1,214 @@
+# app/services/analytics.py
+
+import os
+import logging
+from collections import defaultdict
+import numpy as np
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.services.database import read_session
+from app.models import (
+    Assessment, SurveyResponse, SurveyAggregate, SurveyQuestionAggregate
+)
+
+logger = logging.getLogger(__name__)
+
+# ---------- 配置项 ----------
+TREND_WINDOW = int(os.getenv("TREND_WINDOW", "20"))          # 保留最近多少次提交用于滚动均值、近期斜率与风险序列
+TREND_EWMA_ALPHA = float(os.getenv("TREND_EWMA_ALPHA", "0.3"))  # 指数加权均值的平滑系数
+TREND_ROLLING = int(os.getenv("TREND_ROLLING", "5"))         # 滚动均值的宽度（次），不超过 TREND_WINDOW
+
+
+# ---------- 增量更新 ----------
+def _aggregate_for(owner, lock: bool = False, session=None) -> SurveyAggregate:
+    query = (session or db.session).query(SurveyAggregate)
+    if owner.user_id is not None:
+        query = query.filter_by(user_id=owner.user_id)
+    else:
+        query = query.filter_by(anon_id=owner.anon_id)
+    if lock:
+        # 同一用户并发提交时串行更新，避免累计值丢失（SQLite 忽略该子句，由库级写锁保证）
+        query = query.with_for_update()
+    aggregate = query.first()
+    if aggregate is not None or not lock:
+        return aggregate
+
+    aggregate = SurveyAggregate(user_id=owner.user_id, anon_id=owner.anon_id, count=0, score_sum=0.0,
+                                score_sq_sum=0.0, score_xy_sum=0.0, recent=[])
+    try:
+        with db.session.begin_nested():
+            db.session.add(aggregate)
+    except IntegrityError:
+        aggregate = query.one()
+    return aggregate
+
+
+def update_on_survey(owner, assessment: Assessment, survey: SurveyResponse) -> None:
+    """
+    在保存问卷的同一事务内更新汇总：O(题数) 的计算，不读取任何历史记录。
+    分数缺失（评估失败）的提交只计入题目平均值。
+    """
+    aggregate = _aggregate_for(owner, lock=True)
+    score = assessment.score
+    if score is not None:
+        x = aggregate.count
+        aggregate.count = x + 1
+        aggregate.score_sum += score
+        aggregate.score_sq_sum += score * score
+        aggregate.score_xy_sum += x * score
+        aggregate.ewma = score if aggregate.ewma is None else \
+            TREND_EWMA_ALPHA * score + (1 - TREND_EWMA_ALPHA) * aggregate.ewma
+        # JSON 列需整体赋值才会被标记为已修改
+        recent = list(aggregate.recent or [])
+        recent.append([assessment.created_at.isoformat(), score, assessment.risk_level])
+        aggregate.recent = recent[-TREND_WINDOW:]
+
+    from app.services.history import unpack_responses
+    answers = unpack_responses(survey.responses, survey.response_count)
+    questions = next((q for q in aggregate.questions if q.questionnaire_id == survey.questionnaire.id), None)
+    if questions is None:
+        questions = SurveyQuestionAggregate(questionnaire_id=survey.questionnaire.id, count=0,
+                                            sums=[0] * len(answers))
+        aggregate.questions.append(questions)
+    questions.count += 1
+    questions.sums = (np.asarray(questions.sums, dtype=np.int64) + answers).tolist()
+
+
+def reset(owner) -> None:
+    aggregate = _aggregate_for(owner)
+    if aggregate is not None:
+        db.session.delete(aggregate)
+
+
+# ---------- 读取 ----------
+def _slope(n: int, sum_y: float, sum_xy: float):
+    """x = 0..n-1 时的最小二乘斜率（每次提交的分数变化量）"""
+    if n < 2:
+        return None
+    sum_x = n * (n - 1) / 2
+    sum_xx = (n - 1) * n * (2 * n - 1) / 6
+    return (n * sum_xy - sum_x * sum_y) / (n * sum_xx - sum_x * sum_x)
+
+
+def get_trends(owner) -> dict:
+    """
+    返回趋势数据：全量统计、近期窗口统计、分数序列（带滚动均值）、近期风险等级与各题平均分。
+    只读取汇总行（及其题目汇总），耗时与历史记录条数无关；配置了只读副本时在副本上查询。
+    """
+    aggregate = _aggregate_for(owner, session=read_session())
+    if aggregate is None or (aggregate.count == 0 and not aggregate.questions):
+        return {'count': 0, 'series': [], 'risk_levels': [], 'questions': []}
+
+    n = aggregate.count
+    mean = aggregate.score_sum / n if n else None
+    variance = max(aggregate.score_sq_sum / n - mean * mean, 0.0) if n else None
+    recent = aggregate.recent or []
+    scores = np.array([r[1] for r in recent], dtype=np.float64)
+    rolling = _rolling_mean(scores, TREND_ROLLING)
+    window_slope = float(np.polyfit(np.arange(len(scores)), scores, 1)[0]) if len(scores) >= 2 else None
+
+    return {
+        'count': n,
+        'mean': _round(mean),
+        'std': _round(variance ** 0.5 if variance is not None else None),
+        'slope': _round(_slope(n, aggregate.score_sum, aggregate.score_xy_sum)),
+        'ewma': _round(aggregate.ewma),
+        'window': {
+            'size': len(scores),
+            'mean': _round(float(scores.mean())) if len(scores) else None,
+            'slope': _round(window_slope),
+        },
+        'series': [
+            {'created_at': created_at, 'score': score, 'risk_level': risk, 'rolling_mean': _round(avg)}
+            for (created_at, score, risk), avg in zip(recent, rolling)
+        ],
+        'risk_levels': [r[2] for r in recent],
+        'questions': [
+            {
+                'questionnaire_id': q.questionnaire_id,
+                'count': q.count,
+                'questions': q.questionnaire.questions,
+                'averages': [_round(s / q.count) for s in q.sums],
+            }
+            for q in aggregate.questions if q.count
+        ],
+        'updated_at': aggregate.updated_at.isoformat() if aggregate.updated_at else None,
+    }
+
+
+def _rolling_mean(scores: np.ndarray, width: int) -> list:
+    """宽度固定的滚动均值：第 i 项为截至第 i 次（含）的最近 width 次分数的均值，不足 width 次时为 None"""
+    width = max(1, width)
+    if len(scores) < width:
+        return [None] * len(scores)
+    means = np.convolve(scores, np.ones(width) / width, mode='valid')
+    return [None] * (width - 1) + [float(m) for m in means]
+
+
+def _round(value, digits: int = 3):
+    return None if value is None else round(value, digits)
+
+
+# ---------- 全量重建 ----------
+def backfill(batch_size: int = 5000) -> int:
+    """
+    由历史记录重建全部汇总（用于上线前已有的数据或修复）：
+    按归属与时间排序分批读取问卷记录，分数统计与各题累计和均以 NumPy 向量化计算，
+    结果与逐条调用 update_on_survey 一致。返回处理的问卷条数。
+    """
+    SurveyQuestionAggregate.query.delete(synchronize_session=False)
+    SurveyAggregate.query.delete(synchronize_session=False)
+
+    # 逐归属收集（分数、时间、风险）与按问卷分组的打包回答
+    owners = defaultdict(lambda: {'scores': [], 'recent': [], 'answers': defaultdict(list), 'counts': {}})
+    total = 0
+    query = (
+        db.session.query(
+            Assessment.user_id, Assessment.anon_id, Assessment.created_at, Assessment.score,
+            Assessment.risk_level, SurveyResponse.questionnaire_id, SurveyResponse.responses,
+            SurveyResponse.response_count
+        )
+        .join(SurveyResponse, SurveyResponse.assessment_id == Assessment.id)
+        .filter(Assessment.kind == 'survey')
+        .order_by(Assessment.created_at, Assessment.id)
+    )
+    for user_id, anon_id, created_at, score, risk, questionnaire_id, packed, count in query.yield_per(batch_size):
+        state = owners[(user_id, anon_id)]
+        if score is not None:
+            state['scores'].append(score)
+            state['recent'].append([created_at.isoformat(), score, risk])
+            del state['recent'][:-TREND_WINDOW]
+        state['answers'][questionnaire_id].append(packed)
+        state['counts'][questionnaire_id] = count
+        total += 1
+
+    from app.services.history import unpack_responses
+    for (user_id, anon_id), state in owners.items():
+        y = np.asarray(state['scores'], dtype=np.float64)
+        aggregate = SurveyAggregate(
+            user_id=user_id, anon_id=anon_id, count=len(y),
+            score_sum=float(y.sum()), score_sq_sum=float((y * y).sum()),
+            score_xy_sum=float((np.arange(len(y)) * y).sum()),
+            ewma=_ewma(y), recent=state['recent']
+        )
+        for questionnaire_id, rows in state['answers'].items():
+            # 同一问卷的打包回答长度相同，拼接后一次解包为 (提交数, 题数) 矩阵
+            width = len(rows[0])
+            matrix = unpack_responses(b''.join(rows), len(rows) * width * 4).reshape(len(rows), width * 4)
+            sums = matrix[:, :state['counts'][questionnaire_id]].sum(axis=0, dtype=np.int64)
+            aggregate.questions.append(SurveyQuestionAggregate(
+                questionnaire_id=questionnaire_id, count=len(rows), sums=sums.tolist()))
+        db.session.add(aggregate)
+    db.session.commit()
+    logger.info("趋势汇总重建完成：%d 条问卷，%d 个归属", total, len(owners))
+    return total
+
+
+def _ewma(y: np.ndarray):
+    if not len(y):
+        return None
+    # 展开递推式：ewma_n = Σ α(1-α)^(n-1-i)·y_i（i ≥ 1）+ (1-α)^(n-1)·y_0
+    decay = (1 - TREND_EWMA_ALPHA) ** np.arange(len(y) - 1, -1, -1)
+    weights = TREND_EWMA_ALPHA * decay
+    weights[0] = decay[0]
+    return float((weights * y).sum())
@@ -0,0 +1,251 @@
+# app/services/bulk_analysis.py
+
+import os
+import io
+import time
+import hashlib
+import logging
+import zipfile
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import cv2
+from PIL import Image
+from app.services.image_preprocess import (
+    preprocess_pool, PreprocessPoolSaturated, decode_image, IMAGE_POOL_WORKERS
+)
+from app.services.drawing_features import (
+    DRAWING_FAST_PATH, IMAGE_ANALYSIS_PATH, is_line_drawing, extract_features
+)
+from app.services.emotion_classifier import classify_face
+from app.services.image_logic import analyze_image, analyze_drawing_features
+from app.services.llm_governor import AdmissionRejected, PRIORITY_BATCH
+from app.services.metrics import registry, span
+
+logger = logging.getLogger(__name__)
+
+# ---------- 配置项 ----------
+BULK_PREPARE_WORKERS = int(os.getenv("BULK_PREPARE_WORKERS", str(max(1, IMAGE_POOL_WORKERS))))  # 并行解码/预处理线程数
+BULK_LLM_CONCURRENCY = int(os.getenv("BULK_LLM_CONCURRENCY", "4"))     # 同时进行的模型调用数
+BULK_MAX_FILES       = int(os.getenv("BULK_MAX_FILES", "5000"))        # 单次请求最多处理的图片数
+BULK_MAX_FILE_BYTES  = int(os.getenv("BULK_MAX_FILE_BYTES", str(20 * 1024 * 1024)))  # 单张图片上限
+BULK_ADMISSION_RETRIES = int(os.getenv("BULK_ADMISSION_RETRIES", "5"))  # 推理排队被拒时的重试次数
+BULK_POOL_RETRIES    = int(os.getenv("BULK_POOL_RETRIES", "8"))        # 预处理进程池繁忙时的重试次数
+
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+_THUMBNAIL_SIZE = (192, 192)   # 与 /upload 的缩略图尺寸一致
+
+BULK_ITEMS = registry.counter(
+    'bulk_analysis_items_total', '批量分析的图片数（outcome=ok/duplicate/error）')
+
+
+class BulkItem:
+    """待分析的一张图片：名称及按需读取内容的函数（避免一次性读入整个目录或压缩包）"""
+
+    def __init__(self, name: str, load):
+        self.name = name
+        self.load = load
+
+
+def _is_image(name: str) -> bool:
+    return '.' in name and name.rsplit('.', 1)[1].lower() in IMAGE_EXTENSIONS
+
+
+def iter_directory(root: str, recursive: bool = True):
+    """遍历目录中的图片，名称为相对 root 的路径"""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if not _is_image(filename):
+                continue
+            path = os.path.join(dirpath, filename)
+            yield BulkItem(os.path.relpath(path, root), lambda p=path: _read_file(p))
+        if not recursive:
+            break
+
+
+def iter_zip(fileobj, prefix: str = ''):
+    """遍历 zip 压缩包中的图片成员；成员内容在处理时才解压"""
+    try:
+        archive = zipfile.ZipFile(fileobj)
+    except zipfile.BadZipFile as e:
+        # 损坏的压缩包作为一条错误结果输出，不中断整批
+        yield BulkItem(prefix.rstrip('/') or 'archive', lambda msg=f"无法读取压缩包: {e}": _fail(msg))
+        return
+    for info in archive.infolist():
+        if info.is_dir() or not _is_image(info.filename):
+            continue
+        if info.file_size > BULK_MAX_FILE_BYTES:
+            yield BulkItem(prefix + info.filename, lambda size=info.file_size: _fail(_too_large(size)))
+            continue
+        yield BulkItem(prefix + info.filename, lambda i=info: archive.read(i))
+
+
+def _read_file(path: str) -> bytes:
+    size = os.path.getsize(path)
+    if size > BULK_MAX_FILE_BYTES:
+        _fail(_too_large(size))
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _too_large(size: int) -> str:
+    return f"文件过大: {size} 字节，上限 {BULK_MAX_FILE_BYTES}"
+
+
+def _fail(message: str):
+    raise ValueError(message)
+
+
+class _Prepared:
+    """预处理完成、等待模型分析的图片"""
+
+    def __init__(self, record: dict, features=None, image=None, prediction=None):
+        self.record = record
+        self.features = features
+        self.image = image
+        self.prediction = prediction
+
+
+class BulkAnalyzer:
+    """
+    流式批量分析流水线：
+      读取 → SHA-256 去重 → 解码与预处理（线程池 + 预处理进程池，多核并行）
+      → 模型分析（并发数受 llm_concurrency 限制）→ 按完成顺序逐条产出结果
+
+    run() 为生成器，同时在途的图片数有上限，处理上千张图片时内存占用保持平稳。
+    """
+
+    def __init__(self, prepare_workers: int = None, llm_concurrency: int = None, max_files: int = None):
+        self.prepare_workers = prepare_workers or BULK_PREPARE_WORKERS
+        self.llm_concurrency = llm_concurrency or BULK_LLM_CONCURRENCY
+        self.max_files = max_files or BULK_MAX_FILES
+        self._seen = {}
+        self._seen_lock = threading.Lock()
+
+    def run(self, items):
+        """逐条产出每张图片的结果字典（name、sha256、status 以及 result/error/duplicate_of）"""
+        window = self.prepare_workers + self.llm_concurrency * 2
+        source = iter(items)
+        submitted = 0
+        pending = set()
+        prepare_ex = ThreadPoolExecutor(self.prepare_workers, thread_name_prefix='bulk-prepare')
+        llm_ex = ThreadPoolExecutor(self.llm_concurrency, thread_name_prefix='bulk-llm')
+        try:
+            while True:
+                while len(pending) < window and submitted < self.max_files:
+                    item = next(source, None)
+                    if item is None:
+                        break
+                    submitted += 1
+                    pending.add(self._submit(prepare_ex, self._prepare, item))
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    outcome = future.result()
+                    if isinstance(outcome, _Prepared):
+                        pending.add(self._submit(llm_ex, self._analyze, outcome))
+                    else:
+                        BULK_ITEMS.inc(outcome=outcome['status'])
+                        yield outcome
+            if next(source, None) is not None:
+                logger.warning("批量分析超过 %d 张上限，其余图片未处理", self.max_files)
+                yield {'status': 'error', 'error': f'超过单批 {self.max_files} 张上限，其余图片未处理'}
+        finally:
+            # 客户端断开（生成器被关闭）时不再提交新图片，也不等待窗口内的任务：
+            # 尚未开始的预处理与模型调用直接取消，已在执行的在后台结束
+            prepare_ex.shutdown(wait=False, cancel_futures=True)
+            llm_ex.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def _submit(executor, fn, arg):
+        # 在工作线程中沿用调用方的上下文（请求 ID 等）
+        ctx = contextvars.copy_context()
+        return executor.submit(ctx.run, fn, arg)
+
+    def _prepare(self, item: BulkItem):
+        started = time.perf_counter()
+        record = {'name': item.name}
+        try:
+            data = item.load()
+            digest = hashlib.sha256(data).hexdigest()
+            record['sha256'] = digest
+            with self._seen_lock:
+                first = self._seen.setdefault(digest, item)
+            if first is not item:
+                record.update(status='duplicate', duplicate_of=first.name)
+                return record
+
+            with span('preprocess', step='read'):
+                img_cv = decode_image(data)
+            if img_cv is None:
+                # OpenCV 无法解码（如 GIF）时与 /upload 一致：跳过预处理，直接发送原图
+                try:
+                    with Image.open(io.BytesIO(data)) as opened:
+                        opened.seek(0)
+                        image = opened.convert('RGB')
+                except Exception:
+                    raise ValueError("无法解码图片")
+                record['path'] = 'pixels'
+                return _Prepared(record, image=image)
+
+            if DRAWING_FAST_PATH and is_line_drawing(img_cv):
+                with span('preprocess', step='drawing_features'):
+                    features = extract_features(img_cv)
+                record['path'] = 'drawing_features'
+                return _Prepared(record, features=features)
+
+            img_processed, face_found = self._run_pool(img_cv)
+            prediction = classify_face(img_processed) if face_found else None
+            with span('preprocess', step='thumbnail'):
+                image = Image.fromarray(cv2.cvtColor(img_processed, cv2.COLOR_BGR2RGB))
+                image.thumbnail(_THUMBNAIL_SIZE, Image.Resampling.LANCZOS)
+            record['path'] = 'pixels'
+            return _Prepared(record, image=image, prediction=prediction)
+        except Exception as e:
+            logger.error("批量分析预处理失败 %s: %s", item.name, e)
+            record.update(status='error', error=str(e))
+            return record
+        finally:
+            record['prepare_ms'] = round((time.perf_counter() - started) * 1000, 1)
+
+    @staticmethod
+    def _run_pool(img_cv):
+        # 与在线请求共用预处理进程池；池满时稍后重试，而不是让整批失败；
+        # 重试耗尽（进程池长时间不可用）时该图片记为错误，整批继续
+        delay = 0.2
+        for attempt in range(BULK_POOL_RETRIES + 1):
+            try:
+                return preprocess_pool.run(img_cv)
+            except PreprocessPoolSaturated:
+                if attempt == BULK_POOL_RETRIES:
+                    raise
+                time.sleep(delay)
+                delay = min(delay * 2, 5)
+
+    def _analyze(self, prepared: _Prepared) -> dict:
+        started = time.perf_counter()
+        record = prepared.record
+        IMAGE_ANALYSIS_PATH.inc(path=record['path'])
+        try:
+            for attempt in range(BULK_ADMISSION_RETRIES + 1):
+                try:
+                    # 以批量优先级排队，不挤占在线请求
+                    if prepared.features is not None:
+                        result = analyze_drawing_features(prepared.features, priority=PRIORITY_BATCH)
+                    else:
+                        result = analyze_image(prepared.image, prediction=prepared.prediction,
+                                               priority=PRIORITY_BATCH)
+                    break
+                except AdmissionRejected as e:
+                    if attempt == BULK_ADMISSION_RETRIES:
+                        raise
+                    time.sleep(e.retry_after)
+            record.update(status='ok', result=result)
+        except Exception as e:
+            logger.error("批量分析模型调用失败 %s: %s", record['name'], e)
+            record.update(status='error', error=str(e))
+        record['analyze_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        return record
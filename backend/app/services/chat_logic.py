@@ -1,24 +1,14 @@
 # app/services/chat_logic.py
 
-import re
-import requests
-from datetime import datetime
-from openai import OpenAI
-
-# 模式切换：True 使用本地 Ollama，False 使用 DeepSeek API
-USE_OLLAMA = False
-
-# 本地模型配置
-OLLAMA_URL = "http://localhost:11434"
-OLLAMA_MODEL = "deepseek-r1:1.5b"  # 本地模型名称
-
-# DeepSeek API 客户端配置
-client = OpenAI(
-    api_key="sk-e1927ee1ea204a22b49fa3667f70a033",
-    base_url="https://api.deepseek.com"
-)
+import logging
+from app.services import llm_client
+from app.services.model_router import router
+from app.services.llm_governor import AdmissionRejected, PRIORITY_INTERACTIVE
 
 MAX_HISTORY = 8  # 保留最近8轮对话
+CONTEXT_TRIM_STEP = 4  # 超出后一次丢弃的消息数
+
+logger = logging.getLogger(__name__)
 
 def process_chat(full_history, instruction=None):
     try:
@@ -28,89 +18,34 @@ def process_chat(full_history, instruction=None):
         if instruction:
             optimized_history.insert(0, {"role": "system", "content": instruction})
 
-        if USE_OLLAMA:
-            return chat_with_ollama(optimized_history)
-        else:
-            return chat_with_api(optimized_history)
+        # 后端由路由策略决定（本地推理服务地址与模型见 llm_client）
+        return chat_with_api(optimized_history, router.route('chat'))
 
+    except AdmissionRejected:
+        # 交由路由层直接返回 429/503
+        raise
     except Exception as e:
-        log_error(e)
+        logger.error("对话处理失败: %s", e, exc_info=True)
         return "当前服务繁忙，请稍后再试"
 
-def chat_with_api(messages):
-    """调用 DeepSeek 官方 API 聊天"""
-    response = client.chat.completions.create(
-        model="deepseek-chat",
-        messages=messages,
+def chat_with_api(messages, backend):
+    """调用推理后端聊天（失败时退避重试，不可用时切换到另一后端）"""
+    return llm_client.complete(
+        messages,
+        backend=backend,
+        priority=PRIORITY_INTERACTIVE,
         temperature=0.7,
         max_tokens=1000
     )
-    return response.choices[0].message.content
-
-def chat_with_ollama(messages):
-    # 拼接 prompt
-    prompt = ""
-    for msg in messages:
-        role = msg["role"]
-        content = msg["content"]
-        if role == "system":
-            prompt += f"System: {content}\n"
-        elif role == "user":
-            prompt += f"User: {content}\n"
-        elif role == "assistant":
-            prompt += f"Assistant: {content}\n"
-    prompt += "Assistant:"
-
-    try:
-        print("🔧 正在向 Ollama 发送请求...")
-        print("📤 Prompt:")
-        print(prompt)
-
-        res = requests.post(
-            f"{OLLAMA_URL}/api/generate",
-            json={
-                "model": OLLAMA_MODEL,
-                "prompt": prompt,
-                "stream": False
-            },
-            timeout=60
-        )
-
-        print(f"📥 状态码: {res.status_code}")
-        print(f"📥 响应: {res.text}")
-
-        if res.status_code == 200:
-            response = res.json().get("response", "").strip()
-            if response:
-                # 在终端打印完整响应
-                print("完整响应:")
-                print(response)
-
-                # 使用正则表达式移除 <think> 标签及其内容
-                cleaned_response = re.sub(r"<think>.*?</think>", "", response, flags=re.DOTALL).strip()
-                return cleaned_response
-            else:
-                log_error("Ollama returned empty response.")
-                return "未能获得有效的模型回复"
-        else:
-            log_error(f"Ollama error: {res.status_code} - {res.text}")
-            return "本地模型服务暂不可用"
-
-    except requests.exceptions.RequestException as e:
-        log_error(f"Ollama request error: {e}")
-        return "本地模型服务暂不可用"
 
 def optimize_context(history):
-    """优化上下文长度策略"""
-    if len(history) > MAX_HISTORY + 1:
-        return [history[0]] + history[-MAX_HISTORY:]
-    return history
-
-def log_error(error):
-    """错误日志记录"""
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    try:
-        with open("chat_errors.log", "a", encoding="utf-8") as f:
-            f.write(f"[{timestamp}] {str(error)}\n")
-    except Exception as file_error:
-        print(f"日志写入失败：{file_error}")
+    """
+    优化上下文长度策略：超出 MAX_HISTORY 时按 CONTEXT_TRIM_STEP 成块丢弃最早的消息，
+    而不是每轮滑动一条。窗口起点在几轮之内保持不变，推理服务可以复用上一轮已计算的
+    提示前缀（Ollama 的 KV 缓存、DeepSeek 的上下文缓存），每轮只处理新增的消息。
+    """
+    overflow = len(history) - 1 - MAX_HISTORY
+    if overflow <= 0:
+        return history
+    drop = -(-overflow // CONTEXT_TRIM_STEP) * CONTEXT_TRIM_STEP
+    return [history[0]] + history[1 + drop:]
@@ -0,0 +1,138 @@
+# app/services/database.py
+
+import os
+import atexit
+import logging
+import tempfile
+import importlib.util
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+logger = logging.getLogger(__name__)
+
+REPLICA_BIND = 'replica'
+
+# 压测用内存库的存放目录：tmpfs 上的 SQLite 文件。
+# 不使用 mode=memory&cache=shared：共享缓存下并发写入直接报 "database table is locked"，不受 busy timeout 保护
+_MEMORY_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+# 可替换 PyMySQL（纯 Python）的 C 扩展驱动，按优先顺序尝试
+_MYSQL_C_DRIVERS = (('mysqldb', 'MySQLdb'),)
+
+
+def configure_database(app) -> None:
+    """
+    在 db.init_app 之前根据配置补全数据库相关设置：
+      - DB_PROFILE=sqlite-memory 时改用 tmpfs 上的临时 SQLite 库（本地压测，启动时直接建表）；
+      - DB_DRIVER=auto 时若已安装 mysqlclient，MySQL 改用其 C 扩展驱动；
+      - 连接池参数写入 SQLALCHEMY_ENGINE_OPTIONS（显式配置的同名项优先）；
+      - 配置了 DATABASE_REPLICA_URL 时注册只读副本 bind，供 read_session 使用。
+    """
+    config = app.config
+    if config.get('DB_PROFILE') == 'sqlite-memory':
+        config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + _memory_database_path()
+        config['DATABASE_REPLICA_URL'] = None
+
+    uri = _select_driver(config['SQLALCHEMY_DATABASE_URI'], config.get('DB_DRIVER', 'auto'))
+    config['SQLALCHEMY_DATABASE_URI'] = uri
+    options = engine_options(uri, config)
+    options.update(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+    replica_uri = config.get('DATABASE_REPLICA_URL')
+    if replica_uri:
+        replica_uri = _select_driver(replica_uri, config.get('DB_DRIVER', 'auto'))
+        binds = dict(config.get('SQLALCHEMY_BINDS') or {})
+        binds[REPLICA_BIND] = {'url': replica_uri, **engine_options(replica_uri, config)}
+        config['SQLALCHEMY_BINDS'] = binds
+
+    logger.info("数据库: %s（副本: %s）", make_url(uri).render_as_string(hide_password=True),
+                make_url(replica_uri).render_as_string(hide_password=True) if replica_uri else '无')
+
+
+def engine_options(uri: str, config) -> dict:
+    """按方言生成连接池参数；SQLite 不使用连接数上限与回收"""
+    url = make_url(uri)
+    if url.get_backend_name() == 'sqlite':
+        # 写锁冲突时等待而不是立即报错
+        return {'connect_args': {'timeout': 30}}
+    return {
+        'pool_size': config.get('DB_POOL_SIZE', 10),
+        'max_overflow': config.get('DB_MAX_OVERFLOW', 5),
+        'pool_timeout': config.get('DB_POOL_TIMEOUT', 10),
+        'pool_recycle': config.get('DB_POOL_RECYCLE', 280),
+        'pool_pre_ping': config.get('DB_POOL_PRE_PING', True),
+    }
+
+
+def _select_driver(uri: str, driver: str) -> str:
+    """DB_DRIVER：auto（有 C 驱动时使用）、pymysql、mysqldb，或留空保持 URI 原样"""
+    url = make_url(uri)
+    if url.get_backend_name() != 'mysql' or not driver:
+        return uri
+    if driver == 'auto':
+        driver = next((name for name, module in _MYSQL_C_DRIVERS if importlib.util.find_spec(module)),
+                      url.get_driver_name())
+    if driver == url.get_driver_name():
+        return uri
+    return url.set(drivername=f'mysql+{driver}').render_as_string(hide_password=False)
+
+
+def _memory_database_path() -> str:
+    """每个进程一个新库，进程退出时删除"""
+    fd, path = tempfile.mkstemp(prefix='psych_eval_bench_', suffix='.db', dir=_MEMORY_DIR)
+    os.close(fd)
+    owner_pid = os.getpid()
+
+    def cleanup():
+        # fork 出的 worker 退出时不删除，库归创建它的进程所有
+        if os.getpid() != owner_pid:
+            return
+        for suffix in ('', '-wal', '-shm'):
+            try:
+                os.unlink(path + suffix)
+            except OSError:
+                pass
+    atexit.register(cleanup)
+    return path
+
+
+def init_database(app, db) -> None:
+    """db.init_app 之后调用：内存库建表，注册副本会话的清理"""
+    if app.config.get('DB_PROFILE') == 'sqlite-memory':
+        from app import models  # noqa: F401
+        with app.app_context():
+            # WAL 下读写互不阻塞；压测数据无需落盘保证
+            @event.listens_for(db.engine, 'connect')
+            def set_sqlite_pragma(dbapi_connection, _):
+                cursor = dbapi_connection.cursor()
+                cursor.execute('PRAGMA journal_mode=WAL')
+                cursor.execute('PRAGMA synchronous=OFF')
+                cursor.close()
+
+            # 内存库不经过迁移，直接建表
+            db.create_all()
+
+    @app.teardown_appcontext
+    def remove_read_session(exc):
+        _read_sessions.remove()
+
+
+# 只读副本会话：每个线程一个，请求结束时移除
+_read_sessions = scoped_session(sessionmaker())
+
+
+def read_session():
+    """
+    返回用于只读查询的会话：配置了副本时绑定副本引擎，否则就是 db.session。
+    副本存在复制延迟，刚写入的数据可能暂时读不到，只用于历史列表、详情与趋势这类查询。
+    """
+    from app import db
+    if REPLICA_BIND not in (current_app.config.get('SQLALCHEMY_BINDS') or {}):
+        return db.session
+    session = _read_sessions()
+    if session.bind is None:
+        session.bind = db.engines[REPLICA_BIND]
+    return session
@@ -0,0 +1,162 @@
+# app/services/drawing_features.py
+
+import os
+import cv2
+import numpy as np
+from app.services.image_encoder import classify_pixels
+from app.services.metrics import registry
+
+# ---------- 配置项 ----------
+DRAWING_FAST_PATH = os.getenv("DRAWING_FAST_PATH", "1") == "1"  # 线稿走特征摘要快速通道
+
+_PROBE_SIDE   = 128   # 线稿判定所用缩略图长边
+_WORK_SIDE    = 512   # 特征提取前统一缩放到的长边，耗时与上传分辨率无关
+_INK_DELTA    = 40    # 与底色的最大通道差超过该值视为笔迹
+_CORE_DELTA   = 100   # 统计颜色时只用差值超过该值的笔迹核心，排除抗锯齿边缘的过渡色
+_MIN_BLOB     = 4     # 连通域面积低于该值视为噪点，不计入笔画数
+_MIN_COLOR    = 0.02  # 颜色占笔迹比例低于该值时不列出
+
+IMAGE_ANALYSIS_PATH = registry.counter(
+    'image_analysis_path_total', '图片分析路径（path=drawing_features/pixels）')
+
+# 颜色名称；OpenCV HSV 色相（0-180）按 _HUE_BOUNDS 分段映射到 _HUE_INDEX
+_COLOR_NAMES = ('红', '橙', '黄', '绿', '青', '蓝', '紫', '黑', '灰', '白')
+_HUE_BOUNDS  = np.array([10, 22, 35, 85, 100, 130, 160, 181])
+_HUE_INDEX   = np.array([0, 1, 2, 3, 4, 5, 6, 0])
+_BLACK, _GRAY, _WHITE = 7, 8, 9
+_WARM = {'红', '橙', '黄'}
+
+
+def is_line_drawing(img_bgr: np.ndarray) -> bool:
+    """用最近邻缩略图判断是否为画布线稿（大面积底色 + 少量颜色），耗时约 1ms"""
+    h, w = img_bgr.shape[:2]
+    scale = _PROBE_SIDE / max(h, w)
+    if scale < 1:
+        img_bgr = cv2.resize(img_bgr, (max(1, round(w * scale)), max(1, round(h * scale))),
+                             interpolation=cv2.INTER_NEAREST)
+    kind, _ = classify_pixels(img_bgr)
+    return kind == 'drawing'
+
+
+def _background(work: np.ndarray) -> np.ndarray:
+    """取量化后出现最多的颜色作为底色"""
+    q = (work >> 4).astype(np.int32)
+    codes = (q[..., 0] << 8) | (q[..., 1] << 4) | q[..., 2]
+    bg_code = np.bincount(codes.ravel()).argmax()
+    return np.median(work[codes == bg_code], axis=0)
+
+
+def _color_indices(ink_hsv: np.ndarray) -> np.ndarray:
+    """按 HSV 为每个笔迹像素分配 _COLOR_NAMES 中的颜色下标"""
+    h, s, v = ink_hsv[:, 0], ink_hsv[:, 1] / 255.0, ink_hsv[:, 2] / 255.0
+    idx = _HUE_INDEX[np.searchsorted(_HUE_BOUNDS, h, side='right')]
+    achromatic = s < 0.25
+    idx[achromatic & (v < 0.3)] = _BLACK
+    idx[achromatic & (v >= 0.3) & (v < 0.8)] = _GRAY
+    idx[achromatic & (v >= 0.8)] = _WHITE
+    return idx
+
+
+def extract_features(img_bgr: np.ndarray) -> dict:
+    """
+    提取线稿的绘画特征（全部为向量化的 NumPy/OpenCV 运算）：
+      - 笔迹密度、包围盒、重心、离散度、九宫格分布、左右对称性
+      - 笔画（连通域）数量与最大笔画占比
+      - 线宽均值与变异系数、墨色深浅与波动（作为下笔力度的近似）
+      - 主要颜色及占比、暖色比例、平均饱和度与明度
+    """
+    h, w = img_bgr.shape[:2]
+    scale = _WORK_SIDE / max(h, w)
+    work = cv2.resize(img_bgr, (max(1, round(w * scale)), max(1, round(h * scale))),
+                      interpolation=cv2.INTER_AREA) if scale < 1 else img_bgr
+    h, w = work.shape[:2]
+
+    bg = _background(work)
+    delta = np.abs(work.astype(np.int16) - bg.astype(np.int16)).max(axis=2)
+    ink = delta > _INK_DELTA
+    ink_pixels = int(ink.sum())
+    features = {'width': int(img_bgr.shape[1]), 'height': int(img_bgr.shape[0]),
+                'ink_density': round(ink_pixels / ink.size, 4)}
+    if ink_pixels == 0:
+        features['empty'] = True
+        return features
+
+    # 空间分布
+    ys, xs = np.nonzero(ink)
+    x0, x1, y0, y1 = xs.min() / w, (xs.max() + 1) / w, ys.min() / h, (ys.max() + 1) / h
+    grid = np.add.reduceat(np.add.reduceat(ink.astype(np.int32), np.linspace(0, h, 4, dtype=int)[:-1], axis=0),
+                           np.linspace(0, w, 4, dtype=int)[:-1], axis=1) / ink_pixels
+    mirrored = ink[:, ::-1]
+    features.update({
+        'bbox': [round(x0, 3), round(y0, 3), round(x1, 3), round(y1, 3)],
+        'bbox_area': round((x1 - x0) * (y1 - y0), 3),
+        'centroid': [round(xs.mean() / w, 3), round(ys.mean() / h, 3)],
+        'spread': [round(xs.std() / w, 3), round(ys.std() / h, 3)],
+        'grid': np.round(grid, 3).tolist(),
+        'symmetry': round(float((ink & mirrored).sum() / (ink | mirrored).sum()), 3),
+    })
+
+    # 笔画与线宽
+    ink_u8 = ink.astype(np.uint8)
+    _, _, stats, _ = cv2.connectedComponentsWithStats(ink_u8, connectivity=8)
+    areas = stats[1:, cv2.CC_STAT_AREA]
+    areas = areas[areas >= _MIN_BLOB]
+    dist = cv2.distanceTransform(ink_u8, cv2.DIST_L2, 3)
+    ridge = ink & (dist >= cv2.dilate(dist, np.ones((3, 3), np.uint8)))
+    widths = 2 * dist[ridge] / scale if scale < 1 else 2 * dist[ridge]
+    features.update({
+        'strokes': int(len(areas)),
+        'largest_stroke_share': round(float(areas.max() / ink_pixels), 3) if len(areas) else 0.0,
+        'stroke_width': round(float(np.median(widths)), 2) if len(widths) else 0.0,
+        'stroke_width_cv': round(float(widths.std() / widths.mean()), 3) if len(widths) and widths.mean() else 0.0,
+    })
+
+    # 墨色与颜色
+    ink_bgr = work[ink]
+    gray = cv2.cvtColor(ink_bgr.reshape(-1, 1, 3), cv2.COLOR_BGR2GRAY).ravel() / 255.0
+    core = delta > _CORE_DELTA
+    core_bgr = work[core] if core.any() else ink_bgr
+    hsv = cv2.cvtColor(core_bgr.reshape(-1, 1, 3), cv2.COLOR_BGR2HSV).reshape(-1, 3).astype(np.float32)
+    counts = np.bincount(_color_indices(hsv), minlength=len(_COLOR_NAMES))
+    shares = sorted(((n, c / len(hsv)) for n, c in zip(_COLOR_NAMES, counts) if c), key=lambda x: -x[1])
+    colors = [(n, round(float(s), 3)) for n, s in shares if s >= _MIN_COLOR]
+    chromatic = [(n, s) for n, s in shares if n not in ('黑', '灰', '白')]
+    chromatic_total = sum(s for _, s in chromatic)
+    features.update({
+        'darkness': round(float(1 - gray.mean()), 3),
+        'darkness_std': round(float(gray.std()), 3),
+        'colors': colors,
+        'color_count': len(colors),
+        'warm_ratio': round(sum(s for n, s in chromatic if n in _WARM) / chromatic_total, 3) if chromatic_total else 0.0,
+        'saturation': round(float(hsv[:, 1].mean() / 255), 3),
+        'brightness': round(float(hsv[:, 2].mean() / 255), 3),
+    })
+    return features
+
+
+def _position(x: float, y: float) -> str:
+    col = '左' if x < 0.4 else '右' if x > 0.6 else '中'
+    row = '上' if y < 0.4 else '下' if y > 0.6 else '中'
+    return '居中' if col == row == '中' else f"偏{row if row != '中' else ''}{col if col != '中' else ''}"
+
+
+def summarize(features: dict) -> str:
+    """将特征压缩为几行中文描述，供提示词使用（通常不足 300 字）"""
+    if features.get('empty'):
+        return "画布为空白，没有可辨识的笔迹。"
+    grid = features['grid']
+    rows = [round(sum(r), 2) for r in grid]
+    cols = [round(sum(grid[i][j] for i in range(3)), 2) for j in range(3)]
+    colors = '、'.join(f"{n}{int(s * 100)}%" for n, s in features['colors']) or '无'
+    return "\n".join([
+        f"画布 {features['width']}x{features['height']}，笔迹覆盖 {features['ink_density']:.1%}，"
+        f"作画区域占画布 {features['bbox_area']:.0%}，重心{_position(*features['centroid'])}，"
+        f"水平/垂直离散度 {features['spread'][0]}/{features['spread'][1]}，左右对称度 {features['symmetry']}。",
+        f"九宫格笔迹比例：上中下 {rows}，左中右 {cols}。",
+        f"独立笔画约 {features['strokes']} 处，最大笔画占 {features['largest_stroke_share']:.0%}；"
+        f"线宽中位数 {features['stroke_width']}px，线宽变异系数 {features['stroke_width_cv']}"
+        f"（越大表示下笔轻重变化越明显）。",
+        f"墨色深度 {features['darkness']}（波动 {features['darkness_std']}）；"
+        f"颜色：{colors}；暖色占彩色笔迹 {features['warm_ratio']:.0%}，"
+        f"平均饱和度 {features['saturation']}，平均明度 {features['brightness']}。",
+    ])
@@ -0,0 +1,119 @@
+# app/services/emotion_classifier.py
+
+import os
+import logging
+import threading
+import cv2
+import numpy as np
+from app.services.metrics import registry, span
+
+logger = logging.getLogger(__name__)
+
+# ---------- 配置项 ----------
+# 本地表情分类模型（ONNX 等 OpenCV DNN 可读取的格式）；为空则不启用，全部交给大模型
+EMOTION_MODEL_PATH = os.getenv("EMOTION_MODEL_PATH", "")
+# 模型输出顺序对应的标签，默认为 FER+ 的 8 类
+EMOTION_MODEL_LABELS = os.getenv(
+    "EMOTION_MODEL_LABELS", "neutral,happiness,surprise,sadness,anger,disgust,fear,contempt").split(",")
+EMOTION_CONFIDENCE = float(os.getenv("EMOTION_CONFIDENCE", "0.85"))  # 高于该置信度直接返回，不再调用大模型
+EMOTION_INPUT_SIZE = int(os.getenv("EMOTION_INPUT_SIZE", "64"))      # 模型输入边长
+EMOTION_INPUT_GRAY = os.getenv("EMOTION_INPUT_GRAY", "1") == "1"     # 模型输入为单通道灰度
+EMOTION_INPUT_SCALE = float(os.getenv("EMOTION_INPUT_SCALE", "1.0")) # 像素缩放系数（如 1/255）
+EMOTION_INPUT_MEAN = float(os.getenv("EMOTION_INPUT_MEAN", "0"))     # 缩放前减去的均值
+
+# 英文标签到前端使用的中文情绪名
+EMOTION_NAMES = {
+    'neutral': '平静', 'happiness': '高兴', 'happy': '高兴', 'surprise': '惊讶',
+    'sadness': '伤心', 'sad': '伤心', 'anger': '愤怒', 'angry': '愤怒',
+    'disgust': '厌恶', 'fear': '恐惧', 'contempt': '轻蔑',
+}
+
+EMOTION_CLASSIFIER = registry.counter(
+    'emotion_classifier_total', '本地表情分类结果（outcome=accepted/escalated/error）')
+
+_net = None
+_net_lock = threading.Lock()
+
+
+class EmotionPrediction:
+    """本地分类结果：最可能的情绪、置信度及按概率排序的全部候选"""
+
+    def __init__(self, scores: list):
+        self.scores = scores
+        self.label, self.confidence = scores[0]
+
+    @property
+    def emotion(self) -> str:
+        return EMOTION_NAMES.get(self.label, self.label)
+
+    @property
+    def confident(self) -> bool:
+        return self.confidence >= EMOTION_CONFIDENCE
+
+    def describe(self, top: int = 3) -> str:
+        return "、".join(f"{EMOTION_NAMES.get(l, l)} {p:.0%}" for l, p in self.scores[:top])
+
+    def as_result(self) -> dict:
+        """置信度足够时直接作为 analyze_image 的返回值"""
+        return {
+            "emotion": self.emotion,
+            "analysis": f"面部表情识别为「{self.emotion}」（置信度 {self.confidence:.0%}），"
+                        f"候选情绪：{self.describe()}。"
+        }
+
+
+def enabled() -> bool:
+    return bool(EMOTION_MODEL_PATH)
+
+
+def _get_net():
+    global _net
+    if _net is None:
+        with _net_lock:
+            if _net is None:
+                net = cv2.dnn.readNet(EMOTION_MODEL_PATH)
+                net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+                net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+                _net = net
+                logger.info("已加载表情分类模型: %s", EMOTION_MODEL_PATH)
+    return _net
+
+
+def classify_face(face_bgr: np.ndarray):
+    """
+    对已裁剪的人脸区域做表情分类，返回 EmotionPrediction；
+    未配置模型或推理失败时返回 None，由调用方回退到大模型。
+    """
+    if not enabled() or face_bgr is None or face_bgr.size == 0:
+        return None
+    try:
+        with span('preprocess', step='emotion_classifier'):
+            img = cv2.cvtColor(face_bgr, cv2.COLOR_BGR2GRAY) if EMOTION_INPUT_GRAY else face_bgr
+            blob = cv2.dnn.blobFromImage(
+                img, scalefactor=EMOTION_INPUT_SCALE, size=(EMOTION_INPUT_SIZE, EMOTION_INPUT_SIZE),
+                mean=EMOTION_INPUT_MEAN, swapRB=not EMOTION_INPUT_GRAY
+            )
+            net = _get_net()
+            # cv2.dnn.Net 不是线程安全的，推理本身只需数毫秒，串行即可
+            with _net_lock:
+                net.setInput(blob)
+                logits = net.forward().ravel().astype(np.float64)
+    except Exception as e:
+        EMOTION_CLASSIFIER.inc(outcome='error')
+        logger.error("本地表情分类失败: %s", e)
+        return None
+
+    if len(logits) != len(EMOTION_MODEL_LABELS):
+        EMOTION_CLASSIFIER.inc(outcome='error')
+        logger.error("模型输出 %d 类，与 EMOTION_MODEL_LABELS 的 %d 个标签不符", len(logits), len(EMOTION_MODEL_LABELS))
+        return None
+    # 输出已是概率分布时直接使用，否则视为 logits 做 softmax
+    if logits.min() >= 0 and abs(logits.sum() - 1) < 1e-3:
+        probs = logits
+    else:
+        exp = np.exp(logits - logits.max())
+        probs = exp / exp.sum()
+    order = np.argsort(-probs)
+    prediction = EmotionPrediction([(EMOTION_MODEL_LABELS[i].strip(), float(probs[i])) for i in order])
+    EMOTION_CLASSIFIER.inc(outcome='accepted' if prediction.confident else 'escalated')
+    return prediction
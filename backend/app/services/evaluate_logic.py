@@ -1,30 +1,47 @@
 import os
 import json
-import base64
-import re
-import requests
-from openai import OpenAI, OpenAIError
+import time
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from app.services import llm_client
+from app.services.image_encoder import encode_for_prompt
+from app.services.image_preprocess import read_image
+from app.services.drawing_features import (
+    DRAWING_FAST_PATH, IMAGE_ANALYSIS_PATH, is_line_drawing, extract_features, summarize
+)
 from app.services.questions_data import QUESTIONS
+from app.services.llm_governor import AdmissionRejected, PRIORITY_BATCH, PRIORITY_STANDARD
+from app.services.metrics import observe_stage, registry, span
+from app.services.structured_output import StructuredOutputError, strip_think
+from app.services.model_router import router
 
-# DeepSeek 云 API 配置
-DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY", "sk-e1927ee1ea204a22b49fa3667f70a033")
-DEEPSEEK_BASE_URL = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com")
+logger = logging.getLogger(__name__)
 
-# 本地推理服务配置（Ollama / LocalAI OpenAI-兼容接口）
-USE_LOCAL_INFERENCE = False  # True 使用本地推理服务，False 使用 DeepSeek API
-INFERENCE_URL       = os.getenv("INFERENCE_URL", "http://localhost:11434/v1/chat/completions")
-INFERENCE_MODEL     = os.getenv("INFERENCE_MODEL", "deepseek-r1:1.5b")
+# ---------- 分段评估配置 ----------
+EVALUATE_REFINE            = os.getenv("EVALUATE_REFINE", "1") == "1"                 # 是否由云端模型修订低置信度段落
+EVALUATE_REFINE_CONFIDENCE = float(os.getenv("EVALUATE_REFINE_CONFIDENCE", "0.6"))  # 初稿置信度低于该值时修订
 
-# 初始化 DeepSeek 客户端（云端）
-api_client = OpenAI(
-    api_key=DEEPSEEK_API_KEY,
-    base_url=DEEPSEEK_BASE_URL
-)
+# 评估报告的五个部分：(键, 标题)
+REPORT_SECTIONS = [
+    ('overall', '综合心理评价'),
+    ('emotion', '当前情绪状态'),
+    ('stressors', '工作与生活中的压力源分析'),
+    ('relationships', '人际关系状况评估'),
+    ('advice', '建议与应对策略'),
+]
+SECTION_SCHEMA = {
+    'content': str,
+    'confidence': (int, float),
+}
+
+EVALUATE_SECTIONS = registry.counter(
+    'evaluate_sections_total', '分段评估的段落数（outcome=draft/refined/failed）')
 
 
 def remove_think_tags(text):
-    """移除 <think> 标签及其内容"""
-    return re.sub(r'<think>.*?</think>', '', text, flags=re.DOTALL)
+    """移除 <think> 标签及其内容（本地推理的输出已由 llm_client 流式过滤，这里兜底）"""
+    return strip_think(text)
 
 
 def evaluate_all(text_input: str,
@@ -35,8 +52,46 @@ def evaluate_all(text_input: str,
                  gender: str = None) -> str:
     """
     综合评估入口：接收文本描述、题目列表、问卷答案、可选的图像分析结果，以及年龄组和性别。
-    然后根据 USE_LOCAL_INFERENCE 选择本地或云端推理返回评估文本。
+    然后按路由策略选择本地或云端推理返回评估文本。
     """
+    build_start = time.perf_counter()
+    parts = [build_context(text_input, questions, survey_answers, image_analysis, age_group, gender)]
+
+    # 添加明确的报告结构提示词
+    parts.append(
+        "请作为心理健康专家，基于以上信息撰写一份专业的心理健康评估报告，"
+        "报告应包括以下部分：\n"
+        + "".join(f"{i}. {title}\n" for i, (_, title) in enumerate(REPORT_SECTIONS, 1))
+        + "请使用专业且易于理解的语言，避免使用非正式或模糊的词汇。"
+    )
+    prompt = "\n\n".join(parts)
+    observe_stage('prompt_build', time.perf_counter() - build_start, service='evaluate')
+
+    # 后端由路由策略决定；重试、熔断与故障切换见 llm_client
+    backend = router.route('evaluate')
+    try:
+        content = llm_client.complete(
+            [
+                {"role": "system", "content": "你是一位资深心理健康评估专家。"},
+                {"role": "user",   "content": prompt}
+            ],
+            backend=backend,
+            priority=PRIORITY_BATCH
+        )
+    except AdmissionRejected:
+        raise
+    except Exception as e:
+        raise RuntimeError(f"评估推理调用失败: {e}")
+    return remove_think_tags(content).strip()
+
+
+def build_context(text_input: str,
+                  questions: list,
+                  survey_answers: list,
+                  image_analysis: str = None,
+                  age_group: str = None,
+                  gender: str = None) -> str:
+    """评估提示中描述用户信息的部分（不含撰写要求）"""
     parts = [
         f"年龄组：{age_group or 'unknown'}",
         f"性别：{gender or 'unknown'}",
@@ -46,60 +101,147 @@ def evaluate_all(text_input: str,
     ]
     if image_analysis:
         parts.append(f"图像分析结果：\n{image_analysis}")
+    return "\n\n".join(parts)
 
-    # 添加明确的报告结构提示词
-    parts.append(
-        "请作为心理健康专家，基于以上信息撰写一份专业的心理健康评估报告，"
-        "报告应包括以下部分：\n"
-        "1. 综合心理评价\n"
-        "2. 当前情绪状态\n"
-        "3. 工作与生活中的压力源分析\n"
-        "4. 人际关系状况评估\n"
-        "5. 建议与应对策略\n"
-        "请使用专业且易于理解的语言，避免使用非正式或模糊的词汇。"
+
+# ---------- 分段评估：本地模型并行起草，云端模型修订低置信度段落 ----------
+def draft_section(context: str, key: str, title: str) -> dict:
+    """
+    起草报告的一个部分，返回 {'content', 'confidence'}。
+    各段提示以相同的用户信息开头、撰写要求放在最后，推理服务可复用共同前缀。
+    """
+    prompt = (
+        f"{context}\n\n"
+        f"请作为心理健康专家，基于以上信息只撰写评估报告中的「{title}」部分，"
+        "使用专业且易于理解的语言。按以下模板输出纯 JSON：\n"
+        "{\"content\": \"该部分正文\", \"confidence\": 0到1之间的数字，表示依据是否充分、结论是否可靠}"
     )
-    prompt = "\n\n".join(parts)
+    data = llm_client.complete_structured(
+        [
+            {"role": "system", "content": "你是一位资深心理健康评估专家。输出严格 JSON，不要多余文本。"},
+            {"role": "user",   "content": prompt}
+        ],
+        SECTION_SCHEMA,
+        backend=router.route('evaluate_section'),
+        priority=PRIORITY_STANDARD,
+        timeout=30,
+        temperature=0.3,
+        max_tokens=600,
+        response_format={"type": "json_object"}
+    )
+    content = data['content'].strip()
+    if not content:
+        raise StructuredOutputError("段落内容为空")
+    return {'content': content, 'confidence': max(0.0, min(float(data['confidence']), 1.0))}
 
-    # 本地推理
-    if USE_LOCAL_INFERENCE:
-        payload = {
-            "model": INFERENCE_MODEL,
-            "messages": [
-                {"role": "system", "content": "你是一位资深心理健康评估专家。"},
-                {"role": "user",   "content": prompt}
-            ],
-            "stream": False
-        }
-        resp = requests.post(INFERENCE_URL, json=payload, timeout=30)
-        resp.raise_for_status()
-        data = resp.json()
-        return remove_think_tags(data["choices"][0]["message"]["content"].strip())
 
-    # 云端 DeepSeek
+def refine_section(context: str, title: str, draft: str = None) -> str:
+    """由路由到的（默认云端）模型修订一个段落；没有初稿（起草失败）时直接撰写"""
+    if draft:
+        task = (f"以下是评估报告「{title}」部分的初稿，请核对其与用户信息是否一致，"
+                f"修正不准确或依据不足的内容后输出修订后的正文：\n{draft}")
+    else:
+        task = f"请撰写评估报告中的「{title}」部分。"
+    content = llm_client.complete(
+        [
+            {"role": "system", "content": "你是一位资深心理健康评估专家。"},
+            {"role": "user",   "content": f"{context}\n\n{task}\n只输出该部分正文，不要标题或多余说明。"}
+        ],
+        backend=router.route('evaluate_refine'),
+        priority=PRIORITY_BATCH
+    )
+    return remove_think_tags(content).strip()
+
+
+def evaluate_sections(text_input: str,
+                      questions: list,
+                      survey_answers: list,
+                      image_analysis: str = None,
+                      age_group: str = None,
+                      gender: str = None,
+                      refine: bool = None):
+    """
+    分段生成评估报告的生成器，按完成顺序逐条产出事件：
+      - {'type': 'section', 'stage': 'draft', key, title, content, confidence}：初稿，五个部分同时起草；
+      - {'type': 'section', 'stage': 'refined', key, title, content}：低置信度（或起草失败）段落的修订稿；
+      - {'type': 'section', 'stage': 'failed', key, title, error}：起草与修订均失败；
+      - 最后一条 {'type': 'done', 'report': 完整报告文本}。
+    五个部分真正并行需要本地后端的并发上限（LLM_MAX_CONCURRENCY_LOCAL 与 Ollama 的 OLLAMA_NUM_PARALLEL）不小于 5。
+    """
+    refine = EVALUATE_REFINE if refine is None else refine
+    build_start = time.perf_counter()
+    context = build_context(text_input, questions, survey_answers, image_analysis, age_group, gender)
+    observe_stage('prompt_build', time.perf_counter() - build_start, service='evaluate_sections')
+
+    start = time.perf_counter()
+    titles = dict(REPORT_SECTIONS)
+    final = {}
+    pending = {}
+    executor = ThreadPoolExecutor(len(REPORT_SECTIONS), thread_name_prefix='evaluate-section')
     try:
-        resp = api_client.chat.completions.create(
-            model="deepseek-chat",
-            messages=[
-                {"role": "system", "content": "你是一位资深心理健康评估专家。"},
-                {"role": "user",   "content": prompt}
-            ],
-            stream=False
-        )
-        return remove_think_tags(resp.choices[0].message.content.strip())
-    except OpenAIError as e:
-        raise RuntimeError(f"DeepSeek 云调用失败: {e}")
+        def submit(stage, key, fn, *args):
+            # 在工作线程中沿用调用方的上下文（请求 ID、路由指定等）
+            ctx = contextvars.copy_context()
+            pending[executor.submit(ctx.run, fn, *args)] = (stage, key)
+
+        for key, title in REPORT_SECTIONS:
+            submit('draft', key, draft_section, context, key, title)
 
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, key = pending.pop(future)
+                event = {'type': 'section', 'key': key, 'title': titles[key]}
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.warning("评估段落 %s 的%s失败: %s", key, '起草' if stage == 'draft' else '修订', e)
+                    if stage == 'draft' and refine:
+                        submit('refine', key, refine_section, context, titles[key])
+                        continue
+                    if stage == 'refine' and key in final:
+                        continue  # 修订失败时保留已发出的初稿
+                    EVALUATE_SECTIONS.inc(outcome='failed')
+                    yield {**event, 'stage': 'failed', 'error': str(e)}
+                    continue
+
+                if stage == 'draft':
+                    if not final:
+                        observe_stage('first_section', time.perf_counter() - start, service='evaluate_sections')
+                    final[key] = result['content']
+                    EVALUATE_SECTIONS.inc(outcome='draft')
+                    yield {**event, 'stage': 'draft', **result}
+                    if refine and result['confidence'] < EVALUATE_REFINE_CONFIDENCE:
+                        submit('refine', key, refine_section, context, titles[key], result['content'])
+                else:
+                    final[key] = result
+                    EVALUATE_SECTIONS.inc(outcome='refined')
+                    yield {**event, 'stage': 'refined', 'content': result}
+    finally:
+        # 客户端断开（生成器被关闭）时不等待在途的推理调用，尚未开始的段落直接取消
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    report = "\n\n".join(f"{i}. {title}\n{final[key]}"
+                          for i, (key, title) in enumerate(REPORT_SECTIONS, 1) if key in final)
+    yield {'type': 'done', 'report': report}
 
 
 def analyze_image(image_path: str) -> dict:
     """
     对上传的本地图片文件进行分析，返回一个 dict 结构：
-    先将图片 Base64 编码，然后传给模型，最终解析模型输出为 JSON 或 raw 文本。
+    画布线稿只发送本地提取的绘画特征摘要；其他图片按字节预算缩放、编码为 Base64 后传给模型，
+    最终解析模型输出为 JSON 或 raw 文本。
     """
     try:
-        with open(image_path, "rb") as f:
-            raw = f.read()
-        b64 = base64.b64encode(raw).decode("utf-8")
+        img_cv = read_image(image_path) if DRAWING_FAST_PATH else None
+        if img_cv is not None and is_line_drawing(img_cv):
+            IMAGE_ANALYSIS_PATH.inc(path='drawing_features')
+            with span('preprocess', step='drawing_features'):
+                image_content = f"<DrawingFeatures>\n{summarize(extract_features(img_cv))}\n</DrawingFeatures>"
+        else:
+            IMAGE_ANALYSIS_PATH.inc(path='pixels')
+            with span('prompt_build', step='image_encode'):
+                image_content = f"<ImageData>{encode_for_prompt(image_path).data_url}</ImageData>"
     except Exception as e:
         raise RuntimeError(f"无法读取或编码图片: {e}")
 
@@ -115,59 +257,27 @@ def analyze_image(image_path: str) -> dict:
         {
             "role": "user",
             "content": (
-                f"<ImageData>data:image/jpeg;base64,{b64}</ImageData>\n\n"
+                f"{image_content}\n\n"
                 "请你基于这张图片的内容给出心理评估，"
                 "包括主要情绪倾向和置信度（0-1）。"
             )
         }
     ]
 
-    if USE_LOCAL_INFERENCE:
-        return _analyze_image_local(messages)
-    else:
-        return _analyze_image_deepseek_api(messages)
-
-
-# ... 其余 _analyze_image_deepseek_api、_analyze_image_local 和 _parse_response 保持不变 ...
-
-
-def _analyze_image_deepseek_api(messages: list) -> dict:
-    """调用 DeepSeek 云 API 进行图片分析"""
+    backend = router.route('image')
     try:
-        resp = api_client.chat.completions.create(
-            model="deepseek-chat",
-            messages=messages,
+        content = llm_client.complete(
+            messages,
+            backend=backend,
+            priority=PRIORITY_BATCH,
             temperature=0.7,
             max_tokens=500
         )
-    except OpenAIError as e:
-        raise RuntimeError(f"DeepSeek API 请求失败: {e}")
-
-    content = resp.choices[0].message.content.strip()
-    return _parse_response(content)
-
-
-def _analyze_image_local(messages: list) -> dict:
-    """调用本地推理服务进行图片分析"""
-    try:
-        r = requests.post(INFERENCE_URL, json={
-            "model": INFERENCE_MODEL,
-            "messages": messages,
-            "stream": False
-        }, timeout=60)
-        r.raise_for_status()
-    except requests.RequestException as e:
-        raise RuntimeError(f"本地推理请求失败: {e}")
-
-    data = r.json()
-    # 兼容多种字段命名
-    content = data.get("choices", [{}])[0].get("message", {}).get("content", "").strip()
-    if not content:
-        raise RuntimeError("本地推理未返回内容")
-
-    # 去除 <think> 标签
-    cleaned = re.sub(r"<think>.*?</think>", "", content, flags=re.DOTALL).strip()
-    return _parse_response(cleaned)
+    except AdmissionRejected:
+        raise
+    except Exception as e:
+        raise RuntimeError(f"图片分析推理调用失败: {e}")
+    return _parse_response(remove_think_tags(content).strip())
 
 
 def _parse_response(text: str) -> dict:
@@ -0,0 +1,258 @@
+# app/services/history.py
+
+import json
+import uuid
+import base64
+import hashlib
+import logging
+from datetime import datetime
+import numpy as np
+from flask import session
+from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt.exceptions import PyJWTError
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+from app import db
+from app.services import analytics
+from app.services.database import read_session
+from app.models import (
+    Assessment, Questionnaire, SurveyResponse, ImageAnalysis, EvaluationReport
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+KINDS = ('survey', 'image', 'evaluation')
+
+
+class Owner:
+    """评估历史的归属：登录用户（user_id）或未登录会话（anon_id），二者取其一"""
+
+    def __init__(self, user_id: int = None, anon_id: str = None):
+        self.user_id = user_id
+        self.anon_id = anon_id
+
+    def __eq__(self, other):
+        return isinstance(other, Owner) and (self.user_id, self.anon_id) == (other.user_id, other.anon_id)
+
+    __hash__ = None
+
+    def filter(self, query):
+        if self.user_id is not None:
+            return query.filter(Assessment.user_id == self.user_id)
+        return query.filter(Assessment.anon_id == self.anon_id)
+
+
+def current_owner() -> Owner:
+    """
+    从当前请求确定归属：携带有效 JWT 时为对应用户，
+    否则为会话 Cookie 中的匿名 ID（首次访问时生成，Cookie 中只保存这一个 ID）。
+    令牌过期或格式错误时同样按匿名处理：这些接口本身无需登录，不因残留的旧令牌而失败。
+    """
+    try:
+        if verify_jwt_in_request(optional=True):
+            return Owner(user_id=int(get_jwt_identity()))
+    except (JWTExtendedException, PyJWTError) as e:
+        logger.info("忽略无效的访问令牌，按匿名用户处理: %s", e)
+    anon_id = session.get('anon_id')
+    if not anon_id:
+        anon_id = session['anon_id'] = uuid.uuid4().hex
+    return Owner(anon_id=anon_id)
+
+
+# ---------- 回答向量打包 ----------
+def pack_responses(responses) -> bytes:
+    """0-3 的回答每题占 2 位，4 题一个字节（高位在前），末尾不足 4 题补 0"""
+    arr = np.asarray(responses, dtype=np.uint8)
+    padded = np.zeros(-(-len(arr) // 4) * 4, dtype=np.uint8)
+    padded[:len(arr)] = arr
+    quads = padded.reshape(-1, 4)
+    return ((quads[:, 0] << 6) | (quads[:, 1] << 4) | (quads[:, 2] << 2) | quads[:, 3]).astype(np.uint8).tobytes()
+
+
+def unpack_responses(packed: bytes, count: int) -> np.ndarray:
+    """pack_responses 的逆运算，返回长度为 count 的 uint8 数组"""
+    raw = np.frombuffer(packed, dtype=np.uint8)
+    quads = np.stack([(raw >> 6) & 3, (raw >> 4) & 3, (raw >> 2) & 3, raw & 3], axis=1)
+    return quads.ravel()[:count]
+
+
+def _packable(responses) -> bool:
+    return all(isinstance(r, int) and 0 <= r <= 3 for r in responses)
+
+
+# ---------- 写入 ----------
+def try_record(fn, *args, **kwargs):
+    """保存历史失败（如数据库不可用）只记日志，不影响已经得到的评估结果"""
+    try:
+        return fn(*args, **kwargs)
+    except Exception:
+        db.session.rollback()
+        logger.exception("保存评估历史失败: %s", fn.__name__)
+        return None
+
+
+def _get_questionnaire(questions: list) -> Questionnaire:
+    payload = json.dumps(questions, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    digest = hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    questionnaire = Questionnaire.query.filter_by(sha256=digest).first()
+    if questionnaire is not None:
+        return questionnaire
+    questionnaire = Questionnaire(sha256=digest, question_count=len(questions), questions=questions)
+    try:
+        # 保存点内插入，并发插入同一问卷时只回滚这一步
+        with db.session.begin_nested():
+            db.session.add(questionnaire)
+    except IntegrityError:
+        questionnaire = Questionnaire.query.filter_by(sha256=digest).one()
+    return questionnaire
+
+
+def _new_assessment(owner: Owner, kind: str, **fields) -> Assessment:
+    assessment = Assessment(user_id=owner.user_id, anon_id=owner.anon_id, kind=kind, **fields)
+    db.session.add(assessment)
+    return assessment
+
+
+def record_survey(owner: Owner, questions: list, responses: list, result: dict,
+                  age_group: str = None, gender: str = None):
+    """保存一次问卷提交；回答不是 0-3 的整数（评估本身已失败）时不保存，返回 None"""
+    if len(questions) != len(responses) or not _packable(responses):
+        return None
+    score = result.get('score')
+    assessment = _new_assessment(
+        owner, 'survey',
+        score=float(score) if isinstance(score, (int, float)) else None,
+        risk_level=result.get('risk_level'),
+        created_at=datetime.utcnow()
+    )
+    assessment.survey = SurveyResponse(
+        questionnaire=_get_questionnaire(questions),
+        responses=pack_responses(responses),
+        response_count=len(responses),
+        age_group=age_group, gender=gender, result=result
+    )
+    # 趋势汇总与记录在同一事务内提交
+    analytics.update_on_survey(owner, assessment, assessment.survey)
+    db.session.commit()
+    return assessment
+
+
+def record_image_analysis(owner: Owner, image_id: int, result: dict) -> Assessment:
+    assessment = _new_assessment(owner, 'image', emotion=(result.get('emotion') or None))
+    assessment.image_analysis = ImageAnalysis(image_id=image_id, analysis=result.get('analysis'))
+    db.session.commit()
+    return assessment
+
+
+def record_evaluation(owner: Owner, report: str, age_group: str = None, gender: str = None,
+                      text_input: str = None) -> Assessment:
+    assessment = _new_assessment(owner, 'evaluation')
+    assessment.evaluation = EvaluationReport(
+        age_group=age_group, gender=gender, text_input=text_input, report=report
+    )
+    db.session.commit()
+    return assessment
+
+
+# ---------- 查询 ----------
+def encode_cursor(assessment: Assessment) -> str:
+    raw = f"{assessment.created_at.isoformat()}|{assessment.id}"
+    return base64.urlsafe_b64encode(raw.encode('ascii')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """解析游标，格式不正确时抛出 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('ascii')
+        created_at, assessment_id = raw.split('|')
+        return datetime.fromisoformat(created_at), int(assessment_id)
+    except Exception:
+        raise ValueError('无效的分页游标')
+
+
+def list_history(owner: Owner, kind: str = None, limit: int = DEFAULT_PAGE_SIZE, cursor: str = None) -> tuple:
+    """
+    按时间倒序返回一页评估记录，返回 (记录列表, 下一页游标或 None)。
+    游标为上一页最后一条的 (created_at, id)，查询沿 (归属, created_at, id) 索引定位，
+    翻到第几页都不需要 OFFSET 扫描。配置了只读副本时在副本上查询。
+    """
+    limit = max(1, min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE))
+    query = owner.filter(read_session().query(Assessment))
+    if kind:
+        query = query.filter(Assessment.kind == kind)
+    if kind == 'survey':
+        # 问卷列表需要明细，一次 JOIN 取回，避免逐条懒加载
+        query = query.options(joinedload(Assessment.survey).joinedload(SurveyResponse.questionnaire))
+    if cursor:
+        created_at, assessment_id = decode_cursor(cursor)
+        query = query.filter(db.or_(
+            Assessment.created_at < created_at,
+            db.and_(Assessment.created_at == created_at, Assessment.id < assessment_id)
+        ))
+    rows = query.order_by(Assessment.created_at.desc(), Assessment.id.desc()).limit(limit + 1).all()
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def get_assessment(owner: Owner, assessment_id: int):
+    return owner.filter(read_session().query(Assessment)).filter(Assessment.id == assessment_id).first()
+
+
+def delete_history(owner: Owner, kind: str = None) -> int:
+    """删除归属下的评估记录（可按类别），返回删除条数"""
+    query = owner.filter(db.session.query(Assessment.id))
+    if kind:
+        query = query.filter(Assessment.kind == kind)
+    ids = query.scalar_subquery()
+    # 批量删除，不逐条加载；明细表先删，不依赖数据库的级联设置
+    for detail in (SurveyResponse, ImageAnalysis, EvaluationReport):
+        db.session.query(detail).filter(detail.assessment_id.in_(ids)).delete(synchronize_session=False)
+    deleted = owner.filter(Assessment.query)
+    if kind:
+        deleted = deleted.filter(Assessment.kind == kind)
+    count = deleted.delete(synchronize_session=False)
+    if kind in (None, 'survey'):
+        analytics.reset(owner)
+    db.session.commit()
+    return count
+
+
+def survey_to_dict(assessment: Assessment) -> dict:
+    """问卷记录，字段与原先会话中的 survey_history 条目一致，另加 id 与时间"""
+    survey = assessment.survey
+    return {
+        'id': assessment.id,
+        'created_at': assessment.created_at.isoformat(),
+        'questions': survey.questionnaire.questions,
+        'responses': unpack_responses(survey.responses, survey.response_count).tolist(),
+        'result': survey.result,
+        'ageGroup': survey.age_group,
+        'gender': survey.gender,
+    }
+
+
+def to_dict(assessment: Assessment, detail: bool = False) -> dict:
+    """列表只返回摘要字段；detail=True 时附带明细"""
+    data = {
+        'id': assessment.id,
+        'kind': assessment.kind,
+        'created_at': assessment.created_at.isoformat(),
+        'score': assessment.score,
+        'risk_level': assessment.risk_level,
+        'emotion': assessment.emotion,
+    }
+    if not detail:
+        return data
+    if assessment.kind == 'survey' and assessment.survey is not None:
+        data.update(survey_to_dict(assessment))
+    elif assessment.kind == 'image' and assessment.image_analysis is not None:
+        image = assessment.image_analysis
+        data.update(image_id=image.image_id, analysis=image.analysis)
+    elif assessment.kind == 'evaluation' and assessment.evaluation is not None:
+        report = assessment.evaluation
+        data.update(ageGroup=report.age_group, gender=report.gender,
+                    text=report.text_input, report=report.report)
+    return data
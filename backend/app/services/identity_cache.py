@@ -0,0 +1,62 @@
+# app/services/identity_cache.py
+
+import time
+import threading
+from collections import OrderedDict
+from app.services.metrics import registry
+
+IDENTITY_CACHE_LOOKUPS = registry.counter(
+    'identity_cache_lookups_total', '用户身份缓存查询次数（outcome=hit/miss）')
+
+
+class IdentityCache:
+    """
+    JWT 鉴权请求的用户身份短期缓存：user_id -> 不含敏感字段的用户信息。
+    只在进程内缓存 AUTH_IDENTITY_TTL 秒，条目数超过上限时淘汰最久未使用的；
+    用户信息变化（如删除、改邮箱）时调用 invalidate，其他进程最多延迟一个 TTL 生效。
+    """
+
+    def __init__(self, app=None):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.ttl = 30.0
+        self.max_size = 10000
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.ttl = app.config.get('AUTH_IDENTITY_TTL', self.ttl)
+        self.max_size = app.config.get('AUTH_IDENTITY_CACHE_SIZE', self.max_size)
+
+    def get(self, user_id: int):
+        """命中且未过期时返回缓存的用户信息，否则返回 None"""
+        if self.ttl <= 0:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                IDENTITY_CACHE_LOOKUPS.inc(outcome='hit')
+                return entry[1]
+            if entry is not None:
+                del self._entries[user_id]
+        IDENTITY_CACHE_LOOKUPS.inc(outcome='miss')
+        return None
+
+    def set(self, user_id: int, identity: dict) -> None:
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, identity)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int = None) -> None:
+        """删除单个用户的缓存；不传 user_id 时清空"""
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
@@ -0,0 +1,160 @@
+# app/services/image_encoder.py
+
+import io
+import os
+import base64
+import logging
+import numpy as np
+from PIL import Image
+from app.services.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# ---------- 配置项 ----------
+IMAGE_PAYLOAD_MAX_BYTES = int(os.getenv("IMAGE_PAYLOAD_MAX_BYTES", "60000"))  # Base64 后的字节预算
+IMAGE_PAYLOAD_MAX_SIDE  = int(os.getenv("IMAGE_PAYLOAD_MAX_SIDE", "512"))     # 长边上限（像素）
+IMAGE_PAYLOAD_MIN_SIDE  = int(os.getenv("IMAGE_PAYLOAD_MIN_SIDE", "128"))     # 为满足预算最多缩到的长边
+IMAGE_PAYLOAD_QUALITY   = int(os.getenv("IMAGE_PAYLOAD_QUALITY", "80"))       # 照片的初始有损质量
+IMAGE_PAYLOAD_MIN_QUALITY = int(os.getenv("IMAGE_PAYLOAD_MIN_QUALITY", "45")) # 降质量的下限，再不够则缩小尺寸
+IMAGE_PAYLOAD_WEBP      = os.getenv("IMAGE_PAYLOAD_WEBP", "0") == "1"         # 照片使用 WebP（需上游支持）
+
+# 内容判定阈值
+_GRAY_CHROMA     = 24     # 99% 像素的通道差都低于该值时视为灰度图
+_DRAWING_BG_FRAC = 0.4    # 最多的颜色占比超过该值
+_DRAWING_COLORS  = 512    # 且 15 位量化后的颜色数少于该值时视为线稿
+
+IMAGE_PAYLOAD_BYTES = registry.histogram(
+    'image_payload_bytes', '发往推理服务的图片 Base64 字节数',
+    buckets=(4096, 8192, 16384, 32768, 65536, 131072, 262144, 524288, 1048576, 4194304))
+
+MIME_TYPES = {'PNG': 'image/png', 'JPEG': 'image/jpeg', 'WEBP': 'image/webp'}
+
+
+class EncodedImage:
+    """编码结果：Base64 字符串及其格式、尺寸与内容类别"""
+
+    def __init__(self, b64: str, fmt: str, width: int, height: int, kind: str, grayscale: bool, quality=None):
+        self.b64 = b64
+        self.format = fmt
+        self.width = width
+        self.height = height
+        self.kind = kind
+        self.grayscale = grayscale
+        self.quality = quality
+
+    @property
+    def mime(self) -> str:
+        return MIME_TYPES[self.format]
+
+    @property
+    def data_url(self) -> str:
+        return f"data:{self.mime};base64,{self.b64}"
+
+    @property
+    def size(self) -> int:
+        return len(self.b64)
+
+    def describe(self) -> dict:
+        return {
+            'format': self.format, 'width': self.width, 'height': self.height, 'bytes': self.size,
+            'kind': self.kind, 'grayscale': self.grayscale, 'quality': self.quality,
+        }
+
+
+def flatten(img: Image.Image) -> Image.Image:
+    """透明背景（如前端画布导出）合成到白底，其余模式统一转为 RGB"""
+    if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+        rgba = img.convert('RGBA')
+        canvas = Image.new('RGB', rgba.size, (255, 255, 255))
+        canvas.paste(rgba, mask=rgba.getchannel('A'))
+        return canvas
+    return img.convert('RGB')
+
+
+def classify_pixels(arr: np.ndarray) -> tuple:
+    """
+    对已缩小的 3 通道像素数组（RGB 或 BGR 均可）判断内容类别，返回 (kind, grayscale)：
+      - kind='drawing'：大面积单一底色且颜色很少（画布线稿、草图），适合无损 PNG
+      - kind='photo'：其余情况，适合有损 JPEG/WebP
+    """
+    arr = arr.astype(np.int16, copy=False)
+    chroma = arr.max(axis=2) - arr.min(axis=2)
+    grayscale = bool(np.percentile(chroma, 99) < _GRAY_CHROMA)
+
+    q = arr >> 3
+    codes = (q[..., 0] << 10) | (q[..., 1] << 5) | q[..., 2]
+    _, counts = np.unique(codes, return_counts=True)
+    dominant = counts.max() / codes.size
+    kind = 'drawing' if dominant > _DRAWING_BG_FRAC and len(counts) < _DRAWING_COLORS else 'photo'
+    return kind, grayscale
+
+
+def classify(img: Image.Image) -> tuple:
+    """在 128px 缩略图上粗略判断 PIL 图像的内容类别，见 classify_pixels"""
+    probe = img.copy()
+    # 最近邻采样保留原始像素颜色，避免插值在笔画边缘产生大量过渡色
+    probe.thumbnail((128, 128), Image.NEAREST)
+    return classify_pixels(np.asarray(probe))
+
+
+def _encode(img: Image.Image, kind: str, grayscale: bool, quality: int) -> tuple:
+    """按内容类别编码一次，返回 (bytes, format)"""
+    buffer = io.BytesIO()
+    if grayscale:
+        img = img.convert('L')
+    if kind == 'drawing':
+        if not grayscale:
+            # 线稿颜色很少，量化为调色板后 PNG 明显更小且笔画不失真
+            img = img.quantize(colors=32, method=Image.Quantize.MEDIANCUT, dither=Image.Dither.NONE)
+        img.save(buffer, format='PNG', optimize=True)
+        return buffer.getvalue(), 'PNG'
+    fmt = 'WEBP' if IMAGE_PAYLOAD_WEBP else 'JPEG'
+    if fmt == 'WEBP':
+        img.save(buffer, format='WEBP', quality=quality, method=4)
+    else:
+        img.save(buffer, format='JPEG', quality=quality, optimize=True, progressive=True)
+    return buffer.getvalue(), fmt
+
+
+def encode_for_prompt(source, max_bytes: int = None, max_side: int = None) -> EncodedImage:
+    """
+    将图片（路径、文件对象或 PIL.Image）编码为适合放入提示词的 Base64：
+    按内容选择格式，先在 max_side 内降低有损质量，仍超出 max_bytes 时逐步缩小尺寸，
+    直到满足预算或到达 IMAGE_PAYLOAD_MIN_SIDE。
+    """
+    max_bytes = max_bytes or IMAGE_PAYLOAD_MAX_BYTES
+    max_side = max_side or IMAGE_PAYLOAD_MAX_SIDE
+
+    if isinstance(source, Image.Image):
+        img = flatten(source)
+    else:
+        with Image.open(source) as opened:
+            opened.seek(0)
+            img = flatten(opened)
+    kind, grayscale = classify(img)
+
+    # Base64 膨胀 4/3，预算换算为原始字节
+    raw_budget = max_bytes * 3 // 4
+    side = max_side
+    while True:
+        scaled = img.copy()
+        # 线稿用面积平均缩放：细笔画不会丢失，且过渡色少于 LANCZOS，PNG 更小
+        scaled.thumbnail((side, side), Image.BOX if kind == 'drawing' else Image.LANCZOS)
+        quality = IMAGE_PAYLOAD_QUALITY
+        data, fmt = _encode(scaled, kind, grayscale, quality)
+        while kind == 'photo' and len(data) > raw_budget and quality > IMAGE_PAYLOAD_MIN_QUALITY:
+            quality = max(IMAGE_PAYLOAD_MIN_QUALITY, quality - 10)
+            data, fmt = _encode(scaled, kind, grayscale, quality)
+        if len(data) <= raw_budget or side <= IMAGE_PAYLOAD_MIN_SIDE:
+            break
+        side = max(IMAGE_PAYLOAD_MIN_SIDE, int(side * 0.75))
+
+    encoded = EncodedImage(
+        base64.b64encode(data).decode('ascii'), fmt, scaled.width, scaled.height,
+        kind, grayscale, quality if kind == 'photo' else None
+    )
+    IMAGE_PAYLOAD_BYTES.observe(encoded.size, format=fmt, kind=kind)
+    if encoded.size > max_bytes:
+        logger.warning("图片在最小尺寸下仍超出预算: %d > %d 字节", encoded.size, max_bytes)
+    logger.info("图片载荷 %d 字节（%s %dx%d，%s）", encoded.size, fmt, encoded.width, encoded.height, kind)
+    return encoded
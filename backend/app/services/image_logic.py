@@ -1,49 +1,34 @@
 # app/services/image_logic.py
 
-import os
-import io
-import base64
-import json
-import re
-import requests
 import logging
-from openai import OpenAI, OpenAIError
-from PIL import Image
-
-# ---------- 配置项 ----------
-DEEPSEEK_API_KEY    = os.getenv("DEEPSEEK_API_KEY", "sk-e1927ee1ea204a22b49fa3667f70a033")
-DEEPSEEK_BASE_URL   = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com")
-USE_LOCAL_INFERENCE = False  # True 使用本地推理服务，False 使用 DeepSeek API
-INFERENCE_URL       = os.getenv("INFERENCE_URL", "http://localhost:11434")
-INFERENCE_MODEL     = os.getenv("INFERENCE_MODEL", "deepseek-r1:1.5b")
-
-# 日志
-logging.basicConfig(level=logging.DEBUG)
+from app.services import llm_client
+from app.services.image_encoder import encode_for_prompt
+from app.services.drawing_features import summarize
+from app.services.structured_output import IMAGE_SCHEMA, StructuredOutputError
+from app.services.llm_governor import AdmissionRejected, PRIORITY_STANDARD
+from app.services.metrics import span
+from app.services.model_router import router
+
+# 日志（输出方式由 create_app 统一配置）
 logger = logging.getLogger(__name__)
 
-# 初始化 DeepSeek 客户端
-api_client = OpenAI(api_key=DEEPSEEK_API_KEY, base_url=DEEPSEEK_BASE_URL)
-
 
-def analyze_image(image_path: str) -> dict:
+def analyze_image(image_path, prediction=None, priority: int = PRIORITY_STANDARD) -> dict:
     """
     对图片进行心理评估。优先使用本地推理，否则调用 DeepSeek API。
+    image_path 可以是文件路径、文件对象或 PIL.Image。
+    prediction 为本地表情分类结果（EmotionPrediction）：置信度足够时直接返回，
+    否则作为参考信息加入提示词。
     返回 JSON 对象，仅包括：
       - emotion: string
       - analysis: string
     """
-    # 1. 打开并压缩图像
-    with Image.open(image_path) as img:
-        max_dimensions = (512, 512)
-        img.thumbnail(max_dimensions, Image.LANCZOS)
+    if prediction is not None and prediction.confident:
+        return prediction.as_result()
 
-        # 将图像保存到内存中
-        buffered = io.BytesIO()
-        img.save(buffered, format="PNG")
-        raw = buffered.getvalue()
-
-    # 2. Base64 编码
-    b64 = base64.b64encode(raw).decode("utf-8")
+    # 1-2. 按内容与字节预算选择尺寸和格式，并 Base64 编码
+    with span('prompt_build', step='image_encode'):
+        encoded = encode_for_prompt(image_path)
 
     # 3. 构造提示词，指定 emotion 和 analysis，并加入严格 JSON 指令
     system_prompt = (
@@ -60,117 +45,63 @@ def analyze_image(image_path: str) -> dict:
         "现在对以下 Base64 图片数据进行分析，并仅以纯 JSON 格式输出上述格式，\n"
         "请严格使用中文回答，不要多余说明。"
     )
+    if prediction is not None:
+        user_prompt += f"\n（参考：本地表情模型的初步判断为 {prediction.describe()}，置信度较低，请结合图片自行判断。）"
 
     messages = [
         {"role": "system", "content": system_prompt},
         {"role": "user",   "content": user_prompt},
-        {"role": "user",   "content": f"data:image/png;base64,{b64}"}
+        {"role": "user",   "content": encoded.data_url}
     ]
 
-    # 4. 调用推理
-    if USE_LOCAL_INFERENCE:
-        raw_resp = _invoke_local(messages)
-    else:
-        raw_resp = _invoke_deepseek(messages)
+    return _request_analysis(messages, priority)
+
 
-    # 5. 提取并解析 JSON
-    return _safe_parse_json(raw_resp)
+def analyze_drawing_features(features: dict, priority: int = PRIORITY_STANDARD) -> dict:
+    """
+    线稿快速通道：以本地提取的绘画特征摘要代替像素发送给模型，
+    返回结构与 analyze_image 相同。
+    """
+    system_prompt = (
+        "你是一位资深心理学家助手，熟悉绘画投射分析。\n"
+        "用户在画布上完成了一幅手绘图，下面给出从图中提取的客观特征。\n"
+        "请严格只返回一个 JSON 对象，且仅包含 emotion 和 analysis 两个字段，\n"
+        "不要包含任何多余文字或标记，并使用中文回答。"
+    )
+    user_prompt = (
+        "绘画特征：\n"
+        f"{summarize(features)}\n\n"
+        "请据此推断作画者的主要情绪，按以下模板输出纯 JSON：\n"
+        "{\"emotion\": \"主要情绪，如 高兴, 伤心, 平静 等\", \"analysis\": \"简洁分析说明\"}"
+    )
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user",   "content": user_prompt}
+    ]
+    return _request_analysis(messages, priority)
 
 
-def _invoke_deepseek(messages: list) -> str:
-    """调用 DeepSeek 云 API 并返回原始文本或 JSON"""
+def _request_analysis(messages: list, priority: int) -> dict:
+    # 4. 流式调用推理：后端由路由策略决定，两个字段齐全即停止生成（重试、熔断、故障切换见 llm_client）
+    backend = router.route('image')
     try:
-        resp = api_client.chat.completions.create(
-            model="deepseek-chat",
-            messages=messages,
+        data = llm_client.complete_structured(
+            messages,
+            IMAGE_SCHEMA,
+            backend=backend,
+            priority=priority,
             temperature=0.7,
             max_tokens=500,
             response_format={"type": "json_object"}
         )
-    except OpenAIError as e:
-        logger.error("DeepSeek API 调用失败: %s", e)
-        raise RuntimeError(f"DeepSeek API 调用失败: {e}")
-
-    # 调试输出完整响应
-    logger.debug("DeepSeek full response: %r", resp)
-
-    choice = resp.choices[0]
-    msg = getattr(choice, 'message', choice)
-
-    # 优先使用结构化 JSON 字段
-    json_data = None
-    if hasattr(msg, 'json') and isinstance(msg.json, (dict, list)):
-        json_data = msg.json
-    elif isinstance(msg, dict) and 'json' in msg:
-        json_data = msg['json']
-
-    if json_data is not None:
-        return json.dumps(json_data)
-
-    # 回退到 content
-    content = (getattr(msg, 'content', None) or '').strip()
-    if not content:
-        logger.warning("DeepSeek 返回空内容，消息: %r", choice)
-        raise RuntimeError("DeepSeek 返回空内容，请检查提示或模型状态。")
-    return content
-
-
-def _invoke_local(messages: list) -> str:
-    """调用本地推理服务 (Ollama HTTP API) 并返回原始文本或 JSON"""
-    url = f"{INFERENCE_URL.rstrip('/')}/v1/chat/completions"
-    payload = {
-        "model": INFERENCE_MODEL,
-        "messages": messages,
-        "temperature": 0.7,
-        "max_tokens": 500,
-        "stream": False,
-        "response_format": {"type": "json_object"}
-    }
-    r = requests.post(url, json=payload, timeout=60)
-    r.raise_for_status()
-    data = r.json()
-
-    logger.debug("本地推理完整响应: %s", data)
-
-    # 本地推理返回格式处理
-    if "choices" in data and data["choices"]:
-        msg = data["choices"][0].get("message", {})
-        if isinstance(msg, dict) and 'json' in msg:
-            return json.dumps(msg['json'])
-        return (msg.get('content') or '').strip()
-
-    fallback = data.get("message", {}).get("content", "").strip()
-    if not fallback:
-        logger.warning("本地推理返回空内容: %s", data)
-        raise RuntimeError("本地推理返回空内容，请检查服务状态。")
-    return fallback
-
-
-def _extract_json_block(text: str) -> str:
-    """
-    从文本中提取 JSON 区块：
-    1. 匹配 ```json ... ```
-    2. 否则提取第一个 { ... }
-    """
-    m = re.search(r"```json\s*(\{.*?\})\s*```", text, re.S)
-    if m:
-        return m.group(1)
-    start = text.find("{")
-    end = text.rfind("}")
-    if start != -1 and end != -1 and end > start:
-        return text[start:end+1]
-    return text
-
-
-def _safe_parse_json(text: str) -> dict:
-    """
-    尝试解析 JSON；解析失败则以原文为 analysis，
-    emotion 默认为 None。
-    """
-    clean = _extract_json_block(text).strip()
-    try:
-        data = json.loads(clean)
-        return {"emotion": data.get("emotion"), "analysis": data.get("analysis")}  
-    except json.JSONDecodeError:
-        logger.error("JSON 解析失败: %s", clean)
-        return {"emotion": None, "analysis": text.strip()}
+    except StructuredOutputError as e:
+        # 5. 无法修复为 JSON 时，以原文作为 analysis
+        logger.error("JSON 解析失败: %s", e)
+        return {"emotion": None, "analysis": e.text.strip()}
+    except AdmissionRejected:
+        raise
+    except Exception as e:
+        logger.error("图片分析推理调用失败: %s", e)
+        raise RuntimeError(f"图片分析推理调用失败: {e}")
+
+    return {"emotion": data.get("emotion"), "analysis": data.get("analysis")}
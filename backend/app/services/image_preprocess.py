@@ -0,0 +1,308 @@
+# app/services/image_preprocess.py
+
+import io
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context, shared_memory
+
+import cv2
+import numpy as np
+from PIL import Image
+from app.services.metrics import registry, observe_stage
+
+logger = logging.getLogger(__name__)
+
+# ---------- 配置项 ----------
+# 进程数为 0 时在调用线程内直接处理（便于本地调试）
+IMAGE_POOL_WORKERS      = int(os.getenv("IMAGE_POOL_WORKERS", str(os.cpu_count() or 2)))
+# 除正在执行的任务外，最多允许排队等待的任务数
+IMAGE_POOL_QUEUE        = int(os.getenv("IMAGE_POOL_QUEUE", str(IMAGE_POOL_WORKERS * 2)))
+# 队列已满时最多等待多久（秒），超时则拒绝
+IMAGE_POOL_WAIT_TIMEOUT = float(os.getenv("IMAGE_POOL_WAIT_TIMEOUT", "2"))
+# 单个任务的最长处理时间（秒），超时则放弃等待
+IMAGE_POOL_TASK_TIMEOUT = float(os.getenv("IMAGE_POOL_TASK_TIMEOUT", "30"))
+
+
+class PreprocessPoolSaturated(RuntimeError):
+    """预处理进程池已满，调用方应返回 503 并提示稍后重试"""
+
+
+class _TaskTimeout(PreprocessPoolSaturated):
+    """等待超时但子进程仍在执行的任务；其名额要到任务真正结束才归还"""
+
+    def __init__(self, message: str, future):
+        super().__init__(message)
+        self.future = future
+
+
+# ---------- 读取 ----------
+def read_image(path: str):
+    """
+    读取上传图片为 BGR 数组，无法解码时返回 None。
+    带透明通道的图片（前端画布导出的 PNG 底色透明）合成到白底，
+    否则 cv2.imread 会把透明区域变成黑色，黑色笔迹随之消失。
+    """
+    if not _has_alpha(path):
+        return cv2.imread(path)
+    img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if img is None or img.ndim != 3 or img.shape[2] != 4:
+        return cv2.imread(path)
+    return _composite_white(img)
+
+
+def decode_image(data: bytes):
+    """同 read_image，输入为内存中的文件内容（批量分析、压缩包成员等）"""
+    buf = np.frombuffer(data, dtype=np.uint8)
+    if not _has_alpha(io.BytesIO(data)):
+        return cv2.imdecode(buf, cv2.IMREAD_COLOR)
+    img = cv2.imdecode(buf, cv2.IMREAD_UNCHANGED)
+    if img is None or img.ndim != 3 or img.shape[2] != 4:
+        return cv2.imdecode(buf, cv2.IMREAD_COLOR)
+    return _composite_white(img)
+
+
+def _has_alpha(source) -> bool:
+    # 只读取文件头判断模式，不解码像素
+    try:
+        with Image.open(source) as probe:
+            return probe.mode in ('RGBA', 'LA') or (probe.mode == 'P' and 'transparency' in probe.info)
+    except Exception:
+        return False
+
+
+def _composite_white(img: np.ndarray) -> np.ndarray:
+    if img.dtype != np.uint8:
+        img = (img / 257).astype(np.uint8)
+    alpha = img[..., 3:4].astype(np.float32) / 255.0
+    white = np.full_like(img[..., :3], 255, dtype=np.float32)
+    return (img[..., :3] * alpha + white * (1 - alpha)).astype(np.uint8)
+
+
+# ---------- 纯函数：预处理流程 ----------
+_face_cascade = None
+
+
+def _get_face_cascade():
+    # 每个进程只加载一次 Haar 分类器
+    global _face_cascade
+    if _face_cascade is None:
+        _face_cascade = cv2.CascadeClassifier(
+            cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+        )
+    return _face_cascade
+
+
+def clahe_equalize(img_cv: np.ndarray) -> np.ndarray:
+    """转 LAB 对亮度通道做 CLAHE 均衡化"""
+    lab = cv2.cvtColor(img_cv, cv2.COLOR_BGR2LAB)
+    l_channel, a_channel, b_channel = cv2.split(lab)
+    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+    cl = clahe.apply(l_channel)
+    merged_lab = cv2.merge((cl, a_channel, b_channel))
+    return cv2.cvtColor(merged_lab, cv2.COLOR_LAB2BGR)
+
+
+def denoise(img_cv: np.ndarray) -> np.ndarray:
+    """彩色 NL-means 去噪"""
+    return cv2.fastNlMeansDenoisingColored(
+        img_cv, None, h=10, hColor=10, templateWindowSize=7, searchWindowSize=21
+    )
+
+
+def _crop_face(img_cv: np.ndarray) -> tuple:
+    gray = cv2.cvtColor(img_cv, cv2.COLOR_BGR2GRAY)
+    faces = _get_face_cascade().detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5)
+    if len(faces) > 0:
+        x, y, w, h = faces[0]
+        return img_cv[y:y+h, x:x+w], True
+    return img_cv, False
+
+
+def crop_face(img_cv: np.ndarray) -> np.ndarray:
+    """检测到人脸时裁剪第一张人脸区域，否则原样返回"""
+    return _crop_face(img_cv)[0]
+
+
+def preprocess_with_face(img_cv: np.ndarray) -> tuple:
+    """同 preprocess_array，额外返回是否检测到并裁剪了人脸"""
+    return _crop_face(denoise(clahe_equalize(img_cv)))
+
+
+def preprocess_array(img_cv: np.ndarray) -> np.ndarray:
+    """
+    对 BGR 图像执行：CLAHE 均衡化 → 彩色去噪 → 人脸检测与裁剪。
+    返回处理后的 BGR 图像（可能是原图的一个裁剪区域）。
+    """
+    return preprocess_with_face(img_cv)[0]
+
+
+# ---------- 子进程入口 ----------
+def _init_worker():
+    # 由进程池负责并行，避免每个进程内 OpenCV 再开多线程造成超订
+    cv2.setNumThreads(1)
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    try:
+        # Python 3.13+：仅附加，不向 resource tracker 登记（由父进程负责释放）
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+def _preprocess_shm(name: str, shape: tuple) -> tuple:
+    """
+    在共享内存上原地处理：从缓冲区读取输入图像，
+    将结果写回同一缓冲区开头，仅返回结果形状与是否裁剪了人脸，像素数据不经过 pickle。
+    """
+    shm = _attach(name)
+    src = out = None
+    try:
+        src = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+        out, face_found = preprocess_with_face(src)
+        out = np.ascontiguousarray(out)
+        np.ndarray(out.shape, dtype=np.uint8, buffer=shm.buf)[...] = out
+        return out.shape, face_found
+    finally:
+        # 先释放指向缓冲区的数组视图（结果可能是输入的切片），否则 close 抛出 BufferError 掩盖原始异常
+        src = out = None
+        shm.close()
+
+
+# ---------- 进程池 ----------
+class PreprocessPool:
+    """
+    有界的预处理进程池：
+    - 同时在途（执行 + 排队）的任务数不超过 workers + queue_size
+    - 超出时最多等待 wait_timeout 秒，仍无空位则抛出 PreprocessPoolSaturated
+    - stats() 提供队列深度与服务耗时等指标
+    """
+
+    def __init__(self, workers: int, queue_size: int, wait_timeout: float, task_timeout: float = 30.0):
+        self.workers = workers
+        self.wait_timeout = wait_timeout
+        self.task_timeout = task_timeout
+        self._slots = threading.BoundedSemaphore(max(1, workers) + max(0, queue_size))
+        self._executor = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._completed = 0
+        self._rejected = 0
+        self._service_total = 0.0
+        self._service_max = 0.0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=get_context('spawn'),
+                    initializer=_init_worker
+                )
+            return self._executor
+
+    def run(self, img_cv: np.ndarray) -> tuple:
+        """
+        执行预处理，返回 (结果图像, 是否裁剪到人脸)；池满时抛出 PreprocessPoolSaturated
+        """
+        wait_start = time.perf_counter()
+        acquired = self._slots.acquire(timeout=self.wait_timeout)
+        observe_stage('queue_wait', time.perf_counter() - wait_start, backend='preprocess_pool')
+        if not acquired:
+            with self._lock:
+                self._rejected += 1
+            raise PreprocessPoolSaturated('图像预处理繁忙，请稍后重试')
+
+        with self._lock:
+            self._in_flight += 1
+        start = time.perf_counter()
+        release_slot = True
+        try:
+            if self.workers <= 0:
+                return preprocess_with_face(img_cv)
+            return self._run_in_pool(np.ascontiguousarray(img_cv, dtype=np.uint8))
+        except _TaskTimeout as e:
+            # 子进程中的任务无法取消，仍占着一个 worker：名额随任务结束归还，
+            # 否则每次超时都会多放进一个请求，堆积在进程池无界的内部队列中
+            release_slot = False
+            e.future.add_done_callback(lambda _: self._slots.release())
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            observe_stage('preprocess', elapsed, step='pool_service')
+            with self._lock:
+                self._in_flight -= 1
+                self._completed += 1
+                self._service_total += elapsed
+                self._service_max = max(self._service_max, elapsed)
+            if release_slot:
+                self._slots.release()
+
+    def _run_in_pool(self, img: np.ndarray) -> tuple:
+        shm = shared_memory.SharedMemory(create=True, size=img.nbytes)
+        try:
+            np.ndarray(img.shape, dtype=np.uint8, buffer=shm.buf)[...] = img
+            executor = self._get_executor()
+            try:
+                future = executor.submit(_preprocess_shm, shm.name, img.shape)
+                out_shape, face_found = future.result(timeout=self.task_timeout)
+            except BrokenProcessPool:
+                # 子进程异常退出（OOM、段错误等）后该进程池不再可用，丢弃并在下次调用时重建
+                self._discard(executor)
+                raise PreprocessPoolSaturated('图像预处理进程异常退出，请稍后重试')
+            except FutureTimeout:
+                # 尚在排队时可以取消（随即完成并归还名额），已在执行的只能等它结束
+                future.cancel()
+                raise _TaskTimeout(f'图像预处理超过 {self.task_timeout:.0f} 秒未完成', future)
+            return np.ndarray(out_shape, dtype=np.uint8, buffer=shm.buf).copy(), face_found
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def _discard(self, executor: ProcessPoolExecutor):
+        with self._lock:
+            # 并发请求可能已替换过进程池，只丢弃出错的那一个
+            if self._executor is executor:
+                self._executor = None
+        logger.error("预处理进程池已损坏，将重建")
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            running = min(self._in_flight, max(1, self.workers))
+            return {
+                'workers': self.workers,
+                'in_flight': self._in_flight,
+                'queue_depth': self._in_flight - running,
+                'completed': self._completed,
+                'rejected': self._rejected,
+                'service_seconds_total': self._service_total,
+                'service_seconds_max': self._service_max,
+                'service_seconds_avg': (self._service_total / self._completed) if self._completed else 0.0,
+            }
+
+    def reset_after_fork(self):
+        """fork 出的子进程中调用：父进程的进程池及其管理线程不可用，丢弃后按需重建"""
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+preprocess_pool = PreprocessPool(IMAGE_POOL_WORKERS, IMAGE_POOL_QUEUE, IMAGE_POOL_WAIT_TIMEOUT,
+                                 IMAGE_POOL_TASK_TIMEOUT)
+
+registry.gauge('preprocess_pool_in_flight', '预处理进程池在途任务数',
+               lambda: [({}, preprocess_pool.stats()['in_flight'])])
+registry.gauge('preprocess_pool_queue_depth', '预处理进程池排队任务数',
+               lambda: [({}, preprocess_pool.stats()['queue_depth'])])
+registry.gauge('preprocess_pool_rejected', '预处理进程池累计拒绝数',
+               lambda: [({}, preprocess_pool.stats()['rejected'])])
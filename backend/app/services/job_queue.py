@@ -0,0 +1,182 @@
+# app/services/job_queue.py
+
+import time
+import uuid
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from app.services.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# 任务状态
+QUEUED    = 'queued'
+RUNNING   = 'running'
+SUCCEEDED = 'succeeded'
+FAILED    = 'failed'
+TERMINAL_STATES = {SUCCEEDED, FAILED}
+
+# 当前线程正在执行的任务，供 report_progress 使用
+_current = threading.local()
+
+# 两次清理过期任务之间的最短间隔（秒）
+_PURGE_INTERVAL = 30.0
+
+
+class JobQueueFull(RuntimeError):
+    """排队与执行中的任务数已达上限，调用方应返回 503 并提示稍后重试"""
+
+
+class Job:
+    """单个后台任务的状态快照"""
+
+    def __init__(self, kind: str, owner=None):
+        self.id         = uuid.uuid4().hex
+        self.kind       = kind
+        self.owner      = owner     # 提交者（history.Owner），查询时据此校验；None 表示不限
+        self.status     = QUEUED
+        self.progress   = 0
+        self.message    = '排队中'
+        self.result     = None
+        self.error      = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        # 每次状态变化递增，SSE 订阅方据此判断是否有新事件
+        self.version    = 0
+
+    @property
+    def done(self) -> bool:
+        return self.status in TERMINAL_STATES
+
+    def to_dict(self) -> dict:
+        data = {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'progress': self.progress,
+            'message': self.message,
+            'created_at': self.created_at,
+            'updated_at': self.updated_at,
+        }
+        if self.status == SUCCEEDED:
+            data['result'] = self.result
+        elif self.status == FAILED:
+            data['error'] = self.error
+        return data
+
+
+class JobQueue:
+    """
+    进程内后台任务队列：
+    - submit 立即返回 Job，由线程池异步执行耗时的推理任务
+    - 任务函数内可调用 report_progress 上报进度
+    - 排队与执行中的任务超过 JOB_MAX_PENDING 时拒绝提交（JobQueueFull）
+    - 结果在内存中保留 JOB_RESULT_TTL 秒后清理（提交与查询时顺带清理）
+    """
+
+    def __init__(self, app=None):
+        self._jobs = {}
+        self._cond = threading.Condition()
+        self._executor = None
+        self._app = None
+        self.result_ttl = 3600
+        self.max_pending = 64
+        self._purged_at = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self._app = app
+        self.result_ttl = app.config.get('JOB_RESULT_TTL', 3600)
+        self.max_pending = app.config.get('JOB_MAX_PENDING', self.max_pending)
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=app.config.get('JOB_WORKERS', 4),
+                thread_name_prefix='job-worker'
+            )
+        app.extensions['job_queue'] = self
+        registry.gauge('job_queue_jobs', '后台任务数（按状态）', self._gauge)
+
+    def submit(self, kind: str, fn, *args, owner=None, **kwargs) -> Job:
+        """
+        提交任务，返回 Job（此时尚未执行）；owner 记录提交者，不传给 fn。
+        未完成的任务数已达上限时抛出 JobQueueFull。
+        """
+        if self._executor is None:
+            raise RuntimeError('JobQueue 尚未通过 init_app 初始化')
+        self._purge_expired()
+        job = Job(kind, owner)
+        with self._cond:
+            pending = sum(1 for j in self._jobs.values() if not j.done)
+            if pending >= self.max_pending:
+                raise JobQueueFull('后台任务繁忙，请稍后重试')
+            self._jobs[job.id] = job
+        # 复制提交方上下文，使任务日志沿用请求 ID
+        ctx = contextvars.copy_context()
+        self._executor.submit(ctx.run, self._run, job, fn, args, kwargs)
+        return job
+
+    def get(self, job_id: str):
+        self._purge_expired()
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def wait_for_update(self, job: Job, version: int, timeout: float = 15.0) -> bool:
+        """阻塞直到 job.version 超过 version 或超时；返回是否有更新"""
+        with self._cond:
+            return self._cond.wait_for(lambda: job.version > version, timeout=timeout)
+
+    def update(self, job: Job, **fields):
+        with self._cond:
+            for key, value in fields.items():
+                setattr(job, key, value)
+            job.updated_at = time.time()
+            job.version += 1
+            self._cond.notify_all()
+
+    def _run(self, job: Job, fn, args, kwargs):
+        _current.job, _current.queue = job, self
+        self.update(job, status=RUNNING, message='执行中')
+        try:
+            with self._app.app_context():
+                result = fn(*args, **kwargs)
+            self.update(job, status=SUCCEEDED, progress=100, message='完成', result=result)
+        except Exception as e:
+            logger.exception('后台任务 %s (%s) 失败', job.id, job.kind)
+            self.update(job, status=FAILED, message='失败', error=str(e))
+        finally:
+            _current.job = _current.queue = None
+
+    def _gauge(self):
+        with self._cond:
+            counts = {state: 0 for state in (QUEUED, RUNNING, SUCCEEDED, FAILED)}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+        return [({'status': state}, n) for state, n in counts.items()]
+
+    def _purge_expired(self):
+        now = time.time()
+        if now - self._purged_at < _PURGE_INTERVAL:
+            return
+        self._purged_at = now
+        cutoff = now - self.result_ttl
+        with self._cond:
+            expired = [jid for jid, j in self._jobs.items() if j.done and j.updated_at < cutoff]
+            for jid in expired:
+                del self._jobs[jid]
+
+
+def report_progress(progress: int, message: str = None):
+    """
+    在后台任务中上报进度（0-100）；在普通请求线程中调用时无任何效果，
+    因此同步与异步路径可以共用同一段业务代码。
+    """
+    job = getattr(_current, 'job', None)
+    queue = getattr(_current, 'queue', None)
+    if job is None or queue is None:
+        return
+    fields = {'progress': max(0, min(int(progress), 99))}
+    if message:
+        fields['message'] = message
+    queue.update(job, **fields)
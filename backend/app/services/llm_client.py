@@ -0,0 +1,413 @@
+# app/services/llm_client.py
+
+import os
+import sys
+import json
+import time
+import logging
+import threading
+import requests
+from app.services.llm_governor import (
+    admission, AdmissionRejected, BACKEND_DEEPSEEK, BACKEND_LOCAL, PRIORITY_STANDARD
+)
+from app.services.singleflight import llm_flight, request_key
+from app.services.resilience import Backend, CircuitOpen, RetryPolicy, call_with_retry
+from app.services.structured_output import StructuredOutputParser, ThinkFilter, strip_think
+from app.services.model_router import router
+from app.services.metrics import LLM_TOKENS, observe_stage, registry, span
+
+logger = logging.getLogger(__name__)
+
+# ---------- 配置项 ----------
+DEEPSEEK_API_KEY  = os.getenv("DEEPSEEK_API_KEY", "sk-e1927ee1ea204a22b49fa3667f70a033")
+DEEPSEEK_BASE_URL = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com")
+DEEPSEEK_MODEL    = os.getenv("DEEPSEEK_MODEL", "deepseek-chat")
+INFERENCE_URL     = os.getenv("INFERENCE_URL", "http://localhost:11434")
+INFERENCE_MODEL   = os.getenv("INFERENCE_MODEL", "deepseek-r1:1.5b")
+INFERENCE_API     = os.getenv("INFERENCE_API", "ollama")  # ollama：原生 /api/chat；openai：/v1/chat/completions（vLLM 等）
+
+# Ollama 原生接口参数
+OLLAMA_KEEP_ALIVE  = os.getenv("OLLAMA_KEEP_ALIVE", "30m")        # 模型空闲后保持加载的时长，-1 为常驻
+OLLAMA_NUM_CTX     = int(os.getenv("OLLAMA_NUM_CTX", "4096"))     # 上下文窗口（token），决定 KV 缓存大小
+OLLAMA_NUM_PREDICT = int(os.getenv("OLLAMA_NUM_PREDICT", "0"))    # 输出 token 上限，0 为仅按调用方的 max_tokens
+
+# 推理模型（如 deepseek-r1）<think> 块的 token 预算：>0 时本地调用改为流式，
+# 推理超出预算即断开并以“不要思考”的方式重新请求一次；0 为不限制
+LLM_THINK_BUDGET = int(os.getenv("LLM_THINK_BUDGET", "0"))
+NO_THINK_INSTRUCTION = "请不要输出思考过程，直接给出最终回答。"
+# deepseek-r1 以空推理块开头续写时会跳过推理；仅 Ollama 原生接口支持 assistant 预填
+_EMPTY_THINK_PREFILL = {"role": "assistant", "content": "<think>\n\n</think>\n\n"}
+
+LLM_THINK_TOKENS = registry.counter(
+    'llm_think_tokens_total', '本地推理模型输出的 <think> 推理 token 数（流式时按分段近似）')
+LLM_THINK_ABORTS = registry.counter(
+    'llm_think_budget_exceeded_total', '推理超出 LLM_THINK_BUDGET 而断开重新请求的次数')
+
+LLM_MAX_ATTEMPTS     = int(os.getenv("LLM_MAX_ATTEMPTS", "3"))      # 单个后端的最大尝试次数
+LLM_BACKOFF_BASE     = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))  # 退避基数（秒）
+LLM_BACKOFF_MAX      = float(os.getenv("LLM_BACKOFF_MAX", "8"))     # 单次退避上限（秒）
+LLM_FALLBACK         = os.getenv("LLM_FALLBACK", "1") == "1"        # 主后端失败时切换到另一后端
+LLM_HEDGE            = os.getenv("LLM_HEDGE", "0") == "1"           # 默认是否发出对冲请求
+LLM_HEDGE_MIN_DELAY  = float(os.getenv("LLM_HEDGE_MIN_DELAY", "1")) # 对冲请求的最小触发延迟（秒）
+
+# DeepSeek 客户端在首次调用时创建：openai SDK 的导入占应用启动时间的大头
+_api_client = None
+_api_client_lock = threading.Lock()
+
+MODELS = {BACKEND_DEEPSEEK: DEEPSEEK_MODEL, BACKEND_LOCAL: INFERENCE_MODEL}
+_backends = {name: Backend(name) for name in (BACKEND_DEEPSEEK, BACKEND_LOCAL)}
+_retry_policy = RetryPolicy(LLM_MAX_ATTEMPTS, LLM_BACKOFF_BASE, LLM_BACKOFF_MAX)
+
+
+def get_api_client():
+    global _api_client
+    if _api_client is None:
+        with _api_client_lock:
+            if _api_client is None:
+                from openai import OpenAI
+                # 重试由本模块统一负责，关闭 SDK 自带的重试以免叠加
+                _api_client = OpenAI(api_key=DEEPSEEK_API_KEY, base_url=DEEPSEEK_BASE_URL, max_retries=0)
+    return _api_client
+
+
+def reset_clients() -> None:
+    """丢弃已创建的客户端（及其连接池），下次调用时重新创建；用于 fork 之后的子进程"""
+    global _api_client
+    with _api_client_lock:
+        _api_client = None
+
+
+def _local_api() -> str:
+    # INFERENCE_URL 配置为 OpenAI 兼容的完整接口地址时按该协议调用
+    if INFERENCE_URL.rstrip('/').endswith('/chat/completions'):
+        return 'openai'
+    return INFERENCE_API
+
+
+def _local_chat_url() -> str:
+    # 兼容 INFERENCE_URL 配置为服务根地址或完整接口地址两种写法
+    url = INFERENCE_URL.rstrip('/')
+    if url.endswith('/chat/completions'):
+        return url
+    return f"{url}/api/chat" if _local_api() == 'ollama' else f"{url}/v1/chat/completions"
+
+
+def _keep_alive(value: str):
+    # 纯数字按秒传给 Ollama（-1 为常驻），其余按时长字符串（如 30m）
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+# OpenAI 风格的生成参数在 Ollama options 中的名称；其余参数（如 num_ctx）原样放入 options
+_OLLAMA_OPTION_NAMES = {'max_tokens': 'num_predict'}
+
+
+def _local_payload(messages: list, params: dict, stream: bool) -> dict:
+    """
+    构造本地推理请求。Ollama 原生接口下：
+      - 消息按原有角色发送，由模型自己的对话模板拼接，不再压平成一段文本；
+      - keep_alive 让模型在请求间保持加载，同一会话的提示前缀命中 Ollama 的 KV 缓存，
+        每轮只需计算新增的消息（前缀稳定性见 chat_logic.optimize_context）；
+      - num_ctx / num_predict 限制上下文窗口与输出长度。
+    """
+    if _local_api() != 'ollama':
+        return {"model": INFERENCE_MODEL, "messages": messages, "stream": stream, **params}
+    options = {'num_ctx': OLLAMA_NUM_CTX}
+    for key, value in params.items():
+        if key != 'response_format':
+            options[_OLLAMA_OPTION_NAMES.get(key, key)] = value
+    if OLLAMA_NUM_PREDICT > 0:
+        options['num_predict'] = min(options.get('num_predict', OLLAMA_NUM_PREDICT), OLLAMA_NUM_PREDICT)
+    payload = {"model": INFERENCE_MODEL, "messages": messages, "stream": stream,
+               "keep_alive": _keep_alive(OLLAMA_KEEP_ALIVE), "options": options}
+    if (params.get('response_format') or {}).get('type') == 'json_object':
+        payload['format'] = 'json'
+    return payload
+
+
+def _observe_prompt_eval(data: dict) -> None:
+    # Ollama 完成时返回提示处理耗时（纳秒），命中 KV 缓存的前缀不计入；用于观察多轮对话的缓存复用
+    duration = data.get('prompt_eval_duration')
+    if duration:
+        observe_stage('llm_prompt_eval', duration / 1e9, backend=BACKEND_LOCAL)
+
+
+def _is_retryable(e: Exception) -> bool:
+    """网络错误、超时、429 与 5xx 可重试；参数错误等 4xx 不重试"""
+    # SDK 尚未导入时不可能抛出它的异常，不为判断类型而导入
+    openai = sys.modules.get('openai')
+    if openai is not None and isinstance(e, (openai.APIConnectionError, openai.APITimeoutError,
+                                             openai.RateLimitError, openai.InternalServerError)):
+        return True
+    if isinstance(e, (requests.ConnectionError, requests.Timeout)):
+        return True
+    if isinstance(e, requests.HTTPError) and e.response is not None:
+        return e.response.status_code == 429 or e.response.status_code >= 500
+    return False
+
+
+def _is_timeout(e: Exception) -> bool:
+    openai = sys.modules.get('openai')
+    return isinstance(e, requests.Timeout) or (openai is not None and isinstance(e, openai.APITimeoutError))
+
+
+def _record_usage(backend: str, usage) -> None:
+    if not usage:
+        return
+    if isinstance(usage, dict):
+        # OpenAI 格式的 usage，或 Ollama 完成响应中的 prompt_eval_count / eval_count
+        prompt = usage.get('prompt_tokens', usage.get('prompt_eval_count'))
+        completion = usage.get('completion_tokens', usage.get('eval_count'))
+    else:
+        prompt, completion = getattr(usage, 'prompt_tokens', None), getattr(usage, 'completion_tokens', None)
+    if prompt:
+        LLM_TOKENS.inc(prompt, backend=backend, direction='in')
+    if completion:
+        LLM_TOKENS.inc(completion, backend=backend, direction='out')
+    router.record_tokens(backend, (prompt or 0) + (completion or 0))
+
+
+def _call_deepseek(messages: list, params: dict, timeout: float) -> str:
+    resp = get_api_client().chat.completions.create(
+        model=DEEPSEEK_MODEL, messages=messages, timeout=timeout, **params
+    )
+    _record_usage(BACKEND_DEEPSEEK, resp.usage)
+    content = (resp.choices[0].message.content or '').strip()
+    if not content:
+        raise RuntimeError("DeepSeek 返回空内容，请检查提示或模型状态。")
+    return content
+
+
+def _call_local(messages: list, params: dict, timeout: float) -> str:
+    if LLM_THINK_BUDGET > 0:
+        pieces = 0
+        content = []
+        for piece in _stream_local_answer(messages, params, timeout):
+            pieces += 1
+            content.append(piece)
+        LLM_TOKENS.inc(pieces, backend=BACKEND_LOCAL, direction='out')
+        router.record_tokens(BACKEND_LOCAL, pieces)
+        content = ''.join(content).strip()
+        if not content:
+            raise RuntimeError("本地推理返回空内容，请检查服务状态。")
+        return content
+
+    r = requests.post(_local_chat_url(), json=_local_payload(messages, params, False), timeout=timeout)
+    r.raise_for_status()
+    data = r.json()
+    _record_usage(BACKEND_LOCAL, data.get("usage") or data)
+    _observe_prompt_eval(data)
+    # 兼容 OpenAI 格式与 Ollama 原生格式
+    if data.get("choices"):
+        content = (data["choices"][0].get("message", {}).get("content") or '').strip()
+    else:
+        content = (data.get("message", {}).get("content") or '').strip()
+    # 推理模型（如 deepseek-r1）会输出 <think> 推理过程，统一去除
+    content = strip_think(content).strip()
+    if not content:
+        raise RuntimeError("本地推理返回空内容，请检查服务状态。")
+    return content
+
+
+def _stream_deepseek(messages: list, params: dict, timeout: float):
+    """流式调用 DeepSeek，逐段产出文本；生成器关闭时断开连接"""
+    stream = get_api_client().chat.completions.create(
+        model=DEEPSEEK_MODEL, messages=messages, stream=True, timeout=timeout, **params
+    )
+    try:
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        stream.close()
+
+
+def _stream_local(messages: list, params: dict, timeout: float):
+    """流式调用本地推理服务，兼容 OpenAI SSE 与 Ollama NDJSON 两种格式"""
+    r = requests.post(_local_chat_url(), json=_local_payload(messages, params, True),
+                      timeout=timeout, stream=True)
+    try:
+        r.raise_for_status()
+        # SSE 与 NDJSON 均为 UTF-8，但响应头通常不带 charset：
+        # 不指定时 NDJSON 按 bytes 返回，text/event-stream 按 ISO-8859-1 解码
+        r.encoding = 'utf-8'
+        for line in r.iter_lines(decode_unicode=True):
+            if not line:
+                continue
+            if line.startswith('data:'):
+                line = line[5:].strip()
+                if line == '[DONE]':
+                    return
+            data = json.loads(line)
+            if data.get("choices"):
+                piece = data["choices"][0].get("delta", {}).get("content")
+            else:
+                piece = data.get("message", {}).get("content")
+                if data.get("done"):
+                    _observe_prompt_eval(data)
+            if piece:
+                yield piece
+    finally:
+        r.close()
+
+
+def _no_think_messages(messages: list) -> list:
+    """在最后一条用户消息后追加“不要思考”指令；Ollama 原生接口下再预填空推理块"""
+    retry = list(messages)
+    if retry and retry[-1].get('role') == 'user':
+        retry[-1] = {**retry[-1], 'content': f"{retry[-1]['content']}\n\n{NO_THINK_INSTRUCTION}"}
+    else:
+        retry.append({"role": "user", "content": NO_THINK_INSTRUCTION})
+    if _local_api() == 'ollama':
+        retry.append(_EMPTY_THINK_PREFILL)
+    return retry
+
+
+def _stream_local_answer(messages: list, params: dict, timeout: float):
+    """
+    流式调用本地推理，边接收边跳过 <think> 块，只产出正文。
+    推理 token 数超过 LLM_THINK_BUDGET（且尚未产出正文）时立即断开，改用 _no_think_messages 重新请求一次；
+    重新请求不再限制预算，避免反复断开。推理 token 数计入 llm_tokens_total 与 llm_think_tokens_total，
+    正文 token 由调用方计数。
+    """
+    attempts = [messages, _no_think_messages(messages)] if LLM_THINK_BUDGET > 0 else [messages]
+    for attempt, msgs in enumerate(attempts):
+        think = ThinkFilter()
+        think_tokens = 0
+        answered = exceeded = False
+        stream = _stream_local(msgs, params, timeout)
+        try:
+            for piece in stream:
+                before = think.think_chars
+                text = think.feed(piece)
+                if think.in_think or think.think_chars > before:
+                    think_tokens += 1
+                if text:
+                    answered = True
+                    yield text
+                elif not answered and attempt == 0 and len(attempts) > 1 and think_tokens > LLM_THINK_BUDGET:
+                    exceeded = True
+                    break
+            if not exceeded:
+                rest = think.flush()
+                if rest:
+                    yield rest
+        finally:
+            stream.close()
+            if think_tokens:
+                LLM_THINK_TOKENS.inc(think_tokens, backend=BACKEND_LOCAL)
+                LLM_TOKENS.inc(think_tokens, backend=BACKEND_LOCAL, direction='out')
+                router.record_tokens(BACKEND_LOCAL, think_tokens)
+        if not exceeded:
+            return
+        LLM_THINK_ABORTS.inc(backend=BACKEND_LOCAL)
+        logger.info("推理超出 %d token 预算，改为直接回答", LLM_THINK_BUDGET)
+
+
+_CALLERS = {BACKEND_DEEPSEEK: _call_deepseek, BACKEND_LOCAL: _call_local}
+_STREAMERS = {BACKEND_DEEPSEEK: _stream_deepseek, BACKEND_LOCAL: _stream_local_answer}
+
+
+def _run_on(backend: str, call, priority: int, hedge: bool):
+    def once():
+        with admission(backend, priority), span('llm_total', backend=backend):
+            start = time.perf_counter()
+            try:
+                result = call(backend)
+            except Exception as e:
+                # 超时同样说明后端变慢，计入耗时；连接失败等由熔断器处理
+                if _is_timeout(e):
+                    router.record_latency(backend, time.perf_counter() - start)
+                raise
+            # 调用耗时回传给路由，用于按延迟切换后端
+            router.record_latency(backend, time.perf_counter() - start)
+            return result
+
+    return call_with_retry(
+        _backends[backend], once, _retry_policy, _is_retryable,
+        hedge=hedge, hedge_min_delay=LLM_HEDGE_MIN_DELAY
+    )
+
+
+def _run_with_fallback(backend: str, call, priority: int, fallback: bool, hedge: bool):
+    try:
+        return _run_on(backend, call, priority, hedge)
+    except Exception as primary_error:
+        # 仅在后端不可用时切换；参数错误等问题换后端也无济于事
+        unavailable = isinstance(primary_error, (CircuitOpen, AdmissionRejected)) or _is_retryable(primary_error)
+        if not fallback or not unavailable:
+            raise
+        other = BACKEND_LOCAL if backend == BACKEND_DEEPSEEK else BACKEND_DEEPSEEK
+        logger.warning("%s 不可用，切换到 %s: %s", backend, other, primary_error)
+        try:
+            return _run_on(other, call, priority, hedge)
+        except Exception as fallback_error:
+            logger.error("%s 备用调用同样失败: %s", other, fallback_error)
+            raise primary_error
+
+
+def complete(messages: list,
+             backend: str = BACKEND_DEEPSEEK,
+             priority: int = PRIORITY_STANDARD,
+             timeout: float = 60,
+             fallback: bool = None,
+             hedge: bool = None,
+             **params) -> str:
+    """
+    统一的对话补全入口，返回模型输出文本：
+      - 相同请求并发合并（singleflight）
+      - 每个后端独立的并发准入、指数退避重试、重试预算与熔断
+      - 主后端不可用（熔断 / 重试耗尽 / 准入拒绝）时自动切换到另一后端
+    params 为生成参数，如 temperature、max_tokens、response_format。
+    两个后端均失败时抛出主后端的异常。
+    """
+    fallback = LLM_FALLBACK if fallback is None else fallback
+    hedge = LLM_HEDGE if hedge is None else hedge
+
+    def call(b: str) -> str:
+        return _CALLERS[b](messages, params, timeout)
+
+    key = request_key(backend, MODELS[backend], messages, **params)
+    return llm_flight.do(key, lambda: _run_with_fallback(backend, call, priority, fallback, hedge))
+
+
+def complete_structured(messages: list,
+                        schema: dict,
+                        backend: str = BACKEND_DEEPSEEK,
+                        priority: int = PRIORITY_STANDARD,
+                        timeout: float = 60,
+                        fallback: bool = None,
+                        **params) -> dict:
+    """
+    流式生成结构化 JSON：边接收边解析，schema 中的字段全部完整后立即断开生成，
+    输出有轻微缺陷（尾随逗号、截断、<think> 块等）时就地修复，不再整段重新生成。
+    重试、熔断、后端切换与请求合并与 complete 相同；
+    无法修复时抛出 StructuredOutputError（不重试）。
+    """
+    fallback = LLM_FALLBACK if fallback is None else fallback
+
+    def call(b: str) -> dict:
+        parser = StructuredOutputParser(schema)
+        start = time.perf_counter()
+        pieces = 0
+        for piece in _STREAMERS[b](messages, params, timeout):
+            if pieces == 0:
+                observe_stage('llm_ttfb', time.perf_counter() - start, backend=b)
+            pieces += 1
+            if parser.feed(piece):
+                break
+        # 流式输出每段约为一个 token；提前断开时上游不返回 usage，以段数近似
+        LLM_TOKENS.inc(pieces, backend=b, direction='out')
+        router.record_tokens(b, pieces)
+        with span('parse', schema=','.join(sorted(schema))):
+            parser.close()
+            return parser.result()
+
+    key = request_key(backend, MODELS[backend], messages, schema=sorted(schema), **params)
+    return llm_flight.do(key, lambda: _run_with_fallback(backend, call, priority, fallback, False))
+
+
+def backend_states() -> dict:
+    return {name: b.breaker.state for name, b in _backends.items()}
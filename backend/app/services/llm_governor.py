@@ -0,0 +1,201 @@
+# app/services/llm_governor.py
+
+import os
+import time
+import heapq
+import itertools
+import threading
+from contextlib import contextmanager
+from app.services.metrics import registry, observe_stage
+
+# ---------- 后端与优先级 ----------
+BACKEND_DEEPSEEK = 'deepseek'   # DeepSeek 云 API
+BACKEND_LOCAL    = 'local'      # 本地 Ollama / 推理服务
+
+PRIORITY_INTERACTIVE = 0   # 聊天等用户实时等待的请求
+PRIORITY_STANDARD    = 1   # 问卷、图片分析
+PRIORITY_BATCH       = 2   # 综合评估等批量/后台请求
+
+# ---------- 配置项 ----------
+# 每个后端允许的最大并发调用数
+MAX_CONCURRENCY = {
+    BACKEND_DEEPSEEK: int(os.getenv("LLM_MAX_CONCURRENCY_DEEPSEEK", "16")),
+    BACKEND_LOCAL:    int(os.getenv("LLM_MAX_CONCURRENCY_LOCAL", "2")),
+}
+# 每个后端等待队列的最大长度
+MAX_QUEUE = {
+    BACKEND_DEEPSEEK: int(os.getenv("LLM_MAX_QUEUE_DEEPSEEK", "64")),
+    BACKEND_LOCAL:    int(os.getenv("LLM_MAX_QUEUE_LOCAL", "8")),
+}
+# 各优先级在队列中的最长等待时间（秒）
+MAX_WAIT = {
+    PRIORITY_INTERACTIVE: float(os.getenv("LLM_MAX_WAIT_INTERACTIVE", "5")),
+    PRIORITY_STANDARD:    float(os.getenv("LLM_MAX_WAIT_STANDARD", "10")),
+    PRIORITY_BATCH:       float(os.getenv("LLM_MAX_WAIT_BATCH", "30")),
+}
+
+
+class AdmissionRejected(RuntimeError):
+    """
+    推理请求未被放行：
+      - 429：等待队列已满
+      - 503：预计无法在截止时间内获得执行槽位
+    路由层应直接返回对应状态码，而不是等到上游超时。
+    """
+
+    def __init__(self, message: str, status_code: int = 503, retry_after: int = 2):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ('priority', 'event', 'granted', 'rejected')
+
+    def __init__(self, priority: int):
+        self.priority = priority
+        self.event = threading.Event()
+        self.granted = False
+        self.rejected = False
+
+
+class BackendGovernor:
+    """
+    单个后端的并发控制：信号量式的执行槽位 + 按优先级排序的有界等待队列。
+    队列满时，新请求若优先级高于队尾最低优先级的等待者，则挤掉后者。
+    依据平均服务时间估算排队时长，超出截止时间的请求直接拒绝。
+    """
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int):
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max(0, max_queue)
+        self._lock = threading.Lock()
+        self._active = 0
+        self._queue = []              # (priority, seq, waiter)
+        self._seq = itertools.count()
+        self._avg_service = 1.0       # 服务耗时 EWMA（秒）
+        self.rejected = 0
+        self.admitted = 0
+
+    # ----- 公共接口 -----
+    def acquire(self, priority: int, max_wait: float):
+        deadline = time.monotonic() + max_wait
+        with self._lock:
+            if self._active < self.max_concurrency and not self._queue:
+                self._active += 1
+                self.admitted += 1
+                return
+
+            ahead = sum(1 for p, _, w in self._queue if p <= priority and not w.rejected)
+            # 按吞吐量估算：前方每 max_concurrency 个请求约占用一个平均服务时长
+            estimated = (ahead + 1) * self._avg_service / self.max_concurrency
+            if estimated > max_wait:
+                self.rejected += 1
+                raise AdmissionRejected(
+                    f"{self.name} 推理服务繁忙，预计等待 {estimated:.1f}s，请稍后重试",
+                    status_code=503, retry_after=max(1, int(estimated))
+                )
+
+            if len(self._queue) >= self.max_queue and not self._evict_lower(priority):
+                self.rejected += 1
+                raise AdmissionRejected(f"{self.name} 推理请求过多，请稍后重试", status_code=429)
+
+            waiter = _Waiter(priority)
+            heapq.heappush(self._queue, (priority, next(self._seq), waiter))
+
+        waiter.event.wait(max(0.0, deadline - time.monotonic()))
+        with self._lock:
+            if waiter.granted:
+                self.admitted += 1
+                return
+            if not waiter.rejected:
+                # 超时：标记并移出队列
+                waiter.rejected = True
+                self._queue = [item for item in self._queue if item[2] is not waiter]
+                heapq.heapify(self._queue)
+            self.rejected += 1
+        raise AdmissionRejected(f"{self.name} 推理服务繁忙，请稍后重试", status_code=503)
+
+    def release(self, service_time: float = None):
+        with self._lock:
+            if service_time is not None:
+                self._avg_service = 0.8 * self._avg_service + 0.2 * service_time
+            while self._queue:
+                _, _, waiter = heapq.heappop(self._queue)
+                if waiter.rejected:
+                    continue
+                # 槽位直接移交给下一个等待者，_active 不变
+                waiter.granted = True
+                waiter.event.set()
+                return
+            self._active -= 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'active': self._active,
+                'queued': len(self._queue),
+                'max_concurrency': self.max_concurrency,
+                'avg_service_seconds': self._avg_service,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+            }
+
+    # ----- 内部 -----
+    def _evict_lower(self, priority: int) -> bool:
+        """队列已满时挤掉优先级最低（且最晚到达）的等待者；调用方需持有锁"""
+        if not self._queue:
+            return False
+        victim = max(self._queue, key=lambda item: (item[0], item[1]))
+        if victim[0] <= priority:
+            return False
+        self._queue.remove(victim)
+        heapq.heapify(self._queue)
+        victim[2].rejected = True
+        victim[2].event.set()
+        return True
+
+
+_governors = {
+    name: BackendGovernor(name, MAX_CONCURRENCY[name], MAX_QUEUE[name])
+    for name in (BACKEND_DEEPSEEK, BACKEND_LOCAL)
+}
+
+
+def get_governor(backend: str) -> BackendGovernor:
+    return _governors[backend]
+
+
+@contextmanager
+def admission(backend: str, priority: int = PRIORITY_STANDARD, max_wait: float = None):
+    """
+    在推理调用外层使用：
+        with admission(BACKEND_DEEPSEEK, PRIORITY_INTERACTIVE):
+            client.chat.completions.create(...)
+    未获放行时抛出 AdmissionRejected。
+    """
+    governor = _governors[backend]
+    wait_start = time.monotonic()
+    try:
+        governor.acquire(priority, MAX_WAIT[priority] if max_wait is None else max_wait)
+    finally:
+        observe_stage('queue_wait', time.monotonic() - wait_start, backend=backend)
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        governor.release(time.monotonic() - start)
+
+
+def governor_stats() -> dict:
+    return {name: g.stats() for name, g in _governors.items()}
+
+
+def _gauge_field(field: str):
+    return lambda: [({'backend': name}, g.stats()[field]) for name, g in _governors.items()]
+
+
+registry.gauge('llm_active_requests', '正在执行的推理调用数', _gauge_field('active'))
+registry.gauge('llm_queued_requests', '等待准入的推理调用数', _gauge_field('queued'))
+registry.gauge('llm_admission_rejected', '累计被拒绝的推理调用数', _gauge_field('rejected'))
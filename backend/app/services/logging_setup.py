@@ -0,0 +1,175 @@
+# app/services/logging_setup.py
+
+import sys
+import copy
+import json
+import queue
+import atexit
+import random
+import logging
+import traceback
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from app.services.metrics import registry
+
+# LogRecord 自带的属性；其余属性视为通过 extra= 传入的结构化字段
+_RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'request_id'}
+
+LOG_RECORDS_DROPPED = registry.counter(
+    'log_records_dropped_total', '未写出的日志条数（reason=sampled/queue_full）')
+
+_listener = None
+_queue = None
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出一行 JSON；过长的消息截断到 max_chars，避免多 KB 的提示词拖慢写出"""
+
+    def __init__(self, max_chars: int = 2000):
+        super().__init__()
+        self.max_chars = max_chars
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = record.getMessage()
+        if self.max_chars and len(message) > self.max_chars:
+            message = f"{message[:self.max_chars]}…（截断，共 {len(message)} 字符）"
+        data = {
+            'ts': self.formatTime(record, '%Y-%m-%dT%H:%M:%S') + f".{int(record.msecs):03d}",
+            'level': record.levelname,
+            'logger': record.name,
+            'request_id': getattr(record, 'request_id', '-'),
+            'message': message,
+            'module': record.module,
+            'line': record.lineno,
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED and not key.startswith('_'):
+                data[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exc'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """开发环境使用的单行文本格式，同样截断过长消息"""
+
+    def __init__(self, max_chars: int = 2000):
+        super().__init__('[%(asctime)s] %(levelname)s [%(request_id)s] in %(module)s: %(message)s')
+        self.max_chars = max_chars
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        if self.max_chars and len(record.message) > self.max_chars:
+            record.message = f"{record.message[:self.max_chars]}…（截断，共 {len(record.message)} 字符）"
+        return super().formatMessage(record)
+
+
+class DebugSampler(logging.Filter):
+    """DEBUG 及以下级别按 rate 比例采样；INFO 及以上全部保留"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.rate >= 1:
+            return True
+        if self.rate > 0 and random.random() < self.rate:
+            return True
+        LOG_RECORDS_DROPPED.inc(reason='sampled')
+        return False
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    写入有界队列后立即返回，由后台线程负责格式化与 I/O；
+    队列已满时丢弃并计数，而不是阻塞请求线程。
+    """
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc(reason='queue_full')
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 在调用线程内合并参数并展开异常堆栈（异常对象不能跨线程保留），
+        # 但不做完整格式化，保留原始字段供后台线程的格式化器使用
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = ''.join(traceback.format_exception(*record.exc_info)).rstrip()
+            record.exc_info = None
+        return record
+
+
+def init_logging(app) -> None:
+    """
+    配置根日志器（每个进程只生效一次）：
+      请求线程 → NonBlockingQueueHandler → 有界队列 → QueueListener 线程 → stderr / 滚动文件
+    相关配置见 config.Config 中的 LOG_* 项。
+    """
+    global _listener, _queue
+    from flask.logging import default_handler
+
+    # 日志统一经根日志器输出，去掉 Flask 自带的同步 handler，避免重复
+    app.logger.removeHandler(default_handler)
+    app.logger.setLevel(logging.NOTSET)
+    if _listener is not None:
+        return
+
+    max_chars = app.config.get('LOG_MAX_MESSAGE_CHARS', 2000)
+    if app.config.get('LOG_FORMAT', 'json') == 'json':
+        formatter = JsonFormatter(max_chars)
+    else:
+        formatter = TextFormatter(max_chars)
+
+    handlers = [logging.StreamHandler(sys.stderr)]
+    log_file = app.config.get('LOG_FILE')
+    if log_file:
+        handlers.append(RotatingFileHandler(
+            log_file,
+            maxBytes=app.config.get('LOG_MAX_BYTES', 10 * 1024 * 1024),
+            backupCount=app.config.get('LOG_BACKUP_COUNT', 5),
+            encoding='utf-8',
+            delay=True
+        ))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    _queue = queue.Queue(maxsize=app.config.get('LOG_QUEUE_SIZE', 10000))
+    queue_handler = NonBlockingQueueHandler(_queue)
+    queue_handler.addFilter(DebugSampler(app.config.get('LOG_DEBUG_SAMPLE_RATE', 0.01)))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(app.config.get('LOG_LEVEL', 'INFO'))
+    # 推理客户端每个请求都会打印一条 INFO，量大且无额外信息
+    for name in app.config.get('LOG_QUIET_LOGGERS', ('httpx', 'httpcore')):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    _listener = QueueListener(_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    registry.gauge('log_queue_depth', '日志队列中等待写出的条数', lambda: [({}, _queue.qsize())])
+
+
+def reinit_after_fork() -> None:
+    """
+    fork 出的子进程中调用：父进程的写出线程不会被复制，且其队列的锁可能正被持有，
+    换一个新队列并重新启动写出线程，否则子进程的日志只进不出。
+    """
+    global _queue
+    if _listener is None:
+        return
+    _queue = queue.Queue(maxsize=_queue.maxsize)
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, QueueHandler):
+            handler.queue = _queue
+    _listener.queue = _queue
+    _listener._thread = None
+    _listener.start()
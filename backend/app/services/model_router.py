@@ -0,0 +1,271 @@
+# app/services/model_router.py
+
+import os
+import json
+import time
+import random
+import logging
+import threading
+from contextvars import ContextVar
+from flask import request
+from app.services.llm_governor import get_governor, BACKEND_DEEPSEEK, BACKEND_LOCAL
+from app.services.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = (BACKEND_DEEPSEEK, BACKEND_LOCAL)
+OVERRIDE_HEADER = 'X-LLM-Backend'
+
+# 未配置策略文件时的默认策略：全部走 DeepSeek，繁忙或变慢时溢出到本地模型
+DEFAULT_POLICY = {
+    'defaults': {
+        'backend': BACKEND_DEEPSEEK,   # 首选后端
+        'overflow': True,              # 是否允许按负载切换到另一后端
+        'queue_depth': 4,              # 首选后端排队数达到该值时溢出（另一后端排队更少时）
+        'slow_seconds': 30.0,          # 首选后端调用耗时 EWMA 超过该值时整体切走
+        'recover_seconds': 15.0,       # 切走后耗时 EWMA 回落到该值以下时切回
+        'probe_ratio': 0.1,            # 切走期间仍发往首选后端的比例，用于观察其是否恢复（0 则不会自动切回）
+    },
+    'endpoints': {
+        'chat': {'slow_seconds': 12.0, 'recover_seconds': 6.0},
+        'survey': {},
+        'image': {},
+        'evaluate': {'slow_seconds': 90.0, 'recover_seconds': 45.0},
+        # 分段评估：本地模型起草各部分，云端模型修订低置信度部分
+        'evaluate_section': {'backend': BACKEND_LOCAL, 'slow_seconds': 20.0, 'recover_seconds': 10.0},
+        'evaluate_refine': {},
+    },
+    # 每个后端每小时的 token 上限（输入 + 输出），0 为不限；超出后改用另一后端。
+    # 用量按进程统计：多 worker 部署时实际上限为该值 × worker 数，应按 worker 数等比缩小
+    'cost_caps': {BACKEND_DEEPSEEK: {'tokens_per_hour': 0}},
+    # 是否接受请求头 X-LLM-Backend 指定后端（成本上限仍然生效）。该请求头任何客户端都能设置，
+    # 开启后可把所有请求固定到付费后端，仅用于调试或受信任的内部网络
+    'allow_override': False,
+}
+
+_RULE_KEYS = tuple(DEFAULT_POLICY['defaults'])
+_LATENCY_ALPHA = 0.2
+
+ROUTE_DECISIONS = registry.counter(
+    'llm_route_decisions_total', '推理路由决策（reason=policy/override/queue/slow/probe/cost_cap）')
+
+# 请求级的后端指定（由 before_request 设置，后台任务复制上下文后沿用）
+_override_var = ContextVar('llm_backend_override', default=None)
+# 最近一次路由的接口名，调用完成后据此按 (后端, 接口) 记录耗时
+_endpoint_var = ContextVar('llm_route_endpoint', default=None)
+
+
+class RoutingPolicy:
+    """校验并展开后的路由策略；rule(endpoint) 返回该接口的完整规则"""
+
+    def __init__(self, raw: dict):
+        defaults = {**DEFAULT_POLICY['defaults'], **(raw.get('defaults') or {})}
+        self.rules = {}
+        endpoints = {**DEFAULT_POLICY['endpoints'], **(raw.get('endpoints') or {})}
+        for name, rule in endpoints.items():
+            self.rules[name] = self._validate(name, {**defaults, **(rule or {})})
+        self.defaults = self._validate('defaults', defaults)
+        self.cost_caps = {}
+        for backend, cap in (raw.get('cost_caps', DEFAULT_POLICY['cost_caps']) or {}).items():
+            if backend not in BACKENDS:
+                raise ValueError(f"cost_caps 中的未知后端: {backend}")
+            self.cost_caps[backend] = int((cap or {}).get('tokens_per_hour', 0))
+        self.allow_override = bool(raw.get('allow_override', DEFAULT_POLICY['allow_override']))
+        self.raw = raw
+
+    @staticmethod
+    def _validate(name: str, rule: dict) -> dict:
+        unknown = set(rule) - set(_RULE_KEYS)
+        if unknown:
+            raise ValueError(f"{name} 中的未知配置项: {', '.join(sorted(unknown))}")
+        if rule['backend'] not in BACKENDS:
+            raise ValueError(f"{name}.backend 只能是 {' / '.join(BACKENDS)}")
+        if rule['recover_seconds'] > rule['slow_seconds']:
+            raise ValueError(f"{name}.recover_seconds 不能大于 slow_seconds")
+        if not 0 <= rule['probe_ratio'] <= 1:
+            raise ValueError(f"{name}.probe_ratio 需在 0-1 之间")
+        return rule
+
+    def rule(self, endpoint: str) -> dict:
+        return self.rules.get(endpoint, self.defaults)
+
+    def to_dict(self) -> dict:
+        return {
+            'defaults': self.defaults,
+            'endpoints': self.rules,
+            'cost_caps': {b: {'tokens_per_hour': n} for b, n in self.cost_caps.items()},
+            'allow_override': self.allow_override,
+        }
+
+
+class ModelRouter:
+    """
+    按接口选择推理后端：
+      - 策略（每个接口的首选后端与阈值、成本上限、是否允许请求级指定）来自 JSON 文件，
+        文件修改后在 MODEL_ROUTING_CHECK_INTERVAL 秒内自动生效，无需重启；格式错误时保留原策略；
+      - 首选后端排队过深时单个请求溢出到另一后端；调用耗时 EWMA 超过 slow_seconds 时整体切走，
+        期间按 probe_ratio 继续发少量请求观察，回落到 recover_seconds 以下后切回；
+      - 后端在当前小时内的 token 用量达到上限后改用另一后端。
+    后端不可用（熔断、重试耗尽）时的切换仍由 llm_client 负责。
+    """
+
+    def __init__(self, app=None):
+        self.policy_file = None
+        self.check_interval = 2.0
+        self._policy = RoutingPolicy({})
+        self._mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._latency = {}            # (backend, endpoint) -> 耗时 EWMA（秒）
+        self._shifted = set()         # 因变慢而切走的 (backend, endpoint)
+        self._tokens = {}             # backend -> (小时编号, token 数)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.policy_file = app.config.get('MODEL_ROUTING_FILE')
+        self.check_interval = app.config.get('MODEL_ROUTING_CHECK_INTERVAL', self.check_interval)
+        self.reload()
+
+        @app.before_request
+        def read_backend_override():
+            # 每个请求都重新设置，线程复用时不会沿用上一个请求的指定
+            value = request.headers.get(OVERRIDE_HEADER, '').strip().lower()
+            _override_var.set(value if value in BACKENDS else None)
+
+    # ----- 策略加载 -----
+    def reload(self) -> bool:
+        """重新读取策略文件，返回是否成功；文件不存在时使用默认策略"""
+        path = self.policy_file
+        try:
+            mtime = os.path.getmtime(path) if path else None
+        except OSError:
+            mtime = None
+        try:
+            raw = {}
+            if mtime is not None:
+                with open(path, encoding='utf-8') as f:
+                    raw = json.load(f)
+            policy = RoutingPolicy(raw)
+        except (OSError, ValueError, TypeError, KeyError) as e:
+            logger.error("路由策略 %s 无效，继续使用原策略: %s", path, e)
+            with self._lock:
+                self._mtime = mtime
+            return False
+        with self._lock:
+            self._policy = policy
+            self._mtime = mtime
+        logger.info("已加载路由策略: %s", path if mtime is not None else '默认策略')
+        return True
+
+    def _current(self) -> RoutingPolicy:
+        now = time.monotonic()
+        if self.policy_file and now - self._checked_at >= self.check_interval:
+            self._checked_at = now
+            try:
+                mtime = os.path.getmtime(self.policy_file)
+            except OSError:
+                mtime = None
+            if mtime != self._mtime:
+                self.reload()
+        return self._policy
+
+    # ----- 路由 -----
+    def route(self, endpoint: str) -> str:
+        """返回本次调用应使用的后端"""
+        policy = self._current()
+        rule = policy.rule(endpoint)
+        backend, reason = rule['backend'], 'policy'
+        override = _override_var.get()
+
+        if override and policy.allow_override:
+            backend, reason = override, 'override'
+        elif rule['overflow']:
+            other = _other(backend)
+            if self._is_slow(backend, endpoint, rule):
+                if random.random() < rule['probe_ratio']:
+                    reason = 'probe'
+                else:
+                    backend, reason = other, 'slow'
+            elif self._queue_overflow(backend, other, rule['queue_depth']):
+                backend, reason = other, 'queue'
+
+        if self._over_cap(backend, policy) and not self._over_cap(_other(backend), policy):
+            backend, reason = _other(backend), 'cost_cap'
+
+        ROUTE_DECISIONS.inc(endpoint=endpoint, backend=backend, reason=reason)
+        _endpoint_var.set(endpoint)
+        return backend
+
+    def _is_slow(self, backend: str, endpoint: str, rule: dict) -> bool:
+        key = (backend, endpoint)
+        with self._lock:
+            latency = self._latency.get(key)
+            if latency is None:
+                return False
+            if key in self._shifted:
+                if latency < rule['recover_seconds']:
+                    self._shifted.discard(key)
+                    logger.info("%s 耗时回落到 %.1fs，%s 切回该后端", backend, latency, endpoint)
+                    return False
+                return True
+            if latency > rule['slow_seconds']:
+                self._shifted.add(key)
+                logger.warning("%s 耗时升至 %.1fs，%s 切换到 %s", backend, latency, endpoint, _other(backend))
+                return True
+            return False
+
+    @staticmethod
+    def _queue_overflow(backend: str, other: str, depth: int) -> bool:
+        if depth <= 0:
+            return False
+        queued = get_governor(backend).stats()['queued']
+        return queued >= depth and get_governor(other).stats()['queued'] < queued
+
+    def _over_cap(self, backend: str, policy: RoutingPolicy) -> bool:
+        cap = policy.cost_caps.get(backend, 0)
+        if cap <= 0:
+            return False
+        hour = int(time.time() // 3600)
+        with self._lock:
+            bucket, used = self._tokens.get(backend, (hour, 0))
+        return bucket == hour and used >= cap
+
+    # ----- 调用结果回传（由 llm_client 调用） -----
+    def record_latency(self, backend: str, seconds: float) -> None:
+        endpoint = _endpoint_var.get()
+        if endpoint is None:
+            return
+        key = (backend, endpoint)
+        with self._lock:
+            previous = self._latency.get(key)
+            self._latency[key] = seconds if previous is None else \
+                _LATENCY_ALPHA * seconds + (1 - _LATENCY_ALPHA) * previous
+
+    def record_tokens(self, backend: str, tokens: int) -> None:
+        hour = int(time.time() // 3600)
+        with self._lock:
+            bucket, used = self._tokens.get(backend, (hour, 0))
+            self._tokens[backend] = (hour, (used if bucket == hour else 0) + tokens)
+
+    def state(self) -> dict:
+        """当前策略与各 (后端, 接口) 的耗时、切换状态及本小时 token 用量"""
+        policy = self._current()
+        hour = int(time.time() // 3600)
+        with self._lock:
+            return {
+                'policy_file': self.policy_file,
+                'policy': policy.to_dict(),
+                'latency': [
+                    {'backend': b, 'endpoint': e, 'ewma_seconds': round(v, 3), 'shifted': (b, e) in self._shifted}
+                    for (b, e), v in sorted(self._latency.items())
+                ],
+                'tokens_this_hour': {b: used for b, (bucket, used) in self._tokens.items() if bucket == hour},
+            }
+
+
+def _other(backend: str) -> str:
+    return BACKEND_LOCAL if backend == BACKEND_DEEPSEEK else BACKEND_DEEPSEEK
+
+
+router = ModelRouter()
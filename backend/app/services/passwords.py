@@ -0,0 +1,106 @@
+# app/services/passwords.py
+
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash
+from app.services.metrics import registry, observe_stage
+
+logger = logging.getLogger(__name__)
+
+PASSWORD_VERIFICATIONS = registry.counter(
+    'password_verifications_total', '密码校验次数（outcome=ok/failed/rehashed/rejected）')
+
+
+class HasherSaturated(RuntimeError):
+    """密码校验排队已满，调用方应返回 503 并提示稍后重试"""
+
+
+class PasswordHasher:
+    """
+    密码哈希与校验：
+      - 哈希参数由 PASSWORD_HASH_METHOD 配置（werkzeug 格式，如 scrypt:32768:8:1、pbkdf2:sha256:600000），
+        已保存的哈希参数与配置不同时，登录成功后透明地按新参数重新哈希；
+      - 校验在独立线程池中执行（hashlib 计算期间释放 GIL），同时计算的哈希数不超过 CPU 核数，
+        排队已满时最多等待 PASSWORD_HASH_WAIT_TIMEOUT 秒，仍无名额则拒绝，
+        避免登录高峰把所有 worker 线程都压在哈希计算上。
+    """
+
+    def __init__(self, app=None):
+        self.method = 'scrypt:32768:8:1'
+        self._prefix = None           # 按当前配置生成的哈希的参数前缀，见 needs_rehash
+        self._executor = None
+        self._slots = None
+        self.wait_timeout = 2.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.method = app.config.get('PASSWORD_HASH_METHOD', self.method)
+        self._prefix = self._method_prefix()
+        self.wait_timeout = app.config.get('PASSWORD_HASH_WAIT_TIMEOUT', self.wait_timeout)
+        if self._executor is None:
+            workers = app.config.get('PASSWORD_HASH_WORKERS') or (os.cpu_count() or 2)
+            queue_size = app.config.get('PASSWORD_HASH_QUEUE', workers * 8)
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+            # 正在计算 + 排队的校验总数上限
+            self._slots = threading.BoundedSemaphore(workers + queue_size)
+
+    def hash(self, password: str) -> str:
+        return generate_password_hash(password, method=self.method)
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        if self._prefix is None:
+            self._prefix = self._method_prefix()
+        return password_hash.split('$', 1)[0] != self._prefix
+
+    def _method_prefix(self) -> str:
+        # 配置可以是简写（scrypt、pbkdf2:sha256），werkzeug 写入的是补全默认值后的参数
+        # （scrypt:32768:8:1、pbkdf2:sha256:<迭代次数>）；以一次试算的结果为准再比较
+        return self.hash('probe').split('$', 1)[0]
+
+    def verify(self, password_hash: str, password: str) -> bool:
+        """在线程池中校验密码；排队已满时抛出 HasherSaturated"""
+        return self._run(self._check, password_hash, password)
+
+    def verify_and_update(self, user, password: str) -> bool:
+        """
+        校验用户密码；成功且哈希参数已过期时更新 user.password_hash（调用方负责提交）。
+        重新哈希与校验在同一个池任务中完成，只发生在该用户下一次成功登录时。
+        """
+        ok, new_hash = self._run(self._check_and_rehash, user.password_hash, password)
+        if new_hash is not None:
+            user.password_hash = new_hash
+        return ok
+
+    def _run(self, fn, *args):
+        if self._executor is None:
+            return fn(*args)
+        if not self._slots.acquire(timeout=self.wait_timeout):
+            PASSWORD_VERIFICATIONS.inc(outcome='rejected')
+            raise HasherSaturated('登录请求过多，请稍后重试')
+        try:
+            return self._executor.submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    @staticmethod
+    def _check(password_hash: str, password: str) -> bool:
+        start = time.perf_counter()
+        ok = check_password_hash(password_hash, password)
+        observe_stage('auth', time.perf_counter() - start, step='verify')
+        PASSWORD_VERIFICATIONS.inc(outcome='ok' if ok else 'failed')
+        return ok
+
+    def _check_and_rehash(self, password_hash: str, password: str) -> tuple:
+        if not self._check(password_hash, password):
+            return False, None
+        if not self.needs_rehash(password_hash):
+            return True, None
+        start = time.perf_counter()
+        new_hash = self.hash(password)
+        observe_stage('auth', time.perf_counter() - start, step='rehash')
+        PASSWORD_VERIFICATIONS.inc(outcome='rehashed')
+        return True, new_hash
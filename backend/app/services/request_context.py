@@ -0,0 +1,32 @@
+# app/services/request_context.py
+
+import uuid
+import logging
+from contextvars import ContextVar
+
+# 当前请求 ID；后台任务提交时会复制调用方的上下文，因此任务日志沿用同一 ID
+request_id_var = ContextVar('request_id', default='-')
+
+_base_factory = logging.getLogRecordFactory()
+
+
+def _record_factory(*args, **kwargs):
+    record = _base_factory(*args, **kwargs)
+    record.request_id = request_id_var.get()
+    return record
+
+
+def install_log_record_factory():
+    """为所有日志记录附加 request_id 字段，格式串中可使用 %(request_id)s"""
+    if logging.getLogRecordFactory() is not _record_factory:
+        logging.setLogRecordFactory(_record_factory)
+
+
+def new_request_id(incoming: str = None) -> str:
+    """沿用上游传入的 X-Request-ID（长度受限），否则生成新的 ID"""
+    if incoming and len(incoming) <= 64:
+        return incoming
+    return uuid.uuid4().hex
+
+
+install_log_record_factory()
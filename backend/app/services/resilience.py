@@ -0,0 +1,218 @@
+# app/services/resilience.py
+
+import time
+import random
+import logging
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from app.services.metrics import LLM_REQUESTS, LLM_RETRIES
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpen(RuntimeError):
+    """熔断器处于打开状态，请求未发出"""
+
+
+class RetryPolicy:
+    """指数退避 + 全抖动（full jitter）：第 n 次重试前等待 U(0, min(max_delay, base * 2^n))"""
+
+    def __init__(self, max_attempts: int = 3, base_delay: float = 0.5, max_delay: float = 8.0):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+class RetryBudget:
+    """
+    重试预算（令牌桶）：每个请求存入 ratio 个令牌，每次重试消耗 1 个，
+    保证重试流量不超过正常流量的 ratio 比例，避免故障时重试风暴放大负载。
+    """
+
+    def __init__(self, ratio: float = 0.2, min_tokens: float = 3.0, max_tokens: float = 20.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = min_tokens
+        self._lock = threading.Lock()
+
+    def record_request(self):
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+class CircuitBreaker:
+    """
+    连续失败 failure_threshold 次后打开，reset_timeout 秒内直接拒绝；
+    之后进入半开状态，仅放行一个试探请求，成功则关闭，失败则重新打开。
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def before_call(self):
+        with self._lock:
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    raise CircuitOpen(f"{self.name} 熔断中，暂停调用")
+                self._state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self._state == self.HALF_OPEN:
+                if self._probe_in_flight:
+                    raise CircuitOpen(f"{self.name} 熔断试探中，暂停调用")
+                self._probe_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def release(self):
+        """调用未能说明后端是否健康（如被准入拒绝、参数错误）：只归还试探名额，不改变状态与失败计数"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logger.warning("%s 熔断器打开（连续失败 %d 次）", self.name, self._failures)
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+
+class LatencyTracker:
+    """保留最近 window 次成功调用的耗时，用于计算对冲请求的触发延迟"""
+
+    def __init__(self, window: int = 200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q: float, min_samples: int = 20):
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Backend:
+    """单个后端的韧性状态：熔断器、重试预算与耗时统计"""
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+        self.budget = RetryBudget()
+        self.latency = LatencyTracker()
+
+
+# 对冲请求共用的线程池
+_hedge_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='llm-hedge')
+
+
+def _attempt(backend: Backend, fn, is_failure):
+    backend.breaker.before_call()
+    start = time.monotonic()
+    try:
+        result = fn()
+    except Exception as e:
+        # 只有网络错误、超时、429 与 5xx 计入熔断；准入拒绝、4xx、输出无法解析等不代表后端故障
+        if is_failure(e):
+            backend.breaker.record_failure()
+        else:
+            backend.breaker.release()
+        LLM_REQUESTS.inc(backend=backend.name, outcome=type(e).__name__)
+        raise
+    backend.breaker.record_success()
+    LLM_REQUESTS.inc(backend=backend.name, outcome='ok')
+    backend.latency.record(time.monotonic() - start)
+    return result
+
+
+def _hedged_attempt(backend: Backend, fn, is_failure, min_delay: float):
+    """
+    对冲请求：首个请求超过历史 p95 耗时仍未返回时再发一个相同请求，取先成功者。
+    样本不足时退化为普通调用。
+    """
+    p95 = backend.latency.percentile(0.95)
+    if p95 is None:
+        return _attempt(backend, fn, is_failure)
+
+    # 对冲线程沿用调用方的上下文（请求 ID、路由接口名等），路由才能按接口记录耗时
+    first = _hedge_executor.submit(contextvars.copy_context().run, _attempt, backend, fn, is_failure)
+    done, _ = wait([first], timeout=max(p95, min_delay))
+    if done:
+        return first.result()
+
+    logger.info("%s 请求超过 p95（%.2fs），发出对冲请求", backend.name, p95)
+    second = _hedge_executor.submit(contextvars.copy_context().run, _attempt, backend, fn, is_failure)
+    pending = {first, second}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+    raise error
+
+
+def call_with_retry(backend: Backend, fn, policy: RetryPolicy, is_retryable,
+                    hedge: bool = False, hedge_min_delay: float = 1.0):
+    """
+    在单个后端上执行 fn：失败且可重试时按退避策略重试（受重试预算约束），
+    熔断器打开时直接抛出 CircuitOpen。is_retryable 同时决定失败是否计入熔断。
+    """
+    backend.budget.record_request()
+    attempt = 0
+    while True:
+        try:
+            if hedge:
+                return _hedged_attempt(backend, fn, is_retryable, hedge_min_delay)
+            return _attempt(backend, fn, is_retryable)
+        except CircuitOpen:
+            LLM_REQUESTS.inc(backend=backend.name, outcome='circuit_open')
+            raise
+        except Exception as e:
+            attempt += 1
+            if attempt >= policy.max_attempts or not is_retryable(e):
+                raise
+            if not backend.budget.try_spend():
+                logger.warning("%s 重试预算耗尽，放弃重试: %s", backend.name, e)
+                raise
+            delay = policy.backoff(attempt)
+            LLM_RETRIES.inc(backend=backend.name)
+            logger.warning("%s 调用失败（第 %d 次），%.2fs 后重试: %s", backend.name, attempt, delay, e)
+            time.sleep(delay)
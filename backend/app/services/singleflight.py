@@ -0,0 +1,77 @@
+# app/services/singleflight.py
+
+import json
+import hashlib
+import threading
+from app.services.metrics import CACHE_HITS
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    合并并发的相同请求：同一 key 同时只有一个调用真正发往上游，
+    其余调用等待并共享同一结果（或同一异常）。调用结束后立即失效，不做缓存。
+    共享的结果对象会被多个调用方同时使用，调用方不应原地修改。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.leaders = 0
+        self.shared = 0
+
+    def do(self, key: str, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.shared += 1
+                leader = False
+                CACHE_HITS.inc(cache='singleflight')
+            else:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+                leader = True
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'in_flight': len(self._calls), 'leaders': self.leaders, 'shared': self.shared}
+
+
+def request_key(backend: str, model: str, messages: list, **params) -> str:
+    """由后端、模型、消息与生成参数计算规范化的请求 key"""
+    canonical = json.dumps(
+        {'backend': backend, 'model': model, 'messages': messages, 'params': params},
+        ensure_ascii=False, sort_keys=True, separators=(',', ':')
+    )
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+# 所有推理服务共用的合并器
+llm_flight = SingleFlight()
@@ -0,0 +1,149 @@
+# app/services/storage.py
+
+import io
+import os
+import hashlib
+import logging
+import tempfile
+from PIL import Image
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import StoredImage, ImageVariant
+from app.services.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# ---------- 配置项 ----------
+UPLOAD_FOLDER       = os.getenv("UPLOAD_FOLDER", "uploads")        # 存储根目录
+STORAGE_SHARD_DEPTH = int(os.getenv("STORAGE_SHARD_DEPTH", "2"))   # 按哈希前缀分几级子目录（每级 2 个十六进制字符）
+STORAGE_FSYNC       = os.getenv("STORAGE_FSYNC", "1") == "1"       # 写入后 fsync，断电时不留下半个文件
+
+ORIGINALS = 'originals'   # 原始上传
+VARIANTS  = 'variants'    # 派生结果
+
+# 预处理流程（CLAHE、去噪、人脸裁剪、缩略图尺寸等）变化时递增，旧版本的变体不再复用
+PREPROCESS_VERSION = 'v1'
+
+# 允许原样保存的图片格式；其余可解码的格式（如 Base64 上传的 WebP）转存为 PNG
+_FORMAT_EXT = {'PNG': 'png', 'JPEG': 'jpg', 'GIF': 'gif'}
+
+STORAGE_OBJECTS = registry.counter(
+    'storage_objects_total', '存储写入（namespace=originals/variants，outcome=written/deduplicated）')
+
+
+class ContentStore:
+    """
+    按内容寻址的文件存储：文件名为内容的 SHA-256，按哈希前缀分片到多级子目录，
+    例如 originals/ab/cd/abcd….png，单个目录内的文件数保持在较小规模。
+    写入先落到同目录下的临时文件再原子重命名，读者不会看到写了一半的文件；
+    相同内容只写一次。
+    """
+
+    def __init__(self, root: str, depth: int = 2):
+        self.root = root
+        self.depth = depth
+
+    def path_for(self, namespace: str, digest: str, ext: str) -> str:
+        shards = [digest[i * 2:i * 2 + 2] for i in range(self.depth)]
+        return os.path.join(self.root, namespace, *shards, f"{digest}.{ext}")
+
+    def put(self, namespace: str, data: bytes, ext: str) -> tuple:
+        """写入内容，返回 (sha256, path)；内容已存在时不重复写入"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path_for(namespace, digest, ext)
+        if os.path.exists(path):
+            STORAGE_OBJECTS.inc(namespace=namespace, outcome='deduplicated')
+            return digest, path
+
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                if STORAGE_FSYNC:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        STORAGE_OBJECTS.inc(namespace=namespace, outcome='written')
+        return digest, path
+
+
+store = ContentStore(UPLOAD_FOLDER, STORAGE_SHARD_DEPTH)
+
+
+def save_original(data: bytes, original_name: str = None) -> StoredImage:
+    """
+    保存上传的原图并登记到数据库，返回 StoredImage；内容相同的图片返回已有记录。
+    无法解码的数据抛出 ValueError。
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            fmt, (width, height) = img.format, img.size
+            if fmt not in _FORMAT_EXT:
+                buffer = io.BytesIO()
+                img.save(buffer, format='PNG')
+                data, fmt = buffer.getvalue(), 'PNG'
+    except Exception:
+        raise ValueError("无法识别的图片数据")
+
+    ext = _FORMAT_EXT[fmt]
+    digest, _ = store.put(ORIGINALS, data, ext)
+    image = StoredImage.query.filter_by(sha256=digest).first()
+    if image is not None:
+        return image
+
+    image = StoredImage(sha256=digest, ext=ext, size=len(data), width=width, height=height,
+                        original_name=(original_name or '')[:255] or None)
+    db.session.add(image)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # 并发上传了相同内容，使用先提交的那条记录
+        db.session.rollback()
+        image = StoredImage.query.filter_by(sha256=digest).one()
+    return image
+
+
+def original_path(image: StoredImage) -> str:
+    return store.path_for(ORIGINALS, image.sha256, image.ext)
+
+
+def get_variant(image: StoredImage, kind: str, version: str = PREPROCESS_VERSION):
+    """返回已保存的变体；没有记录或文件已丢失时返回 None"""
+    variant = image.variants.filter_by(kind=kind, version=version).first()
+    if variant is not None and variant.sha256 and not os.path.exists(variant_path(variant)):
+        logger.warning("变体文件缺失，将重新生成: image=%s kind=%s", image.id, kind)
+        db.session.delete(variant)
+        db.session.commit()
+        return None
+    return variant
+
+
+def variant_path(variant: ImageVariant):
+    if not variant.sha256:
+        return None
+    return store.path_for(VARIANTS, variant.sha256, variant.ext)
+
+
+def save_variant(image: StoredImage, kind: str, data: bytes = None, ext: str = None,
+                 meta: dict = None, version: str = PREPROCESS_VERSION) -> ImageVariant:
+    """保存原图的一个派生结果（文件内容和/或 meta），同一 (原图, kind, version) 只保留一份"""
+    digest = None
+    if data is not None:
+        digest, _ = store.put(VARIANTS, data, ext)
+    variant = ImageVariant(image_id=image.id, kind=kind, version=version, sha256=digest,
+                           ext=ext if data is not None else None, meta=meta)
+    db.session.add(variant)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        variant = image.variants.filter_by(kind=kind, version=version).one()
+    return variant
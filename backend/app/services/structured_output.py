@@ -0,0 +1,278 @@
+# app/services/structured_output.py
+
+import json
+
+# ---------- 结构定义：字段名 → 允许的类型 ----------
+SURVEY_SCHEMA = {
+    'score': (int, float),
+    'risk_level': str,
+    'analysis': str,
+    'recommendations': list,
+}
+IMAGE_SCHEMA = {
+    'emotion': str,
+    'analysis': str,
+}
+
+_THINK_OPEN, _THINK_CLOSE = '<think>', '</think>'
+
+
+class StructuredOutputError(ValueError):
+    """模型输出无法修复为符合结构的 JSON 对象；text 为去除推理块后的原始输出"""
+
+    def __init__(self, message: str, text: str = ''):
+        super().__init__(message)
+        self.text = text
+
+
+def _partial_suffix(text: str, tag: str) -> int:
+    """text 末尾与 tag 前缀重合的最大长度（标签可能被切分在两个 token 之间）"""
+    for n in range(min(len(tag) - 1, len(text)), 0, -1):
+        if text.endswith(tag[:n]):
+            return n
+    return 0
+
+
+class ThinkFilter:
+    """增量过滤 <think>…</think> 推理块，并统计被丢弃的推理字符数"""
+
+    def __init__(self):
+        self.in_think = False
+        self.think_chars = 0
+        self._pending = ''
+
+    def feed(self, chunk: str) -> str:
+        self._pending += chunk
+        out = []
+        while True:
+            if self.in_think:
+                i = self._pending.find(_THINK_CLOSE)
+                if i == -1:
+                    keep = _partial_suffix(self._pending, _THINK_CLOSE)
+                    self.think_chars += len(self._pending) - keep
+                    self._pending = self._pending[len(self._pending) - keep:]
+                    break
+                self.think_chars += i
+                self._pending = self._pending[i + len(_THINK_CLOSE):]
+                self.in_think = False
+            else:
+                i = self._pending.find(_THINK_OPEN)
+                if i == -1:
+                    keep = _partial_suffix(self._pending, _THINK_OPEN)
+                    out.append(self._pending[:len(self._pending) - keep])
+                    self._pending = self._pending[len(self._pending) - keep:]
+                    break
+                out.append(self._pending[:i])
+                self._pending = self._pending[i + len(_THINK_OPEN):]
+                self.in_think = True
+        return ''.join(out)
+
+    def flush(self) -> str:
+        rest, self._pending = ('' if self.in_think else self._pending), ''
+        return rest
+
+
+def strip_think(text: str) -> str:
+    """去除完整文本中的 <think> 推理块；未闭合的推理块连同其后内容一并去除"""
+    think = ThinkFilter()
+    return think.feed(text) + think.flush()
+
+
+class StructuredOutputParser:
+    """
+    流式结构化输出解析器：
+      - feed(chunk) 逐段接收模型输出，跳过 <think> 块、```json 围栏与 JSON 前的说明文字
+      - 跟踪顶层字段，所有 required 字段的值完整后 feed 返回 True，调用方即可提前结束生成
+      - result() 修复常见缺陷（尾随逗号、未闭合的字符串/括号、被截断的字段）后按 schema 校验
+    """
+
+    def __init__(self, schema: dict, required=None):
+        self.schema = schema
+        self.required = set(schema if required is None else required)
+        self.completed = set()
+        self.think = ThinkFilter()
+        self._text = []           # 去除推理块后的全部输出
+        self._obj = []            # 从首个 '{' 开始的对象文本
+        self._started = False
+        self._closed = False
+        self._stack = []          # 未闭合的 '{' / '['
+        self._in_string = False
+        self._escape = False
+        self._expect_key = True   # 顶层：下一个字符串是键还是值
+        self._key_chars = None    # 正在读取的顶层键
+        self._key = None          # 当前顶层键
+        self._value_open = False  # 顶层当前值是否已开始
+        self._safe_end = 0        # 最后一个完整顶层字段之后的位置
+
+    @property
+    def text(self) -> str:
+        return ''.join(self._text)
+
+    @property
+    def done(self) -> bool:
+        return self._closed or (bool(self.required) and self.required <= self.completed)
+
+    def feed(self, chunk: str) -> bool:
+        """接收一段输出；返回 True 表示所需字段已齐全，可以停止生成"""
+        if not self._closed:
+            self._scan(self.think.feed(chunk))
+        return self.done
+
+    def close(self):
+        """输出结束时调用，处理缓冲区中剩余的文本"""
+        if not self._closed:
+            self._scan(self.think.flush())
+
+    # ----- 增量扫描 -----
+    def _scan(self, text: str):
+        self._text.append(text)
+        for ch in text:
+            if self._closed:
+                return
+            if not self._started:
+                if ch != '{':
+                    continue
+                self._started = True
+            self._obj.append(ch)
+            self._step(ch)
+
+    def _complete_field(self):
+        if self._key is not None:
+            self.completed.add(self._key)
+        self._value_open = False
+        self._safe_end = len(self._obj)
+
+    def _step(self, ch: str):
+        depth = len(self._stack)
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif ch == '\\':
+                self._escape = True
+            elif ch == '"':
+                self._in_string = False
+                if depth == 1 and self._key_chars is not None:
+                    self._key = ''.join(self._key_chars)
+                    self._key_chars = None
+                elif depth == 1:
+                    self._complete_field()
+            elif depth == 1 and self._key_chars is not None:
+                self._key_chars.append(ch)
+            return
+
+        if ch == '"':
+            self._in_string = True
+            if depth == 1 and self._expect_key:
+                self._key_chars = []
+                self._expect_key = False
+            elif depth == 1:
+                self._value_open = True
+        elif ch in '{[':
+            if depth == 1:
+                self._value_open = True
+            self._stack.append(ch)
+        elif ch in '}]':
+            if self._stack:
+                self._stack.pop()
+            if depth == 2:
+                self._complete_field()
+            elif depth == 1:
+                if self._value_open:
+                    self._complete_field()
+                self._closed = True
+        elif ch == ':' and depth == 1:
+            self._value_open = False
+        elif ch == ',' and depth == 1:
+            if self._value_open:
+                self._complete_field()
+            self._safe_end = len(self._obj) - 1
+            self._expect_key = True
+            self._key = None
+        elif depth == 1 and not ch.isspace() and not self._expect_key:
+            # 数字、true/false/null 等字面量，在遇到 ',' 或 '}' 时完成
+            self._value_open = True
+
+    # ----- 修复与校验 -----
+    def _repaired_candidates(self):
+        text = ''.join(self._obj)
+        if self._closed:
+            yield text
+        # 1. 补全未闭合的字符串与括号
+        repaired = text + ('"' if self._in_string else '')
+        repaired = repaired.rstrip().rstrip(',')
+        if repaired.endswith(':'):
+            repaired += 'null'
+        closers = {'{': '}', '[': ']'}
+        yield repaired + ''.join(closers[c] for c in reversed(self._stack))
+        # 2. 截断到最后一个完整字段
+        yield ''.join(self._obj[:self._safe_end]).rstrip().rstrip(',') + '}'
+
+    def result(self) -> dict:
+        """返回修复并校验后的 dict；无法修复或缺少必填字段时抛出 StructuredOutputError"""
+        if not self._started:
+            raise StructuredOutputError('输出中没有 JSON 对象', self.text)
+        data = None
+        for candidate in self._repaired_candidates():
+            try:
+                data = json.loads(_strip_trailing_commas(candidate))
+                break
+            except ValueError:
+                continue
+        if not isinstance(data, dict):
+            raise StructuredOutputError('JSON 无法修复', self.text)
+        return self._validate(data)
+
+    def _validate(self, data: dict) -> dict:
+        missing = [f for f in self.required if data.get(f) is None]
+        if missing:
+            raise StructuredOutputError(f"缺少字段: {', '.join(sorted(missing))}", self.text)
+        for field, types in self.schema.items():
+            value = data.get(field)
+            if value is None or isinstance(value, types):
+                continue
+            expected = types if isinstance(types, tuple) else (types,)
+            if float in expected and isinstance(value, str):
+                try:
+                    data[field] = float(value)
+                    continue
+                except ValueError:
+                    pass
+            elif list in expected:
+                data[field] = [value]
+                continue
+            elif str in expected:
+                data[field] = str(value)
+                continue
+            raise StructuredOutputError(f"字段 {field} 类型错误", self.text)
+        return data
+
+
+def _strip_trailing_commas(text: str) -> str:
+    """去除字符串以外、紧邻 '}' 或 ']' 之前的逗号"""
+    out = []
+    in_string = escape = False
+    for ch in text:
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == '\\':
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in '}]':
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ',':
+                out.pop()
+        out.append(ch)
+    return ''.join(out)
+
+
+def parse_structured(text: str, schema: dict, required=None) -> dict:
+    """一次性解析完整的模型输出"""
+    parser = StructuredOutputParser(schema, required)
+    parser.feed(text)
+    parser.close()
+    return parser.result()
@@ -1,31 +1,18 @@
 # app/services/survey_logic.py
 
-import os
-import re
-import json
 import logging
-import requests
 from datetime import datetime
 from typing import Dict, List
-from openai import OpenAI
-
-# ---------- 日志配置（全局开启 DEBUG 级别） ----------
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s %(levelname)s %(name)s %(message)s'
+from app.services import llm_client
+from app.services.structured_output import SURVEY_SCHEMA, StructuredOutputError
+from app.services.metrics import span
+from app.services.model_router import router
+from app.services.llm_governor import (
+    AdmissionRejected, BACKEND_DEEPSEEK, BACKEND_LOCAL, PRIORITY_STANDARD
 )
 
-# ---------- 配置项（建议通过环境变量管理） ----------
-DEEPSEEK_API_KEY    = os.getenv("DEEPSEEK_API_KEY", "sk-e1927ee1ea204a22b49fa3667f70a033")
-DEEPSEEK_BASE_URL   = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com")
-USE_LOCAL_INFERENCE = False  # True 使用本地推理服务，False 使用 DeepSeek API
-INFERENCE_URL       = os.getenv("INFERENCE_URL", "http://localhost:11434")
-INFERENCE_MODEL     = os.getenv("INFERENCE_MODEL", "deepseek-r1:1.5b")
-
-api_client = OpenAI(
-    api_key=DEEPSEEK_API_KEY,
-    base_url=DEEPSEEK_BASE_URL
-)
+# 日志（输出方式由 create_app 统一配置）
+logger = logging.getLogger(__name__)
 
 def process_survey(questions: List[str], responses: List[int]) -> Dict:
     """
@@ -35,19 +22,24 @@ def process_survey(questions: List[str], responses: List[int]) -> Dict:
     """
     try:
         validate_responses(questions, responses)
-        prompt = build_assessment_prompt(questions, responses)
+        with span('prompt_build', service='survey'):
+            prompt = build_assessment_prompt(questions, responses)
 
-        if USE_LOCAL_INFERENCE:
+        # 后端由路由策略决定（推理服务地址、密钥等见 llm_client）
+        if router.route('survey') == BACKEND_LOCAL:
             raw = analyze_with_inference_server(prompt)
         else:
             raw = get_deepseek_response(prompt)
 
         result = standardize_response(raw)
-        logging.debug(f"Standardized response: {result}")
+        logger.debug("Standardized response: %s", result)
         return result
 
+    except AdmissionRejected:
+        # 交由路由层直接返回 429/503
+        raise
     except Exception as e:
-        logging.error(f"process_survey 全面失败：{e}", exc_info=True)
+        logger.error("process_survey 全面失败：%s", e, exc_info=True)
         return error_response()
 
 
@@ -83,49 +75,46 @@ def build_assessment_prompt(questions: List[str], responses: List[int]) -> str:
     return f"{enhanced_instructions}\n用户回答详情：\n{details}"  
 
 
-def get_deepseek_response(prompt: str, retries: int = 3) -> Dict:
+def get_deepseek_response(prompt: str, retries: int = 2) -> Dict:
+    """
+    流式调用 DeepSeek 生成评估 JSON：四个字段齐全即停止生成，轻微格式缺陷就地修复。
+    网络错误的退避重试与熔断由 llm_client 负责，此处仅在输出无法修复时重新生成。
+    """
+    messages = [
+        {"role": "system", "content": "你是一位专业心理医生，输出严格 JSON 格式，不要额外说明。"},
+        {"role": "user",   "content": prompt}
+    ]
     for attempt in range(1, retries + 1):
         try:
-            resp = api_client.chat.completions.create(
-                model="deepseek-chat",
-                messages=[
-                    {"role": "system", "content": "你是一位专业心理医生，输出严格 JSON 格式，不要额外说明。"},
-                    {"role": "user",   "content": prompt}
-                ],
+            return llm_client.complete_structured(
+                messages,
+                SURVEY_SCHEMA,
+                backend=BACKEND_DEEPSEEK,
+                priority=PRIORITY_STANDARD,
                 temperature=0.3,
                 max_tokens=500,
                 response_format={"type": "json_object"}
             )
-            raw = resp.choices[0].message.content
-            # 清理 ```json 包裹
-            if raw.startswith("```json"):
-                raw = raw.split("```json",1)[1].rsplit("```",1)[0].strip()
-            return json.loads(raw)
-        except Exception as e:
-            logging.warning(f"[DeepSeek API 尝试 {attempt}] 失败: {e}")
-    raise Exception("DeepSeek API 请求失败")
+        except StructuredOutputError as e:
+            logger.warning("[DeepSeek JSON 解析 尝试 %d] 失败: %s", attempt, e)
+    raise Exception("DeepSeek 返回内容无法解析为 JSON")
 
 
 def analyze_with_inference_server(prompt: str) -> Dict:
-    url = f"{INFERENCE_URL.rstrip('/')}/v1/chat/completions"
-    payload = {
-        "model": INFERENCE_MODEL,
-        "messages": [
-            {"role": "system", "content": "你是一位专业心理医生，输出严格 JSON，仅返回结果，不要多余文本。"},
-            {"role": "user",   "content": prompt}
-        ],
-        "temperature": 0.3,
-        "max_tokens": 500
-    }
-    resp = requests.post(url, json=payload, timeout=30)
-    resp.raise_for_status()
-    data = resp.json()
-    content = data["choices"][0]["message"]["content"]
-    # 提取首个 ```json … ``` 区块
-    m = re.search(r"```json\s*(\{.*?\})\s*```", content, re.S)
-    if not m:
-        raise ValueError("无法提取 JSON 区块")
-    return json.loads(m.group(1))
+    messages = [
+        {"role": "system", "content": "你是一位专业心理医生，输出严格 JSON，仅返回结果，不要多余文本。"},
+        {"role": "user",   "content": prompt}
+    ]
+    # 本地推理模型的 <think> 块与 ```json 围栏由解析器在流式接收时跳过
+    return llm_client.complete_structured(
+        messages,
+        SURVEY_SCHEMA,
+        backend=BACKEND_LOCAL,
+        priority=PRIORITY_STANDARD,
+        timeout=30,
+        temperature=0.3,
+        max_tokens=500
+    )
 
 
 def standardize_response(raw: Dict) -> Dict:
@@ -0,0 +1,93 @@
+# app/services/warmup.py
+
+import gc
+import time
+import logging
+import importlib
+from app.services.metrics import observe_stage
+
+logger = logging.getLogger(__name__)
+
+
+def _import_modules():
+    # 路由已导入这些模块时为空操作；单独调用（如 CLI、gunicorn master）时提前完成导入
+    for name in ('app.services.image_preprocess', 'app.services.drawing_features',
+                 'app.services.image_encoder', 'app.services.emotion_classifier',
+                 'app.services.evaluate_logic', 'app.services.questions_data'):
+        importlib.import_module(name)
+
+
+def _llm_client():
+    from app.services import llm_client
+    llm_client.get_api_client()
+
+
+def _face_cascade():
+    from app.services.image_preprocess import _get_face_cascade
+    _get_face_cascade()
+
+
+def _emotion_model():
+    from app.services import emotion_classifier
+    if emotion_classifier.enabled():
+        emotion_classifier._get_net()
+
+
+# (名称, 函数)，按顺序执行；首次请求时才会发生的初始化都应登记在这里
+WARMUP_STEPS = [
+    ('imports', _import_modules),
+    ('llm_client', _llm_client),
+    ('face_cascade', _face_cascade),
+    ('emotion_model', _emotion_model),
+]
+
+
+def warm_up() -> dict:
+    """
+    提前完成延迟初始化（重量级依赖的导入、SDK 客户端、模型文件），返回各步骤耗时（秒）。
+    单个步骤失败只记日志，对应资源仍会在首次使用时再尝试加载。
+    """
+    timings = {}
+    for name, fn in WARMUP_STEPS:
+        start = time.perf_counter()
+        try:
+            fn()
+        except Exception:
+            logger.exception("预热步骤失败: %s", name)
+            continue
+        timings[name] = time.perf_counter() - start
+        observe_stage('warmup', timings[name], step=name)
+    logger.info("预热完成: %s", ', '.join(f"{k} {v * 1000:.0f}ms" for k, v in timings.items()))
+    return timings
+
+
+# ---------- 预加载（fork 前后） ----------
+def prepare_fork() -> dict:
+    """
+    在 master 进程 fork worker 之前调用：完成预热后整理并冻结当前所有对象。
+    冻结的对象不再参与垃圾回收扫描，worker 中的 GC 不会写它们的对象头，
+    预加载的模块、模型与题库等只读数据得以在各 worker 间按页共享（写时复制）。
+    """
+    timings = warm_up()
+    gc.collect()
+    gc.freeze()
+    logger.info("已冻结 %d 个对象，等待 fork worker", gc.get_freeze_count())
+    return timings
+
+
+def after_fork(app) -> None:
+    """
+    在每个 worker fork 之后调用：重建不能跨进程共享的资源——
+    日志写出线程、推理 SDK 客户端（连接池中的套接字）、数据库连接池与预处理进程池。
+    """
+    from app import db
+    from app.services import llm_client, logging_setup
+    from app.services.image_preprocess import preprocess_pool
+
+    logging_setup.reinit_after_fork()
+    llm_client.reset_clients()
+    preprocess_pool.reset_after_fork()
+    with app.app_context():
+        # close=False：父进程继承来的连接留给父进程，子进程只是不再使用它们
+        for engine in db.engines.values():
+            engine.dispose(close=False)
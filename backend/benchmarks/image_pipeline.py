@@ -0,0 +1,281 @@
+# benchmarks/image_pipeline.py
+"""
+图像预处理流水线微基准：
+在合成语料（画布 PNG 线稿、大尺寸 JPEG 照片、GIF）的多种分辨率上，
+逐阶段测量 process_upload 与提示词图片编码（image_encoder）的耗时、峰值内存和输出字节数。
+
+    python -m benchmarks.image_pipeline --sizes 256,512,1024 --repeat 3 --output image.json
+    python -m benchmarks.image_pipeline --skip denoise --formats jpeg --sizes 4032
+    python -m benchmarks.image_pipeline --compare before.json after.json
+
+阶段与线上顺序一致：
+    read → clahe → denoise → face → thumbnail → encode
+cv2.imread 无法读取时（如部分 GIF），与线上相同地跳过 OpenCV 阶段，直接编码原文件。
+默认 cv2.setNumThreads(1)，与预处理进程池中的单个 worker 一致，据此估算每个 worker 的吞吐。
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+import numpy as np
+from PIL import Image, ImageDraw
+
+from app.services.image_preprocess import clahe_equalize, denoise, crop_face
+from app.services.image_encoder import encode_for_prompt
+from app.routes.image import thumbnail_bytes
+
+FORMATS = ('png', 'jpeg', 'gif')
+STAGES = ('read', 'clahe', 'denoise', 'face', 'thumbnail', 'encode')
+
+
+# ---------- 合成语料 ----------
+def _canvas_drawing(size: int, rng: random.Random) -> Image.Image:
+    """模拟前端画布导出：白底 RGBA、少量粗笔画"""
+    img = Image.new('RGBA', (size, size), (255, 255, 255, 255))
+    draw = ImageDraw.Draw(img)
+    stroke = max(2, size // 128)
+    for _ in range(30):
+        points = [(rng.randrange(size), rng.randrange(size)) for _ in range(5)]
+        color = (rng.randrange(256), rng.randrange(256), rng.randrange(256), 255)
+        draw.line(points, fill=color, width=stroke, joint='curve')
+    draw.ellipse((size // 3, size // 4, size * 2 // 3, size * 2 // 3), outline='black', width=stroke)
+    return img
+
+
+def _photo(size: int, rng: random.Random) -> Image.Image:
+    """模拟手机照片：4:3、平滑渐变 + 传感器噪声 + 类人脸的椭圆区域"""
+    width, height = size, size * 3 // 4
+    yy, xx = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = np.stack([
+        120 + 80 * np.sin(xx / width * np.pi),
+        110 + 60 * np.cos(yy / height * np.pi),
+        100 + 50 * np.sin((xx + yy) / (width + height) * 2 * np.pi),
+    ], axis=-1)
+    cx, cy, rx, ry = width / 2, height / 2, width / 8, height / 5
+    face = ((xx - cx) / rx) ** 2 + ((yy - cy) / ry) ** 2 <= 1
+    base[face] = (200, 170, 150)
+    noise = np.random.default_rng(rng.randrange(1 << 30)).normal(0, 12, base.shape)
+    return Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8), 'RGB')
+
+
+def _gif(size: int, rng: random.Random) -> list:
+    """调色板 GIF，三帧"""
+    return [_canvas_drawing(size, rng).convert('RGB').convert('P', palette=Image.ADAPTIVE) for _ in range(3)]
+
+
+def build_corpus(directory: str, formats: list, sizes: list, seed: int = 0) -> list:
+    """在 directory 中生成语料文件，返回 [(名称, 格式, 路径)]"""
+    rng = random.Random(seed)
+    corpus = []
+    for fmt in formats:
+        for size in sizes:
+            path = os.path.join(directory, f"{fmt}_{size}.{'jpg' if fmt == 'jpeg' else fmt}")
+            if fmt == 'png':
+                _canvas_drawing(size, rng).save(path, format='PNG')
+            elif fmt == 'jpeg':
+                _photo(size, rng).save(path, format='JPEG', quality=92)
+            else:
+                frames = _gif(size, rng)
+                frames[0].save(path, format='GIF', save_all=True, append_images=frames[1:], duration=200, loop=0)
+            corpus.append((f"{fmt}_{size}", fmt, path))
+    return corpus
+
+
+# ---------- 单次流水线 ----------
+def _output_bytes(value) -> int:
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, str):
+        return len(value)
+    return 0
+
+
+def _run_pipeline(source: str, workdir: str, skip: set, trace: bool) -> dict:
+    """
+    按线上顺序执行一遍流水线，返回 {stage: {seconds, peak_bytes, output_bytes}}。
+    trace=True 时用 tracemalloc 记录每个阶段的 Python/NumPy 峰值分配（会拖慢执行，单独一轮）。
+    """
+    filepath = os.path.join(workdir, 'upload' + os.path.splitext(source)[1])
+    shutil.copyfile(source, filepath)
+    results = {}
+
+    def measure(stage, fn, *args):
+        if stage in skip:
+            return args[0] if args else None
+        if trace:
+            tracemalloc.start()
+        start = time.perf_counter()
+        value = fn(*args)
+        elapsed = time.perf_counter() - start
+        peak = 0
+        if trace:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        results[stage] = {'seconds': elapsed, 'peak_bytes': peak, 'output_bytes': _output_bytes(value)}
+        return value
+
+    img = measure('read', cv2.imread, filepath)
+    if img is not None:
+        img = measure('clahe', clahe_equalize, img)
+        img = measure('denoise', denoise, img)
+        img = measure('face', crop_face, img)
+        ext = 'jpg' if filepath.endswith(('.jpg', '.jpeg')) else 'png'
+        data = measure('thumbnail', thumbnail_bytes, img, ext)
+        if 'thumbnail' in results:
+            filepath = os.path.join(workdir, 'thumbnail.' + ext)
+            with open(filepath, 'wb') as f:
+                f.write(data)
+    measure('encode', lambda path: encode_for_prompt(path).b64, filepath)
+    return results
+
+
+def bench_image(name: str, fmt: str, path: str, repeat: int, skip: set) -> dict:
+    with Image.open(path) as probe:
+        width, height = probe.size
+    workdir = tempfile.mkdtemp(prefix='imgbench_')
+    try:
+        runs = [_run_pipeline(path, workdir, skip, trace=False) for _ in range(repeat)]
+        traced = _run_pipeline(path, workdir, skip, trace=True)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    stages = {}
+    for stage in STAGES:
+        samples = [run[stage]['seconds'] for run in runs if stage in run]
+        if not samples:
+            continue
+        stages[stage] = {
+            'median_ms': round(statistics.median(samples) * 1000, 3),
+            'min_ms': round(min(samples) * 1000, 3),
+            'max_ms': round(max(samples) * 1000, 3),
+            'peak_mem_kb': round(traced.get(stage, {}).get('peak_bytes', 0) / 1024, 1),
+            'output_bytes': runs[-1][stage]['output_bytes'],
+        }
+    total_ms = sum(s['median_ms'] for s in stages.values())
+    return {
+        'name': name,
+        'format': fmt,
+        'width': width,
+        'height': height,
+        'input_bytes': os.path.getsize(path),
+        'opencv_readable': runs[-1]['read']['output_bytes'] > 0,
+        'stages': stages,
+        'total_ms': round(total_ms, 3),
+        # 单个 worker（单线程 OpenCV）每秒可处理的图片数，用于估算进程池规模
+        'images_per_sec_per_worker': round(1000 / total_ms, 3) if total_ms > 0 else None,
+    }
+
+
+# ---------- 输出与对比 ----------
+def _print_report(report: dict):
+    header = f"{'图片':<14}{'尺寸':>11}{'输入KB':>9}" + ''.join(f"{s:>11}" for s in STAGES) + f"{'合计ms':>11}{'峰值MB':>9}"
+    print(header)
+    for r in report['results']:
+        cells = ''.join(
+            f"{r['stages'][s]['median_ms']:>11.1f}" if s in r['stages'] else f"{'-':>11}" for s in STAGES
+        )
+        peak = max((s['peak_mem_kb'] for s in r['stages'].values()), default=0) / 1024
+        print(f"{r['name']:<14}{r['width']:>5}x{r['height']:<5}{r['input_bytes'] / 1024:>9.1f}"
+              f"{cells}{r['total_ms']:>11.1f}{peak:>9.1f}")
+    print("\n输出字节数（最后一轮）：")
+    for r in report['results']:
+        sizes = ', '.join(f"{s}={v['output_bytes']}" for s, v in r['stages'].items())
+        print(f"  {r['name']:<14}{sizes}")
+
+
+def compare(baseline_path: str, current_path: str, threshold: float) -> int:
+    """逐图片逐阶段比较中位耗时，超过 threshold 视为退化，返回非零退出码"""
+    with open(baseline_path, encoding='utf-8') as f:
+        base = {r['name']: r for r in json.load(f)['results']}
+    with open(current_path, encoding='utf-8') as f:
+        cur = {r['name']: r for r in json.load(f)['results']}
+
+    regressed = False
+    for name, now in cur.items():
+        old = base.get(name)
+        if old is None:
+            continue
+        for stage, s in now['stages'].items():
+            if stage not in old['stages']:
+                continue
+            before, after = old['stages'][stage]['median_ms'], s['median_ms']
+            delta = (after - before) / max(before, 1e-6)
+            bad = delta > threshold and after - before > 1.0
+            regressed |= bad
+            if bad or abs(delta) > threshold:
+                print(f"{name:<14}{stage:<10}{before:>10.1f} → {after:>10.1f} ms  {delta:+.1%}"
+                      f"{'  退化' if bad else ''}")
+    print('存在退化' if regressed else '无退化')
+    return 1 if regressed else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='图像预处理流水线微基准')
+    parser.add_argument('--formats', default=','.join(FORMATS), help='逗号分隔：' + ','.join(FORMATS))
+    parser.add_argument('--sizes', default='256,512,1024', help='长边像素，逗号分隔')
+    parser.add_argument('--repeat', type=int, default=3, help='每张图片重复次数（取中位数）')
+    parser.add_argument('--skip', default='', help='跳过的阶段，逗号分隔（如 denoise）')
+    parser.add_argument('--cv-threads', type=int, default=1, help='OpenCV 线程数，默认与进程池 worker 一致')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='将结果写入 JSON 文件')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'), help='对比两份 JSON 结果')
+    parser.add_argument('--threshold', type=float, default=0.15, help='判定退化的相对阈值')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return compare(args.compare[0], args.compare[1], args.threshold)
+
+    formats = [f.strip() for f in args.formats.split(',') if f.strip()]
+    skip = {s.strip() for s in args.skip.split(',') if s.strip()}
+    # read 阶段的输出是后续 OpenCV 阶段的输入，不可跳过
+    unknown = (set(formats) - set(FORMATS)) | (skip - set(STAGES[1:]))
+    if unknown:
+        parser.error(f"未知格式或阶段: {', '.join(sorted(unknown))}")
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+
+    cv2.setNumThreads(args.cv_threads)
+    corpus_dir = tempfile.mkdtemp(prefix='imgcorpus_')
+    try:
+        corpus = build_corpus(corpus_dir, formats, sizes, args.seed)
+        # 预热：加载 Haar 分类器、初始化 OpenCV/PIL 内部状态，避免计入首张图片
+        warm_dir = tempfile.mkdtemp(prefix='imgbench_', dir=corpus_dir)
+        _run_pipeline(min(corpus, key=lambda c: os.path.getsize(c[2]))[2], warm_dir, skip, trace=False)
+        results = []
+        for name, fmt, path in corpus:
+            print(f"… {name}", file=sys.stderr, flush=True)
+            results.append(bench_image(name, fmt, path, max(1, args.repeat), skip))
+    finally:
+        shutil.rmtree(corpus_dir, ignore_errors=True)
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'opencv': cv2.__version__,
+        'cv_threads': args.cv_threads,
+        'repeat': args.repeat,
+        'skipped': sorted(skip),
+        'results': results,
+    }
+    _print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已写入 {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
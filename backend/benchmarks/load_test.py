@@ -0,0 +1,345 @@
+# benchmarks/load_test.py
+"""
+后端压测：启动本地模拟推理服务，以指定并发驱动
+/api/chat、/api/survey、/api/image/upload、/api/evaluate，
+输出吞吐量、p50/p95/p99 延迟以及 /metrics 中各阶段耗时的分解，并可写出 JSON 供回归对比。
+
+进程内压测（默认，自动启动模拟推理服务，不产生任何 API 费用）：
+    python -m benchmarks.load_test --concurrency 8 --requests 200 --output before.json
+压测已部署的服务（推理服务需另行指向 mock_llm_server）：
+    python -m benchmarks.load_test --base-url http://127.0.0.1:5000 --endpoints chat,survey
+对比两次结果：
+    python -m benchmarks.load_test --compare before.json after.json
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import base64
+import random
+import uuid
+import zlib
+import struct
+import argparse
+import platform
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# 允许以脚本方式运行：python benchmarks/load_test.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.mock_llm_server import start_server, add_settings_arguments, settings_from_args
+
+ENDPOINTS = ('chat', 'survey', 'image', 'evaluate')
+
+QUESTIONS = [
+    {"id": i, "text": text, "options": ["从不", "偶尔", "经常", "总是"]}
+    for i, text in enumerate([
+        "最近两周是否感到情绪低落？", "是否对日常活动失去兴趣？", "睡眠质量如何？",
+        "是否容易感到疲劳？", "是否难以集中注意力？", "是否感到紧张或焦虑？"
+    ])
+]
+
+
+# ---------- 请求负载 ----------
+def _synthetic_png(width: int = 512, height: int = 512) -> bytes:
+    """生成一张类似手绘的线稿 PNG，作为图片与评估接口的输入"""
+    from PIL import Image, ImageDraw
+    rng = random.Random(42)
+    img = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(img)
+    for _ in range(40):
+        points = [(rng.randrange(width), rng.randrange(height)) for _ in range(4)]
+        draw.line(points, fill=(rng.randrange(80), rng.randrange(80), rng.randrange(80)), width=3)
+    draw.ellipse((width // 4, height // 4, width * 3 // 4, height * 3 // 4), outline='black', width=4)
+    buf = io.BytesIO()
+    img.save(buf, format='PNG')
+    return buf.getvalue()
+
+
+def _unique_png(png: bytes) -> bytes:
+    """在 IEND 前插入一个随机 tEXt 块：像素不变但内容哈希不同，不会命中上传去重与变体复用"""
+    body = b'tEXt' + b'bench\x00' + uuid.uuid4().hex.encode('ascii')
+    chunk = struct.pack('>I', len(body) - 4) + body + struct.pack('>I', zlib.crc32(body))
+    return png[:-12] + chunk + png[-12:]
+
+
+def _build_payloads(image_size: int) -> dict:
+    png = _synthetic_png(image_size, image_size)
+    responses = [random.Random(7).randrange(4) for _ in QUESTIONS]
+    return {
+        'png': png,
+        'chat': {'message': '最近工作压力很大，晚上总是睡不好，应该怎么调整？'},
+        'survey': {'questions': QUESTIONS, 'responses': responses, 'ageGroup': '18-25', 'gender': 'female'},
+        'evaluate': {
+            'ageGroup': '18-25', 'gender': 'female',
+            'text': '最近经常感到疲惫，对以前喜欢的事情提不起兴趣。',
+            'questions': QUESTIONS, 'responses': responses,
+            'drawing': 'data:image/png;base64,' + base64.b64encode(png).decode('ascii'),
+        },
+    }
+
+
+# ---------- 客户端：进程内 test_client 或远程 HTTP ----------
+class InProcessClient:
+    def __init__(self, app):
+        self._client = app.test_client()
+
+    def post_json(self, path: str, payload: dict) -> int:
+        return self._client.post(path, json=payload).status_code
+
+    def post_file(self, path: str, name: str, data: bytes) -> int:
+        return self._client.post(path, data={'file': (io.BytesIO(data), name)},
+                                 content_type='multipart/form-data').status_code
+
+    def get_text(self, path: str) -> str:
+        return self._client.get(path).get_data(as_text=True)
+
+
+class HttpClient:
+    def __init__(self, base_url: str, timeout: float):
+        import requests
+        self._session = requests.Session()
+        self._base = base_url.rstrip('/')
+        self._timeout = timeout
+
+    def post_json(self, path: str, payload: dict) -> int:
+        return self._session.post(self._base + path, json=payload, timeout=self._timeout).status_code
+
+    def post_file(self, path: str, name: str, data: bytes) -> int:
+        return self._session.post(self._base + path, files={'file': (name, data, 'image/png')},
+                                  timeout=self._timeout).status_code
+
+    def get_text(self, path: str) -> str:
+        return self._session.get(self._base + path, timeout=self._timeout).text
+
+
+def _send(client, endpoint: str, payloads: dict) -> int:
+    if endpoint == 'chat':
+        return client.post_json('/api/chat/', payloads['chat'])
+    if endpoint == 'survey':
+        return client.post_json('/api/survey', payloads['survey'])
+    if endpoint == 'image':
+        # 默认每个请求的内容都不同，模拟不同用户的上传；--repeat-image 时测量去重后的复用路径
+        data = payloads['png'] if payloads.get('repeat_image') else _unique_png(payloads['png'])
+        return client.post_file('/api/image/upload', f"bench_{uuid.uuid4().hex}.png", data)
+    if endpoint == 'evaluate':
+        return client.post_json('/api/evaluate', payloads['evaluate'])
+    raise ValueError(f"未知接口: {endpoint}")
+
+
+# ---------- /metrics 解析 ----------
+def _parse_stage_metrics(text: str) -> dict:
+    """从 Prometheus 文本中提取 stage_duration_seconds 的 sum/count，key 为标签串"""
+    series = {}
+    for line in text.splitlines():
+        for suffix in ('_sum', '_count'):
+            prefix = 'stage_duration_seconds' + suffix
+            if line.startswith(prefix + '{') or line.startswith(prefix + ' '):
+                labels, _, value = line[len(prefix):].rpartition(' ')
+                entry = series.setdefault(labels.strip('{}'), {'sum': 0.0, 'count': 0})
+                entry[suffix[1:]] = float(value)
+    return series
+
+
+def _stage_breakdown(before: dict, after: dict) -> dict:
+    """两次 /metrics 快照之差：本轮压测期间每个阶段的调用次数、平均与总耗时"""
+    result = {}
+    for labels, end in after.items():
+        start = before.get(labels, {'sum': 0.0, 'count': 0})
+        count = int(end['count'] - start['count'])
+        if count <= 0:
+            continue
+        total = end['sum'] - start['sum']
+        result[labels] = {'count': count, 'total_seconds': round(total, 6),
+                          'avg_ms': round(total / count * 1000, 3)}
+    return dict(sorted(result.items(), key=lambda kv: -kv[1]['total_seconds']))
+
+
+# ---------- 统计 ----------
+def _percentile(ordered: list, q: float) -> float:
+    if not ordered:
+        return 0.0
+    pos = (len(ordered) - 1) * q
+    lo, hi = int(pos), min(int(pos) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+
+def _summarize(latencies: list, statuses: dict, wall: float) -> dict:
+    ordered = sorted(latencies)
+    ok = sum(n for code, n in statuses.items() if 200 <= int(code) < 300)
+    return {
+        'requests': len(ordered),
+        'ok': ok,
+        'errors': len(ordered) - ok,
+        'status_codes': statuses,
+        'wall_seconds': round(wall, 4),
+        'throughput_rps': round(len(ordered) / wall, 3) if wall > 0 else 0.0,
+        'latency_ms': {
+            'mean': round(sum(ordered) / len(ordered) * 1000, 3) if ordered else 0.0,
+            'p50': round(_percentile(ordered, 0.50) * 1000, 3),
+            'p95': round(_percentile(ordered, 0.95) * 1000, 3),
+            'p99': round(_percentile(ordered, 0.99) * 1000, 3),
+            'max': round(ordered[-1] * 1000, 3) if ordered else 0.0,
+        },
+    }
+
+
+def run_endpoint(make_client, endpoint: str, payloads: dict, total: int, concurrency: int) -> dict:
+    """以 concurrency 个并发连接向单个接口发送 total 个请求"""
+    local = threading.local()
+    lock = threading.Lock()
+    latencies, statuses = [], {}
+
+    def client():
+        if getattr(local, 'client', None) is None:
+            local.client = make_client()
+        return local.client
+
+    def one(_):
+        start = time.perf_counter()
+        try:
+            code = _send(client(), endpoint, payloads)
+        except Exception:
+            code = 599
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            statuses[str(code)] = statuses.get(str(code), 0) + 1
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        start = time.perf_counter()
+        list(pool.map(one, range(total)))
+        wall = time.perf_counter() - start
+    return _summarize(latencies, statuses, wall)
+
+
+# ---------- 对比 ----------
+def compare(baseline_path: str, current_path: str, threshold: float) -> int:
+    """比较两份 JSON 结果，p95 或吞吐量退化超过 threshold 时返回非零退出码"""
+    with open(baseline_path, encoding='utf-8') as f:
+        base = json.load(f)
+    with open(current_path, encoding='utf-8') as f:
+        cur = json.load(f)
+
+    regressed = False
+    print(f"{'接口':<10}{'吞吐 基线':>12}{'吞吐 当前':>12}{'p95 基线':>12}{'p95 当前':>12}  结论")
+    for endpoint, now in cur['results'].items():
+        old = base['results'].get(endpoint)
+        if old is None:
+            continue
+        rps_delta = (now['throughput_rps'] - old['throughput_rps']) / max(old['throughput_rps'], 1e-9)
+        p95_delta = (now['latency_ms']['p95'] - old['latency_ms']['p95']) / max(old['latency_ms']['p95'], 1e-9)
+        bad = rps_delta < -threshold or p95_delta > threshold
+        regressed |= bad
+        print(f"{endpoint:<10}{old['throughput_rps']:>12.2f}{now['throughput_rps']:>12.2f}"
+              f"{old['latency_ms']['p95']:>12.1f}{now['latency_ms']['p95']:>12.1f}  "
+              f"{'退化' if bad else 'OK'} (吞吐 {rps_delta:+.1%}, p95 {p95_delta:+.1%})")
+    return 1 if regressed else 0
+
+
+# ---------- 入口 ----------
+def _create_in_process_app(config_object: str, mock_url: str):
+    # 必须在导入 app 之前设置，推理客户端在导入时读取这些配置
+    os.environ['DEEPSEEK_BASE_URL'] = mock_url
+    os.environ['DEEPSEEK_API_KEY'] = 'sk-benchmark'
+    os.environ['INFERENCE_URL'] = mock_url
+    from app import create_app
+    app = create_app(config_object)
+    app.config['TESTING'] = True
+    if app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite') and app.config.get('DB_PROFILE') != 'sqlite-memory':
+        # 压测用的 SQLite 文件库不经过迁移，直接建表（内存库在创建应用时已建表）
+        from app import db
+        with app.app_context():
+            db.create_all()
+    return app
+
+
+def _print_report(report: dict):
+    for endpoint, r in report['results'].items():
+        lat = r['latency_ms']
+        print(f"\n== {endpoint}: {r['requests']} 请求, 成功 {r['ok']}, 状态码 {r['status_codes']}")
+        print(f"   吞吐 {r['throughput_rps']:.2f} req/s | p50 {lat['p50']:.1f} ms | "
+              f"p95 {lat['p95']:.1f} ms | p99 {lat['p99']:.1f} ms | max {lat['max']:.1f} ms")
+        for labels, s in list(r['stages'].items())[:12]:
+            print(f"   {labels:<55} x{s['count']:<5} avg {s['avg_ms']:>9.2f} ms  total {s['total_seconds']:.3f} s")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='后端吞吐与延迟压测')
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS), help='逗号分隔：' + ','.join(ENDPOINTS))
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=50, help='每个接口的请求数')
+    parser.add_argument('--warmup', type=int, default=2, help='每个接口的预热请求数（不计入统计）')
+    parser.add_argument('--image-size', type=int, default=512, help='合成图片的边长（像素）')
+    parser.add_argument('--repeat-image', action='store_true', help='图片接口每次上传相同内容（测量存储去重与变体复用）')
+    parser.add_argument('--base-url', help='压测已运行的服务；不指定时在进程内创建应用')
+    parser.add_argument('--config', default='config.BenchmarkConfig', help='进程内应用使用的配置对象（默认 SQLite 内存库）')
+    parser.add_argument('--timeout', type=float, default=120.0, help='远程请求超时（秒）')
+    parser.add_argument('--output', help='将结果写入 JSON 文件')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'), help='对比两份 JSON 结果')
+    parser.add_argument('--threshold', type=float, default=0.10, help='判定退化的相对阈值')
+    add_settings_arguments(parser)
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return compare(args.compare[0], args.compare[1], args.threshold)
+
+    endpoints = [e.strip() for e in args.endpoints.split(',') if e.strip()]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"未知接口: {', '.join(sorted(unknown))}")
+
+    random.seed(0)
+    settings = settings_from_args(args)
+    mock_server = None
+    if args.base_url:
+        def make_client():
+            return HttpClient(args.base_url, args.timeout)
+    else:
+        mock_server, mock_url = start_server(settings=settings)
+        app = _create_in_process_app(args.config, mock_url)
+
+        def make_client():
+            return InProcessClient(app)
+
+    payloads = _build_payloads(args.image_size)
+    payloads['repeat_image'] = args.repeat_image
+    metrics_client = make_client()
+    results = {}
+    try:
+        for endpoint in endpoints:
+            # 预热（加载模型、建立连接、启动进程池），不计入统计
+            for _ in range(args.warmup):
+                _send(metrics_client, endpoint, payloads)
+            before = _parse_stage_metrics(metrics_client.get_text('/metrics'))
+            result = run_endpoint(make_client, endpoint, payloads, args.requests, args.concurrency)
+            after = _parse_stage_metrics(metrics_client.get_text('/metrics'))
+            result['stages'] = _stage_breakdown(before, after)
+            results[endpoint] = result
+    finally:
+        if mock_server is not None:
+            mock_server.shutdown()
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'target': args.base_url or 'in-process',
+        'concurrency': args.concurrency,
+        'requests_per_endpoint': args.requests,
+        'mock': vars(settings),
+        'results': results,
+    }
+    _print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已写入 {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
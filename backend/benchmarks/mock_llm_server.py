@@ -0,0 +1,235 @@
+# benchmarks/mock_llm_server.py
+"""
+本地模拟推理服务，同时兼容：
+  - OpenAI / DeepSeek：POST /chat/completions、/v1/chat/completions（支持 stream）
+  - Ollama 原生接口：POST /api/chat、/api/generate（NDJSON 流式或一次性返回）
+可配置首 token 延迟、生成速率与抖动，便于离线压测后端而不产生 API 费用。
+
+用法：
+    python -m benchmarks.mock_llm_server --port 18000 --latency 0.3 --token-rate 50
+然后将 DEEPSEEK_BASE_URL 与 INFERENCE_URL 指向 http://127.0.0.1:18000
+"""
+
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# 根据提示词返回结构正确的内容，使问卷、图片分析与分段评估的解析路径与真实调用一致
+SURVEY_REPLY = json.dumps({
+    "score": 35,
+    "risk_level": "low",
+    "analysis": "大部分回答处于低风险区间，整体心理状态较为稳定。",
+    "recommendations": ["保持规律作息", "适度运动", "与亲友保持沟通"]
+}, ensure_ascii=False)
+IMAGE_REPLY = json.dumps({
+    "emotion": "平静",
+    "analysis": "画面色彩柔和、线条平稳，未见明显的负面情绪线索。"
+}, ensure_ascii=False)
+SECTION_REPLY = json.dumps({
+    "content": "近期情绪以疲惫和兴趣减退为主，问卷结果提示轻度压力，整体仍在可自我调节的范围内。",
+    "confidence": 0.8
+}, ensure_ascii=False)
+TEXT_REPLY = (
+    "感谢你的分享。从你的描述来看，最近的压力主要来自工作节奏的变化。"
+    "建议你先梳理每天最重要的三件事，给自己留出固定的休息时间，"
+    "并尝试与信任的人聊聊你的感受。如果情绪持续低落，可以考虑寻求专业帮助。"
+)
+
+
+class MockSettings:
+    def __init__(self, latency=0.2, token_rate=100.0, jitter=0.0, chars_per_token=2, think_tokens=0):
+        self.latency = latency                  # 首 token 延迟（秒）
+        self.token_rate = token_rate            # 每秒生成 token 数，<=0 表示瞬时返回
+        self.jitter = jitter                    # 延迟的相对抖动（0-1）
+        self.chars_per_token = chars_per_token  # 每个 token 的字符数
+        self.think_tokens = think_tokens        # 在正文前输出的 <think> token 数（模拟推理模型）
+
+
+def _pick_reply(messages: list) -> str:
+    text = json.dumps(messages, ensure_ascii=False)
+    if 'confidence' in text:
+        return SECTION_REPLY
+    if 'risk_level' in text:
+        return SURVEY_REPLY
+    if 'emotion' in text:
+        return IMAGE_REPLY
+    return TEXT_REPLY
+
+
+def _prefilled_answer(messages: list) -> bool:
+    """最后一条是以 </think> 结尾的 assistant 预填内容时，模型直接续写正文"""
+    last = messages[-1] if messages else {}
+    return last.get('role') == 'assistant' and '</think>' in str(last.get('content', ''))
+
+
+def _tokens(settings: MockSettings, messages: list) -> list:
+    n = settings.chars_per_token
+    reply = _pick_reply(messages)
+    tokens = []
+    if settings.think_tokens and not _prefilled_answer(messages):
+        tokens.append('<think>')
+        tokens.extend(['嗯，'] * settings.think_tokens)
+        tokens.append('</think>')
+    tokens.extend(reply[i:i + n] for i in range(0, len(reply), n))
+    return tokens
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    settings = MockSettings()
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    # ----- 工具 -----
+    def _sleep(self, seconds: float):
+        if seconds <= 0:
+            return
+        jitter = self.settings.jitter
+        time.sleep(seconds * (1 + random.uniform(-jitter, jitter)))
+
+    def _token_delay(self) -> float:
+        return 1.0 / self.settings.token_rate if self.settings.token_rate > 0 else 0.0
+
+    def _send_json(self, data: dict, status: int = 200):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _start_stream(self, content_type: str):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _end_stream(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    # ----- 路由 -----
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+        path = self.path.rstrip('/')
+        try:
+            if path.endswith('/chat/completions'):
+                self._openai(body)
+            elif path == '/api/chat':
+                self._ollama(body, chat=True)
+            elif path == '/api/generate':
+                self._ollama(body, chat=False)
+            else:
+                self._send_json({'error': 'not found'}, 404)
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端提前断开（如结构化输出解析完成后停止生成）
+            pass
+
+    def _openai(self, body: dict):
+        messages = body.get('messages', [])
+        tokens = _tokens(self.settings, messages)
+        prompt_tokens = sum(len(str(m.get('content', ''))) for m in messages) // self.settings.chars_per_token
+        usage = {'prompt_tokens': prompt_tokens, 'completion_tokens': len(tokens),
+                 'total_tokens': prompt_tokens + len(tokens)}
+        model = body.get('model', 'mock')
+        self._sleep(self.settings.latency)
+
+        if not body.get('stream'):
+            self._sleep(self._token_delay() * len(tokens))
+            self._send_json({
+                'id': 'mock', 'object': 'chat.completion', 'created': int(time.time()), 'model': model,
+                'choices': [{'index': 0, 'finish_reason': 'stop',
+                             'message': {'role': 'assistant', 'content': ''.join(tokens)}}],
+                'usage': usage
+            })
+            return
+
+        self._start_stream('text/event-stream')
+        for token in tokens:
+            chunk = {'id': 'mock', 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                     'model': model, 'choices': [{'index': 0, 'delta': {'content': token}, 'finish_reason': None}]}
+            self._write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+            self._sleep(self._token_delay())
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._end_stream()
+
+    def _ollama(self, body: dict, chat: bool):
+        messages = body.get('messages') or [{'role': 'user', 'content': body.get('prompt', '')}]
+        tokens = _tokens(self.settings, messages)
+        prompt_tokens = sum(len(str(m.get('content', ''))) for m in messages) // self.settings.chars_per_token
+        model = body.get('model', 'mock')
+        self._sleep(self.settings.latency)
+
+        def piece(text: str, done: bool) -> dict:
+            data = {'model': model, 'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ'), 'done': done}
+            if chat:
+                data['message'] = {'role': 'assistant', 'content': text}
+            else:
+                data['response'] = text
+            if done:
+                data.update({'eval_count': len(tokens), 'prompt_eval_count': prompt_tokens})
+                if not chat:
+                    data['context'] = [1, 2, 3]
+            return data
+
+        if body.get('stream') is False:
+            self._sleep(self._token_delay() * len(tokens))
+            self._send_json(piece(''.join(tokens), True))
+            return
+
+        self._start_stream('application/x-ndjson')
+        for token in tokens:
+            self._write_chunk((json.dumps(piece(token, False), ensure_ascii=False) + '\n').encode('utf-8'))
+            self._sleep(self._token_delay())
+        self._write_chunk((json.dumps(piece('', True)) + '\n').encode('utf-8'))
+        self._end_stream()
+
+
+def start_server(host: str = '127.0.0.1', port: int = 0, settings: MockSettings = None):
+    """在后台线程启动模拟服务，返回 (server, base_url)；port=0 时自动分配端口"""
+    handler = type('ConfiguredMockHandler', (MockHandler,), {'settings': settings or MockSettings()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def add_settings_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--latency', type=float, default=0.2, help='首 token 延迟（秒）')
+    parser.add_argument('--token-rate', type=float, default=100.0, help='每秒生成 token 数，0 表示瞬时')
+    parser.add_argument('--jitter', type=float, default=0.0, help='延迟的相对抖动，0-1')
+    parser.add_argument('--think-tokens', type=int, default=0, help='正文前输出的 <think> token 数')
+
+
+def settings_from_args(args) -> MockSettings:
+    return MockSettings(latency=args.latency, token_rate=args.token_rate,
+                        jitter=args.jitter, think_tokens=args.think_tokens)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='OpenAI / Ollama 兼容的本地模拟推理服务')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=18000)
+    add_settings_arguments(parser)
+    args = parser.parse_args()
+
+    server, url = start_server(args.host, args.port, settings_from_args(args))
+    print(f"模拟推理服务已启动: {url}（Ctrl+C 退出）")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
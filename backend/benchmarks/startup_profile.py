@@ -0,0 +1,127 @@
+# benchmarks/startup_profile.py
+"""
+启动耗时分解：在子进程中以 python -X importtime 执行 create_app（可选再执行预热），
+输出总耗时、按顶层包汇总的导入耗时，以及 app.* 各模块的累计导入耗时。
+
+    python -m benchmarks.startup_profile
+    python -m benchmarks.startup_profile --warmup --top 15 --repeat 5 --output startup.json
+
+每次运行都是全新的解释器，结果对应 worker 冷启动；--repeat 取各项的中位数。
+"""
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from collections import defaultdict
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 子进程：计时 create_app 与预热，结果以 JSON 写到 stdout（importtime 写到 stderr）
+_CHILD = """
+import sys, json, time
+start = time.perf_counter()
+sys.path.insert(0, {backend!r})
+from app import create_app
+imported = time.perf_counter()
+create_app({config!r})
+created = time.perf_counter()
+warmup = {{}}
+if {warmup!r}:
+    from app.services.warmup import warm_up
+    warmup = warm_up()
+done = time.perf_counter()
+print(json.dumps({{
+    'import_app': imported - start, 'create_app': created - imported,
+    'warmup': warmup, 'total': done - start, 'modules': len(sys.modules),
+}}))
+"""
+
+
+def _parse_importtime(stderr: str) -> list:
+    """解析 -X importtime 输出，返回 [(模块名, 自身耗时秒, 累计耗时秒)]"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append((name.strip(), int(self_us) / 1e6, int(cumulative_us) / 1e6))
+    return rows
+
+
+def profile_once(config: str, warmup: bool) -> dict:
+    code = _CHILD.format(backend=BACKEND_DIR, config=config, warmup=warmup)
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                          cwd=BACKEND_DIR, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"子进程失败:\n{proc.stderr[-2000:]}")
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    rows = _parse_importtime(proc.stderr)
+
+    # 自身耗时按顶层包汇总，各包之和即全部导入耗时
+    packages = defaultdict(float)
+    for name, self_s, _ in rows:
+        packages[name.split('.')[0]] += self_s
+    result['packages'] = dict(packages)
+    result['app_modules'] = {name: cumulative for name, _, cumulative in rows
+                             if name == 'app' or name.startswith('app.')}
+    result['import_total'] = sum(packages.values())
+    return result
+
+
+def _median(runs: list, key: str) -> dict:
+    names = dict.fromkeys(name for run in runs for name in run[key])
+    return {name: statistics.median(run[key].get(name, 0.0) for run in runs) for name in names}
+
+
+def profile(config: str, warmup: bool, repeat: int) -> dict:
+    runs = [profile_once(config, warmup) for _ in range(repeat)]
+    return {
+        'config': config,
+        'repeat': repeat,
+        'python': sys.version.split()[0],
+        **{key: statistics.median(run[key] for run in runs)
+           for key in ('import_app', 'create_app', 'total', 'import_total', 'modules')},
+        'warmup': _median(runs, 'warmup'),
+        'packages': _median(runs, 'packages'),
+        'app_modules': _median(runs, 'app_modules'),
+    }
+
+
+def _print_report(report: dict, top: int):
+    print(f"启动总耗时 {report['total'] * 1000:.0f} ms（导入 app {report['import_app'] * 1000:.0f} ms，"
+          f"create_app {report['create_app'] * 1000:.0f} ms），已加载模块 {report['modules']:.0f} 个")
+    if report['warmup']:
+        print("\n== 预热步骤")
+        for name, seconds in report['warmup'].items():
+            print(f"   {name:<30} {seconds * 1000:>9.1f} ms")
+    print(f"\n== 按顶层包的导入耗时（合计 {report['import_total'] * 1000:.0f} ms）")
+    for name, seconds in sorted(report['packages'].items(), key=lambda kv: -kv[1])[:top]:
+        print(f"   {name:<30} {seconds * 1000:>9.1f} ms")
+    print("\n== app 模块累计导入耗时")
+    for name, seconds in sorted(report['app_modules'].items(), key=lambda kv: -kv[1])[:top]:
+        print(f"   {name:<40} {seconds * 1000:>9.1f} ms")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='应用启动耗时分解')
+    parser.add_argument('--config', default='config.BenchmarkConfig', help='create_app 使用的配置对象')
+    parser.add_argument('--warmup', action='store_true', help='create_app 之后执行预热并计时各步骤')
+    parser.add_argument('--repeat', type=int, default=3, help='运行次数，取中位数')
+    parser.add_argument('--top', type=int, default=20, help='每个表格显示的行数')
+    parser.add_argument('--output', help='将结果写入 JSON 文件')
+    args = parser.parse_args(argv)
+
+    report = profile(args.config, args.warmup, max(1, args.repeat))
+    _print_report(report, args.top)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已写入 {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
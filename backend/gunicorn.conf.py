@@ -0,0 +1,44 @@
+# gunicorn.conf.py
+# 启动：gunicorn -c gunicorn.conf.py wsgi:app
+#
+# master 进程预加载应用并完成预热（推理 SDK、Haar 分类器、题库等），冻结 GC 后再 fork，
+# worker 以写时复制共享这些只读数据，首个请求不再承担冷启动；
+# fork 之后每个 worker 重建自己的日志线程、网络客户端与数据库连接池。
+
+import os
+
+bind             = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+# 默认单个 worker：以下状态都在进程内，多个 worker 时各自独立——
+#   - 后台任务（job_queue）：提交与查询落到不同 worker 时返回 404；
+#   - 推理并发上限（LLM_MAX_CONCURRENCY_*）、请求合并、路由的 token 上限：实际值为配置值 × worker 数。
+# 在这些状态改为共享存储之前，通过 GUNICORN_THREADS 扩展并发；
+# 确需多个 worker 时（且不使用 /async 接口），应将上述上限按 worker 数等比缩小。
+# 图片预处理等 CPU 密集步骤已在独立的进程池中执行，不受单个 worker 的 GIL 限制。
+workers          = int(os.getenv('GUNICORN_WORKERS', '1'))
+# 请求大多在等待推理服务，用线程并发处理
+worker_class     = 'gthread'
+threads          = int(os.getenv('GUNICORN_THREADS', '16'))
+timeout          = int(os.getenv('GUNICORN_TIMEOUT', '180'))       # 大于推理调用的最长耗时
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive        = 5
+# 定期替换 worker 以限制内存增长；预加载后 fork 新 worker 的代价很小
+max_requests        = int(os.getenv('GUNICORN_MAX_REQUESTS', '0'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '50'))
+
+preload_app      = True
+# 日志由应用自己的队列线程写出（见 app/services/logging_setup.py）
+accesslog        = os.getenv('GUNICORN_ACCESS_LOG')   # 为空时不记录访问日志
+
+
+def when_ready(server):
+    """master 已加载应用、开始监听，fork worker 之前"""
+    from app.services.warmup import prepare_fork
+    if server.cfg.workers > 1:
+        server.log.warning("GUNICORN_WORKERS=%d：后台任务查询可能返回 404，推理并发与 token 上限按 worker 数放大",
+                           server.cfg.workers)
+    prepare_fork()
+
+
+def post_fork(server, worker):
+    from app.services.warmup import after_fork
+    after_fork(server.app.wsgi())
@@ -1,3 +1,4 @@
+# 开发服务器入口；生产部署使用 gunicorn -c gunicorn.conf.py wsgi:app（预加载、预热与 fork 后重建）
 from app import create_app
 
 app = create_app()